@@ -0,0 +1,468 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from geomsimplify import GeomSimplify
+from eliminationengine import EliminationEngine
+from incrementalstate import arc_digest
+from rankstore import RankStore
+from shapely.geometry import (
+    LineString,
+    Polygon,
+    MultiLineString,
+    MultiPolygon,
+)
+
+# Points of the arcs simplified between two checkpoint saves (see simplify_points)
+checkpoint_points = 1000000
+
+
+class ArcStore(object):
+    """
+    ArcStore - the unique arcs of a layer, shared by the features that border each other.
+
+    Like TopoJSON: every line and polygon exterior ring is cut into arcs at the junctions,
+    and each arc is stored once, keyed by its full sequence of quantized points (in either
+    direction). Features reference their arcs by signed ids, where ~id means the arc is
+    used backwards.
+
+        arcs = list of the points of every unique arc
+        features = (geometry type name, parts) for every feature, where a part is
+            a list of arc ids (a line), or
+            (list of arc ids or None, polygon) (a polygon; None if its exterior ring has
+            no junctions, the ring is then simplified on its own)
+
+    simplify() runs the elimination once per unique arc, so a border between two polygons
+    is simplified once and is identical on both sides by construction. Arcs do not depend
+    on each other, so with Workers > 1 they are split between processes that read the
+    coordinates from shared memory (see simplify_shared_arcs). With a Checkpoint the
+    arcs are simplified in runs of about checkpoint_points points, and the keep mask of
+    every run is saved, so a resumed run starts after the last run saved.
+    """
+
+    def __init__(self, simplify):
+        # GeomSimplify with the junctions of the layer
+        self.geomSimplify = simplify
+        self.arcs = []
+        self.dictArcIds = {}
+        self.features = []
+
+    @staticmethod
+    def build(shapes, simplify, ringShapes=None):
+        """
+        Cuts every shape of 'shapes' into arcs at the junctions of 'simplify'.
+
+        The artificial junctions that keep small polygons from collapsing (see
+        GeomSimplify.add_junctions_to_ring) are all added first, in feature order, so every
+        ring is cut with the same junctions. They are added for the rings of 'ringShapes'
+        if it is given (a tile and its neighbors, see TileGrid), else of 'shapes'.
+        """
+        simplify.add_junctions_to_shapes(
+            shapes if ringShapes is None else ringShapes, simplify.dictJunctions
+        )
+
+        arcStore = ArcStore(simplify)
+        for myShape in shapes:
+            arcStore.append(myShape)
+        return arcStore
+
+    def add_arc(self, arc):
+        """
+        Returns the signed id of an arc (a LineString), adding it if it is new.
+        """
+        points = list(arc.coords)
+        key = tuple(self.geomSimplify.quantitize_grid(point) for point in points)
+        reverseKey = key[::-1]
+
+        if reverseKey < key:
+            key = reverseKey
+            points.reverse()
+            isReversed = True
+        else:
+            isReversed = False
+
+        arcId = self.dictArcIds.get(key)
+        if arcId is None:
+            arcId = len(self.arcs)
+            self.dictArcIds[key] = arcId
+            self.arcs.append(points)
+
+        return ~arcId if isReversed else arcId
+
+    def append_line(self, line):
+        dictJunctions = self.geomSimplify.dictJunctions
+        if dictJunctions:
+            arcList = self.geomSimplify.cut_line_by_junctions(line, dictJunctions)
+        else:
+            arcList = [line]
+        return [self.add_arc(arc) for arc in arcList]
+
+    def append_polygon(self, polygon):
+        dictJunctions = self.geomSimplify.dictJunctions
+        if not dictJunctions:
+            return (None, polygon)
+
+        arcList, polygon = self.geomSimplify.cut_polygon_by_junctions(
+            polygon, dictJunctions
+        )
+        if arcList is None:  # No junctions on polygon exterior ring
+            return (None, polygon)
+        return ([self.add_arc(arc) for arc in arcList], polygon)
+
+    def append(self, myShape):
+        if isinstance(myShape, LineString):
+            parts = [self.append_line(myShape)]
+        elif isinstance(myShape, MultiLineString):
+            parts = [self.append_line(line) for line in myShape.geoms]
+        elif isinstance(myShape, Polygon):
+            parts = [self.append_polygon(myShape)]
+        elif isinstance(myShape, MultiPolygon):
+            parts = [self.append_polygon(polygon) for polygon in myShape.geoms]
+        else:
+            raise ValueError("Unhandled geometry type: " + repr(myShape.geom_type))
+
+        self.features.append((myShape.geom_type, parts))
+
+    def __len__(self):
+        return len(self.features)
+
+    def simplify_arcs(self, threshold, Workers=1, arcCache=None, checkpoint=None):
+        """
+        Simplifies every unique arc in one batch (or Workers batches run in parallel,
+        unless the arcs are checked for intersections). Returns a list with the
+        simplified LineString of every arc.
+
+        With 'arcCache' (a dictionary of arc_digest: simplified LineString, for this
+        threshold) only the arcs missing from it are simplified, and added to it.
+        With 'checkpoint' (a Checkpoint) the keep masks are saved run by run, and the
+        runs saved earlier are loaded instead of simplified.
+        """
+        if arcCache is None:
+            return self.simplify_points(self.arcs, threshold, Workers, checkpoint)
+
+        digests = [arc_digest(points) for points in self.arcs]
+        missing = {}
+        for digest, points in zip(digests, self.arcs):
+            if digest not in arcCache:
+                missing.setdefault(digest, points)
+        arcCache.update(
+            zip(
+                missing,
+                self.simplify_points(
+                    list(missing.values()), threshold, Workers, checkpoint
+                ),
+            )
+        )
+        return [arcCache[digest] for digest in digests]
+
+    def simplify_points(self, arcs, threshold, Workers=1, checkpoint=None):
+        # Simplifies the arcs of 'arcs' (lists of points), see simplify_arcs
+        if not arcs:
+            return []
+
+        counts = [len(points) for points in arcs]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        coords = np.array(
+            [point[:2] for points in arcs for point in points], dtype=np.float64
+        )
+        if checkpoint is None or self.geomSimplify.preventIntersections:
+            # All the arcs are one set when they are checked against each other
+            runs = [0, len(arcs)]
+        else:
+            runs = partition_arcs(offsets, -(-len(coords) // checkpoint_points))
+
+        restored = checkpoint.chunk_count() if checkpoint is not None else 0
+        keep = np.zeros(len(coords), dtype=bool)
+        for index, (start, stop) in enumerate(zip(runs[:-1], runs[1:])):
+            points = slice(offsets[start], offsets[stop])
+            runKeep = checkpoint.load_mask(index) if index < restored else None
+            if runKeep is None:
+                runKeep = self.keep_mask(
+                    coords[points],
+                    offsets[start : stop + 1] - offsets[start],
+                    threshold,
+                    Workers,
+                )
+                if checkpoint is not None:
+                    checkpoint.save_mask(index, runKeep)
+            keep[points] = runKeep
+
+        arcOfCoord = np.repeat(np.arange(len(arcs)), counts)
+        return list(shapely.linestrings(coords[keep], indices=arcOfCoord[keep]))
+
+    def feature_arcs(self):
+        """
+        Returns a list with the digests of the arcs of every feature (see arc_digest),
+        each arc once. The rings simplified on their own have no arcs.
+        """
+        digests = [arc_digest(points) for points in self.arcs]
+        featureArcs = []
+        for geomType, parts in self.features:
+            if geomType in ("LineString", "MultiLineString"):
+                arcIds = [arcId for part in parts for arcId in part]
+            else:
+                arcIds = [
+                    arcId for part, _ in parts if part is not None for arcId in part
+                ]
+            featureArcs.append(
+                list(
+                    dict.fromkeys(
+                        digests[arcId if arcId >= 0 else ~arcId] for arcId in arcIds
+                    )
+                )
+            )
+        return featureArcs
+
+    def keep_mask(self, coords, offsets, threshold, Workers=1):
+        # Returns the keep mask of the arcs in 'coords'/'offsets' (see simplify_batch)
+        if self.geomSimplify.preventIntersections:
+            # All the arcs are one set, checked against each other in one engine
+            return self.geomSimplify.simplify_batch(
+                coords, offsets, threshold, groups=0
+            )
+        if Workers > 1:
+            return simplify_shared_arcs(
+                coords, offsets, threshold, Workers, self.geomSimplify.prefilter
+            )
+        return self.geomSimplify.simplify_batch(coords, offsets, threshold)
+
+    def simplify(self, threshold, Workers=1, arcCache=None, checkpoint=None):
+        """
+        Returns a list with the simplified shape of every feature (None where
+        simplification removed the feature), the same shapes the simplify_*_topology
+        methods of GeomSimplify return. With Workers > 1 the arcs are simplified in a
+        pool of that many processes; rings without junctions are still simplified here.
+        The arcs of 'arcCache' are reused, and the arcs are checkpointed run by run in
+        'checkpoint' (see simplify_arcs).
+        """
+        simpleArcs = self.simplify_arcs(threshold, Workers, arcCache, checkpoint)
+        simplify = self.geomSimplify
+
+        def arc_lines(arcIds):
+            return [
+                (
+                    simpleArcs[arcId]
+                    if arcId >= 0
+                    else simplify.reverse_arc(simpleArcs[~arcId])
+                )
+                for arcId in arcIds
+            ]
+
+        def polygon(arcIds, polygon):
+            if arcIds is None:
+                simpleExtRing = simplify.simplify_ring(
+                    polygon.exterior, threshold, simplify.dictJunctions
+                )
+            else:
+                simpleExtRing = simplify.create_ring_from_arcs(arc_lines(arcIds))
+
+            # If the exterior ring was removed by simplification, return None
+            if simpleExtRing is None:
+                return None
+
+            simpleIntRings = []
+            for ring in polygon.interiors:
+                simpleRing = simplify.simplify_ring(
+                    ring, threshold, simplify.dictJunctions
+                )
+                if simpleRing is not None:
+                    simpleIntRings.append(simpleRing)
+            return Polygon(simpleExtRing, simpleIntRings)
+
+        simplifiedShapes = []
+        for geomType, parts in self.features:
+            if geomType == "LineString":
+                lines = arc_lines(parts[0])
+                simpleShape = lines[0] if len(lines) == 1 else MultiLineString(lines)
+            elif geomType == "MultiLineString":
+                simpleShape = MultiLineString(
+                    [line for arcIds in parts for line in arc_lines(arcIds)]
+                )
+            elif geomType == "Polygon":
+                simpleShape = polygon(*parts[0])
+            else:
+                polygons = [polygon(*part) for part in parts]
+                polygons = [simplePoly for simplePoly in polygons if simplePoly]
+                simpleShape = MultiPolygon(polygons) if polygons else None
+            simplifiedShapes.append(simpleShape)
+
+        return simplifiedShapes
+
+    def rank_store(self, source=""):
+        """
+        Returns a RankStore with the features of the store, so they can be simplified for
+        any threshold. Every unique arc is ranked once, in the direction it is kept in,
+        and the features use those ranks: both sides of a border keep the same points for
+        any threshold, and a threshold gives the shapes simplify() returns. Rings without
+        junctions and interior rings are ranked on their own.
+        """
+        simplify = self.geomSimplify
+        rankStore = RankStore(source)
+
+        arcIndices = []
+        if self.arcs:
+            counts = [len(points) for points in self.arcs]
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            coords = np.array(
+                [point[:2] for points in self.arcs for point in points],
+                dtype=np.float64,
+            )
+            areas = simplify.rank_lines(coords, offsets)
+
+            # The junction at the ends of several arcs is one ranked point
+            junctions = {}
+
+            def junction(point):
+                point = tuple(point.tolist())
+                index = junctions.get(point)
+                if index is None:
+                    index = rankStore.add_points([point], [np.inf])[0]
+                    junctions[point] = index
+                return index
+
+            for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+                indices = [junction(coords[start])]
+                indices.extend(
+                    rankStore.add_points(
+                        coords[start + 1 : stop - 1], areas[start + 1 : stop - 1]
+                    )
+                )
+                indices.append(junction(coords[stop - 1]))
+                arcIndices.append(indices)
+
+        def arc_points(arcId):
+            return arcIndices[arcId] if arcId >= 0 else arcIndices[~arcId][::-1]
+
+        def ranked_ring(ring):
+            points, areas, isRing = simplify.rank_ring(ring, simplify.dictJunctions)
+            return (rankStore.add_points(points, areas), isRing)
+
+        def polygon(arcIds, polygon):
+            if arcIds is None:
+                chains = [ranked_ring(polygon.exterior)]
+            else:
+                # Stitched like create_ring_from_arcs, without the closing point
+                points = list(arc_points(arcIds[0]))
+                for arcId in arcIds[1:]:
+                    points.extend(arc_points(arcId)[1:])
+                chains = [(points[:-1], True)]
+            chains.extend(ranked_ring(ring) for ring in polygon.interiors)
+            return chains
+
+        for geomType, parts in self.features:
+            if geomType in ("LineString", "MultiLineString"):
+                # Every arc of a line is a line of its own
+                chains = [
+                    [(arc_points(arcId), False)] for arcIds in parts for arcId in arcIds
+                ]
+                if len(chains) > 1:
+                    geomType = "MultiLineString"
+            else:
+                chains = [polygon(*part) for part in parts]
+            rankStore.append_chains(geomType, chains)
+
+        rankStore.finish()
+        return rankStore
+
+    def simplify_to_budget(self, budget, perFeature=False):
+        """
+        Simplifies the features to a vertex budget instead of an area threshold (see
+        RankStore.threshold_for_budget). Returns a NumPy object array of the simplified
+        shapes (None where a shape was removed). Junctions are always kept and count
+        towards the budget, and a border counts once.
+        """
+        rankStore = self.rank_store()
+        return rankStore.extract(rankStore.threshold_for_budget(budget, perFeature))
+
+
+def partition_arcs(offsets, parts):
+    """
+    Splits the arcs into at most 'parts' runs of consecutive arcs with about the same
+    number of points. Returns the arc index where each run starts, plus the arc count.
+    """
+    targets = np.linspace(0, offsets[-1], parts + 1)
+    bounds = np.searchsorted(offsets, targets)
+    bounds[0], bounds[-1] = 0, len(offsets) - 1
+    return np.unique(bounds)
+
+
+def simplify_shared_arcs(coords, offsets, threshold, Workers, prefilter=None):
+    """
+    Simplifies the arcs in 'coords'/'offsets' (the layout of GeomSimplify.simplify_batch)
+    in a pool of 'Workers' processes, after the 'prefilter' pre-pass (see
+    GeomSimplify.prefilter_chains). Returns the same mask simplify_batch does.
+
+    The coordinates and offsets are copied once into shared memory blocks; every task
+    only gets their names and a range of arcs, and returns the keep mask of its points.
+    Each arc is eliminated on its own, so the result does not depend on the split.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    blocks = []
+    try:
+        names = []
+        for array in (coords, offsets):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+            names.append(block.name)
+
+        # A few runs per worker, so one slow run does not leave the others idle
+        bounds = partition_arcs(offsets, 4 * Workers)
+        runs = list(zip(bounds[:-1], bounds[1:]))
+        keep = np.zeros(len(coords), dtype=bool)
+        with ProcessPoolExecutor(Workers) as pool:
+            futures = [
+                pool.submit(
+                    simplify_arc_range,
+                    names,
+                    len(coords),
+                    len(offsets),
+                    start,
+                    stop,
+                    threshold,
+                    prefilter,
+                )
+                for start, stop in runs
+            ]
+            for (start, stop), future in zip(runs, futures):
+                keep[offsets[start] : offsets[stop]], heapOperations = future.result()
+                EliminationEngine.heapOperations += heapOperations
+        return keep
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def simplify_arc_range(
+    names, coordCount, offsetCount, start, stop, threshold, prefilter=None
+):
+    """
+    Runs in a pool process: simplifies arcs start..stop-1 read from the shared memory
+    blocks named 'names' (coordinates, then offsets). Returns their keep mask and the
+    number of heap operations.
+    """
+    coordsBlock = shared_memory.SharedMemory(name=names[0])
+    offsetsBlock = shared_memory.SharedMemory(name=names[1])
+    try:
+        sharedCoords = np.ndarray((coordCount, 2), np.float64, buffer=coordsBlock.buf)
+        sharedOffsets = np.ndarray((offsetCount,), np.int64, buffer=offsetsBlock.buf)
+
+        # Copy out this range, no view may outlive the blocks
+        offsets = np.array(sharedOffsets[start : stop + 1])
+        coords = np.array(sharedCoords[offsets[0] : offsets[-1]])
+        del sharedCoords, sharedOffsets
+    finally:
+        coordsBlock.close()
+        offsetsBlock.close()
+
+    heapOperations = EliminationEngine.heapOperations
+    keep = GeomSimplify(prefilter=prefilter).simplify_batch(
+        coords, offsets - offsets[0], threshold
+    )
+    return keep, EliminationEngine.heapOperations - heapOperations
@@ -3,6 +3,12 @@
 
 __author__ = "asimmons"
 
+# Grid points are packed as two signed 32 bit integers into 64 bits, and an arc key is
+# two packed points in 128 bits
+MASK_32 = (1 << 32) - 1
+MASK_64 = (1 << 64) - 1
+GRID_LIMIT = 1 << 31
+
 
 class ArcThreshold(object):
     """
@@ -16,3 +22,52 @@ class ArcThreshold(object):
             return str(start) + "_" + str(end)
         else:
             return str(end) + "_" + str(start)
+
+    @staticmethod
+    def get_point_key(point):
+        # Packs an integer grid point (x, y) into a single unsigned 64 bit integer
+        x, y = point
+        if not (-GRID_LIMIT <= x < GRID_LIMIT and -GRID_LIMIT <= y < GRID_LIMIT):
+            raise ValueError(
+                "Grid point out of the 32 bit range of arc keys, use a larger "
+                "quantization factor: " + repr(point)
+            )
+        return ((x & MASK_32) << 32) | (y & MASK_32)
+
+    @staticmethod
+    # Should return the same value even if start and end are switched
+    def get_key(start, end):
+        """
+        Returns an integer key for the arc between the integer grid points 'start' and 'end'
+        (see GeomSimplify.quantitize_grid): both packed points in 128 bits, the smaller
+        one first. Unlike get_string no strings are built, and the key hashes as a
+        single int.
+        """
+        startKey = ArcThreshold.get_point_key(start)
+        endKey = ArcThreshold.get_point_key(end)
+        if startKey < endKey:
+            return (startKey << 64) | endKey
+        else:
+            return (endKey << 64) | startKey
+
+    @staticmethod
+    def split_point_key(pointKey):
+        # Unpacks get_point_key back into the integer grid point (x, y)
+        x = pointKey >> 32
+        y = pointKey & MASK_32
+        if x >= GRID_LIMIT:
+            x -= 1 << 32
+        if y >= GRID_LIMIT:
+            y -= 1 << 32
+        return (x, y)
+
+    @staticmethod
+    def split_key(key):
+        """
+        Returns the two integer grid points of a key made by get_key, the smaller one
+        first. get_key(*split_key(key)) == key.
+        """
+        return (
+            ArcThreshold.split_point_key(key >> 64),
+            ArcThreshold.split_point_key(key & MASK_64),
+        )
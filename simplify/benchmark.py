@@ -0,0 +1,425 @@
+__author__ = "asimmons"
+
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import multiprocessing
+import fiona
+import numpy as np
+import shapely
+import simplify_topology
+from shapely.geometry import mapping, box
+from simplify_topology import SimplifyProcess
+from featureio import read_batches
+from optparse import OptionParser
+
+################################################################################################################################################
+# 1) This script benchmarks SimplifyProcess.process_file on reproducible synthetic inputs:                                                     #
+#     voronoi   = a mosaic of Voronoi cells with noisy shared borders (size = number of cells)                                                 #
+#     coastline = one long noisy island ring (size = number of vertices / 100)                                                                 #
+#     staircase = regions of a raster, polygonized along the pixel edges (size = number of regions, about 100 pixels each)                    #
+#                                                                                                                                              #
+# 2) Every input is simplified in each mode:                                                                                                   #
+#     plain    = no topology                                                                                                                   #
+#     topology = topology preserved                                                                                                            #
+#     dynamic  = topology preserved, one threshold per iso3 (the features are split into 3 iso3 bands)                                         #
+#                                                                                                                                              #
+# 3) Each run happens in a fresh process, so its peak RSS is its own. Time, throughput (input vertices per second), peak RSS and the output    #
+#    vertex count (plus the phases of the fastest run, see Metrics) are written as JSON. -c compares the report with an earlier one.          #
+#                                                                                                                                              #
+################################################################################################################################################
+
+CASES = ("voronoi", "coastline", "staircase")
+MODES = ("plain", "topology", "dynamic")
+
+# Grid the synthetic inputs are rounded to, in map units. Far above the quantization of
+# topology mode (1 unit, see GeomSimplify.quantitizationFactor), so two points of a
+# shape never quantize to the same value.
+GRID = 5.0
+
+# Spacing between the points of a synthetic input, in map units
+SPACING = 4 * GRID
+
+# Threshold of the plain and topology modes: removes the small waves and pixel steps of
+# the synthetic inputs but keeps their overall shape
+THRESHOLD = SPACING * SPACING
+
+# Thresholds of the dynamic mode, relative to THRESHOLD
+ISO_THRESHOLDS = {"AAA": 0.5, "BBB": 1.0, "CCC": 2.0}
+
+
+def voronoi_mosaic(cellCount, seed=0):
+    """
+    Returns a mosaic of 'cellCount' Voronoi cells about 10 * SPACING wide. The borders are
+    cut into segments of SPACING and bent by a smooth warp of the plane (see warp), so
+    both sides of a border stay identical and no ring crosses itself.
+    """
+    rng = np.random.default_rng(seed)
+    extent = 10 * SPACING * np.sqrt(cellCount)
+    square = box(0, 0, extent, extent)
+    points = shapely.multipoints(rng.uniform(0, extent, (cellCount, 2)))
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=square))
+    cells = shapely.intersection(cells, square)
+
+    cells = shapely.segmentize(cells, SPACING)
+    cells = shapely.transform(cells, lambda coords: warp(coords, 5 * SPACING))
+    return shapely.set_precision(cells, GRID)
+
+
+def warp(coords, wavelength):
+    # Moves every point by a smooth wave that only depends on where it is. The wave is
+    # gentle enough (slope below 1/2) that the warp never folds the plane.
+    amplitude = wavelength / (8 * np.pi)
+    phase = 2 * np.pi * coords / wavelength
+    return np.column_stack(
+        (
+            coords[:, 0] + amplitude * np.sin(phase[:, 1] + 1.3),
+            coords[:, 1] + amplitude * np.sin(phase[:, 0] + 0.7),
+        )
+    )
+
+
+def noisy_coastline(vertexCount, seed=0):
+    """
+    Returns one island with 'vertexCount' vertices. The radius at every angle is a sum
+    of random harmonics plus jitter, always positive, so the ring never crosses itself.
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, vertexCount, endpoint=False)
+    radius = np.ones(vertexCount)
+    for harmonic in range(1, 65):
+        amplitude = rng.uniform(0, 0.15) / harmonic
+        radius += amplitude * np.sin(harmonic * angles + rng.uniform(0, 2 * np.pi))
+    # Points about SPACING apart where the radius is smallest
+    radius *= SPACING * vertexCount / (2 * np.pi * radius.min())
+    radius += rng.uniform(-SPACING, SPACING, vertexCount)
+
+    coords = np.column_stack((radius * np.cos(angles), radius * np.sin(angles)))
+    coords -= coords.min(axis=0)
+    return shapely.set_precision(
+        np.array([shapely.polygons(coords)], dtype=object), GRID
+    )
+
+
+def staircase_polygons(regionCount, seed=0):
+    """
+    Returns the regions of a raster of about 100 pixels (of SPACING) per region, each
+    polygonized along its pixel edges (like gdal.Polygonize). Every pixel belongs to the
+    nearest of 'regionCount' random seeds.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(regionCount * 100)))
+    seeds = rng.uniform(0, side, (regionCount, 2))
+
+    rows, columns = np.mgrid[0:side, 0:side]
+    corners = np.column_stack((columns.ravel(), rows.ravel())).astype(np.float64)
+    labels = nearest_seed(corners + 0.5, seeds)
+
+    corners *= SPACING
+    pixels = shapely.box(
+        corners[:, 0], corners[:, 1], corners[:, 0] + SPACING, corners[:, 1] + SPACING
+    )
+    order = np.argsort(labels, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+    regions = [shapely.coverage_union_all(pixels[group]) for group in groups]
+    return np.array(regions, dtype=object)
+
+
+def nearest_seed(points, seeds, chunk=65536):
+    # Returns the index of the nearest seed of every point
+    tree = shapely.STRtree(shapely.points(seeds))
+    labels = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk):
+        inputIndex, treeIndex = tree.query_nearest(
+            shapely.points(points[start : start + chunk]), all_matches=False
+        )
+        labels[start + inputIndex] = treeIndex
+    return labels
+
+
+GENERATORS = {
+    "voronoi": voronoi_mosaic,
+    "coastline": lambda size, seed=0: noisy_coastline(size * 100, seed),
+    "staircase": staircase_polygons,
+}
+
+
+def write_input(directory, case, size, seed=0):
+    """
+    Writes the synthetic input (case, size) to 'directory', unless it is already there.
+    Returns the shapefile path and the dynamic threshold CSV path.
+    """
+    name = case + "_" + str(size) + "_" + str(seed)
+    inFile = os.path.join(directory, name + ".shp")
+    csvFile = os.path.join(directory, name + ".csv")
+    if os.path.exists(inFile) and os.path.exists(csvFile):
+        return inFile, csvFile
+
+    shapes = GENERATORS[case](size, seed)
+    # Three iso3 bands from west to east
+    minX, minY, maxX, maxY = shapely.total_bounds(shapes)
+    centers = shapely.get_x(shapely.centroid(shapes))
+    isoCodes = sorted(ISO_THRESHOLDS)
+    bands = np.minimum(((centers - minX) / (maxX - minX) * 3).astype(int), 2)
+
+    schema = {"geometry": "Polygon", "properties": {"id": "int", "iso3": "str:3"}}
+    with fiona.open(inFile, "w", "ESRI Shapefile", schema) as output:
+        output.writerecords(
+            {
+                "geometry": mapping(myShape),
+                "properties": {"id": index, "iso3": isoCodes[band]},
+            }
+            for index, (myShape, band) in enumerate(zip(shapes, bands))
+        )
+
+    with open(csvFile, "w") as output:
+        for iso3 in isoCodes:
+            output.write(iso3 + "," + repr(THRESHOLD * ISO_THRESHOLDS[iso3]) + "\n")
+    return inFile, csvFile
+
+
+def count_vertices(inFile):
+    # Returns the number of features and vertices of 'inFile'
+    features = 0
+    vertices = 0
+    for shapes, _ in read_batches(inFile, simplify_topology.batch_size):
+        features += len(shapes)
+        vertices += int(shapely.get_num_coordinates(shapes).sum())
+    return features, vertices
+
+
+def run_case(inFile, csvFile, mode, directory, repeat=1):
+    """
+    Simplifies 'inFile' in 'mode' 'repeat' times (in this process) and returns the
+    measurements of the fastest run.
+    """
+    features, vertices = count_vertices(inFile)
+    outFile = os.path.join(directory, "output_" + mode + ".shp")
+
+    simplify_topology.debug = False
+    seconds = []
+    phases = None
+    for run in range(repeat):
+        process = SimplifyProcess()
+        start = time.perf_counter()
+        if mode == "plain":
+            process.process_file(inFile, outFile, THRESHOLD)
+        elif mode == "topology":
+            process.process_file(inFile, outFile, THRESHOLD, True)
+        elif mode == "dynamic":
+            process.process_file(inFile, outFile, None, True, csvFile)
+        else:
+            raise ValueError("Unknown mode: " + repr(mode))
+        seconds.append(time.perf_counter() - start)
+        report = process.metrics.report()
+        if seconds[-1] == min(seconds):
+            phases = report["phases"]
+
+    outFeatures, outVertices = count_vertices(outFile)
+    return {
+        "input": os.path.splitext(os.path.basename(inFile))[0],
+        "mode": mode,
+        "threshold": None if mode == "dynamic" else THRESHOLD,
+        "features": features,
+        "vertices_in": vertices,
+        "features_out": outFeatures,
+        "vertices_out": outVertices,
+        "repaired": report["counts"]["repaired"],
+        "heap_operations": report["counts"]["heap_operations"],
+        "seconds": min(seconds),
+        "phases": phases,
+        "vertices_per_second": vertices / min(seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    return peak / 1024.0
+
+
+def measure_case(inFile, csvFile, mode, directory, repeat=1):
+    """
+    Runs run_case in a fresh process, so the peak RSS is that of the run alone.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, (inFile, csvFile, mode, directory, repeat))
+
+
+def compare_reports(baseline, report):
+    """
+    Returns one line per result of 'report' that is also in 'baseline': the time, peak
+    RSS and output vertices of both, and the ratio of the times (new / old).
+    """
+    old = {(result["input"], result["mode"]): result for result in baseline["results"]}
+    lines = []
+    for result in report["results"]:
+        key = (result["input"], result["mode"])
+        if key not in old:
+            continue
+        before = old[key]
+        if "error" in before or "error" in result:
+            lines.append(
+                "%-24s %-9s %s -> %s"
+                % (
+                    key[0],
+                    key[1],
+                    before.get("error", "ok"),
+                    result.get("error", "ok"),
+                )
+            )
+            continue
+        line = "%-24s %-9s %8.3fs -> %8.3fs (x%.2f)  %7.1f -> %7.1f MB" % (
+            key[0],
+            key[1],
+            before["seconds"],
+            result["seconds"],
+            result["seconds"] / before["seconds"],
+            before["peak_rss_mb"],
+            result["peak_rss_mb"],
+        )
+        if before["vertices_out"] != result["vertices_out"]:
+            line += "  vertices %d -> %d" % (
+                before["vertices_out"],
+                result["vertices_out"],
+            )
+        lines.append(line)
+    return lines
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-o",
+        "--output_file",
+        dest="outputFile",
+        help="JSON report (default: print it)",
+        metavar="FILE",
+    )
+    parser.add_option(
+        "-d",
+        "--directory",
+        dest="directory",
+        help="Directory of the synthetic inputs, reused between runs (default: a "
+        "temporary directory)",
+        metavar="DIR",
+    )
+    parser.add_option(
+        "-s",
+        "--sizes",
+        dest="sizes",
+        default="1000,10000",
+        help="Comma separated sizes of every input (default 1000,10000)",
+    )
+    parser.add_option(
+        "--cases",
+        dest="cases",
+        default=",".join(CASES),
+        help="Comma separated inputs among " + ", ".join(CASES),
+    )
+    parser.add_option(
+        "-m",
+        "--modes",
+        dest="modes",
+        default=",".join(MODES),
+        help="Comma separated modes among " + ", ".join(MODES),
+    )
+    parser.add_option(
+        "--repeat",
+        dest="repeat",
+        type="int",
+        default=1,
+        help="Runs of every case, the fastest one is kept (default 1)",
+    )
+    parser.add_option(
+        "--seed",
+        dest="seed",
+        type="int",
+        default=0,
+        help="Seed of the synthetic inputs (default 0)",
+    )
+    parser.add_option(
+        "-c",
+        "--compare",
+        dest="compare",
+        help="Earlier JSON report to compare with",
+        metavar="FILE",
+    )
+
+    options, args = parser.parse_args()
+
+    directory = options.directory or tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    sizes = [int(size) for size in options.sizes.split(",")]
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shapely": shapely.__version__,
+        "numpy": np.__version__,
+        "results": [],
+    }
+    try:
+        for case in options.cases.split(","):
+            for size in sizes:
+                inFile, csvFile = write_input(directory, case, size, options.seed)
+                for mode in options.modes.split(","):
+                    try:
+                        result = measure_case(
+                            inFile, csvFile, mode, directory, options.repeat
+                        )
+                    except Exception as error:
+                        # Recorded, so a mode that stops (or starts) working shows up
+                        result = {
+                            "input": os.path.splitext(os.path.basename(inFile))[0],
+                            "mode": mode,
+                            "error": repr(error),
+                        }
+                        print("%-24s %-9s failed: %r" % (result["input"], mode, error))
+                        report["results"].append(result)
+                        continue
+
+                    report["results"].append(result)
+                    print(
+                        "%-24s %-9s %8.3fs %12.0f vertices/s %7.1f MB"
+                        % (
+                            result["input"],
+                            mode,
+                            result["seconds"],
+                            result["vertices_per_second"],
+                            result["peak_rss_mb"],
+                        )
+                    )
+    finally:
+        # Inputs written to a temporary directory are not kept
+        if not options.directory:
+            shutil.rmtree(directory)
+
+    if options.outputFile:
+        with open(options.outputFile, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if options.compare:
+        with open(options.compare, "r") as input:
+            baseline = json.load(input)
+        for line in compare_reports(baseline, report):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
+
+# example usage:
+# python benchmark.py -o benchmark.json -d benchmark_inputs -s 1000,10000,100000
+# python benchmark.py -o benchmark_new.json -d benchmark_inputs -c benchmark.json
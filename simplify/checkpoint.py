@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import glob
+import os
+import numpy as np
+import shapely
+from arcthreshold import ArcThreshold
+
+
+class Checkpoint(object):
+    """
+    Checkpoint - the progress of a process_file run, saved so a run that stopped can be
+    resumed with the same output (see SimplifyProcess.process_file).
+
+    The checkpoint is a directory:
+        source.txt = the input and the options of the run (see describe_source)
+        chunk_<n>.npz = the simplified geometries of the n-th batch of features (or tile)
+            as WKB, the number of geometries repaired, and, where they apply, the feature
+            ids of a tile and the arcs added to GeomSimplify.dictSimpleArcs; or the keep
+            mask of the n-th run of arcs (see ArcStore.simplify), followed by one chunk
+            with the simplified layer
+        junctions/ = the junctions and arc thresholds (see JunctionCache)
+
+    Every chunk is written to a temporary file first and renamed, so a run stopped while
+    writing one never leaves a partial chunk behind. Only the chunks 0, 1, ... up to the
+    first one missing count as done.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+
+    @staticmethod
+    def describe_source(junctionSource, *options):
+        """
+        Returns a string identifying a run: the input (a JunctionCache.describe_source) and
+        every option that changes the output.
+        """
+        return repr((junctionSource,) + tuple(options))
+
+    @staticmethod
+    def open(path, source, resume=False):
+        """
+        Returns the checkpoint in the directory 'path'. With 'resume' the chunks of an
+        earlier run with the same 'source' are kept; otherwise (or if the source
+        differs) they are removed and the run starts over.
+        """
+        os.makedirs(path, exist_ok=True)
+        sourceFile = os.path.join(path, "source.txt")
+        if resume and os.path.exists(sourceFile):
+            with open(sourceFile, "r") as input:
+                if input.read() == source:
+                    return Checkpoint(path, source)
+            print("Checkpoint is from another input or other options, starting over")
+
+        for chunkFile in glob.glob(os.path.join(path, "chunk_*.npz")):
+            os.remove(chunkFile)
+        with open(sourceFile, "w") as output:
+            output.write(source)
+        return Checkpoint(path, source)
+
+    def junction_cache_dir(self):
+        # Where the junctions of the run are kept
+        return os.path.join(self.path, "junctions")
+
+    def chunk_file(self, index):
+        return os.path.join(self.path, "chunk_%06d.npz" % index)
+
+    def chunk_count(self):
+        """
+        Returns the number of chunks done.
+        """
+        count = 0
+        while os.path.exists(self.chunk_file(count)):
+            count += 1
+        return count
+
+    def save_chunk(
+        self, index, shapes, repaired=0, vertices=0, featureIds=None, simpleArcs=None
+    ):
+        """
+        Saves chunk 'index': the simplified 'shapes' (None where removed), the number of
+        them that were repaired, the number of vertices of a tile before simplifying,
+        the feature ids of a tile, and the arcs of dictSimpleArcs (arc key: LineString)
+        simplified for this chunk.
+        """
+        arrays = {"repaired": np.int64(repaired), "vertices": np.int64(vertices)}
+        arrays["wkb"], arrays["wkbOffsets"] = pack_wkb(shapes)
+        if featureIds is not None:
+            arrays["featureIds"] = np.asarray(featureIds, dtype=np.int64)
+        if simpleArcs:
+            arrays["arcEnds"] = np.array(
+                [start + end for start, end in map(ArcThreshold.split_key, simpleArcs)],
+                dtype=np.int64,
+            ).reshape(-1, 4)
+            arrays["arcWkb"], arrays["arcWkbOffsets"] = pack_wkb(
+                list(simpleArcs.values())
+            )
+
+        # np.savez adds .npz to a name without it
+        temporaryFile = self.chunk_file(index) + ".tmp.npz"
+        np.savez(temporaryFile, **arrays)
+        os.replace(temporaryFile, self.chunk_file(index))
+
+    def load_chunk(self, index):
+        """
+        Returns (shapes, repaired, vertices, featureIds, simpleArcs) of chunk 'index': a
+        NumPy object array, two ints, an int64 array or None, and a dictionary of the
+        arcs (empty if none).
+        """
+        with np.load(self.chunk_file(index)) as chunk:
+            shapes = unpack_wkb(chunk["wkb"], chunk["wkbOffsets"])
+            featureIds = chunk["featureIds"] if "featureIds" in chunk else None
+            simpleArcs = {}
+            if "arcEnds" in chunk:
+                arcs = unpack_wkb(chunk["arcWkb"], chunk["arcWkbOffsets"])
+                for (sx, sy, ex, ey), arc in zip(chunk["arcEnds"].tolist(), arcs):
+                    simpleArcs[ArcThreshold.get_key((sx, sy), (ex, ey))] = arc
+            return (
+                shapes,
+                int(chunk["repaired"]),
+                int(chunk["vertices"]),
+                featureIds,
+                simpleArcs,
+            )
+
+    def save_mask(self, index, keep):
+        """
+        Saves chunk 'index': the keep mask of a run of arcs.
+        """
+        temporaryFile = self.chunk_file(index) + ".tmp.npz"
+        np.savez(temporaryFile, keep=np.asarray(keep, dtype=bool))
+        os.replace(temporaryFile, self.chunk_file(index))
+
+    def load_mask(self, index):
+        """
+        Returns the keep mask of chunk 'index', or None if the chunk holds geometries.
+        """
+        with np.load(self.chunk_file(index)) as chunk:
+            return chunk["keep"] if "keep" in chunk else None
+
+
+def pack_wkb(shapes):
+    """
+    Returns the WKB of 'shapes' concatenated into one uint8 array, and the offsets of
+    every geometry in it. A missing geometry (None) has offset -1 at its end.
+    """
+    shapeArray = np.empty(len(shapes), dtype=object)
+    shapeArray[:] = list(shapes)
+    wkbs = shapely.to_wkb(shapeArray)
+    present = ~shapely.is_missing(shapeArray)
+    lengths = np.array(
+        [len(wkb) if wkb is not None else 0 for wkb in wkbs], dtype=np.int64
+    )
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    offsets[1:][~present] = -1
+    data = np.frombuffer(b"".join(wkbs[present]), dtype=np.uint8)
+    return data, offsets
+
+
+def unpack_wkb(data, offsets):
+    """
+    Returns the NumPy object array of geometries packed by pack_wkb.
+    """
+    data = data.tobytes()
+    shapes = np.full(len(offsets) - 1, None, dtype=object)
+    start = 0
+    for index, end in enumerate(offsets[1:].tolist()):
+        if end < 0:
+            continue
+        shapes[index] = shapely.from_wkb(data[start:end])
+        start = end
+    return shapes
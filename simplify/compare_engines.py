@@ -0,0 +1,214 @@
+__author__ = "asimmons"
+
+import json
+import numpy as np
+import shapely
+from simplify_topology import SimplifyProcess
+from shapestore import ShapeStore
+from engines import available_engines
+from optparse import OptionParser
+
+################################################################################################################################################
+# 1) This script runs the simplification engines (see engines.py) on the same input and threshold, and reports for each run:                   #
+#     seconds (total and elimination), vertices in and out, and the differences with the input and with a reference run:                      #
+#     size_change = total |area - area before| / total area before (length for lines), hausdorff_mean / hausdorff_max per feature.           #
+#                                                                                                                                              #
+# 2) The runs are:                                                                                                                             #
+#     visvalingam          = this project, no topology                                                                                         #
+#     visvalingam_topology = this project, topology preserved                                                                                  #
+#     geos                 = shapely.simplify(preserve_topology=True), one feature at a time                                                  #
+#     coverage             = shapely.coverage_simplify, topology preserved (shapely 2.1 or later)                                              #
+#                                                                                                                                              #
+# 3) The GEOS engines get the square root of the threshold as tolerance (see engines.geos_tolerance).                                          #
+#                                                                                                                                              #
+################################################################################################################################################
+
+# run name: (engine, Topology)
+RUNS = {
+    "visvalingam": ("visvalingam", False),
+    "visvalingam_topology": ("visvalingam", True),
+    "geos": ("geos", False),
+    "coverage": ("coverage", True),
+}
+
+
+def differences(shapes, simplifiedShapes):
+    """
+    Compares two NumPy object arrays of the same features (None where missing), over the
+    features present in both. Returns the relative change of their total area (length
+    for lines) and the mean and largest Hausdorff distance between them.
+    """
+    both = ~(shapely.is_missing(shapes) | shapely.is_missing(simplifiedShapes))
+    shapes = shapes[both]
+    simplifiedShapes = simplifiedShapes[both]
+
+    polygonal = np.isin(shapely.get_type_id(shapes), (3, 6))
+    size = np.where(polygonal, shapely.area(shapes), shapely.length(shapes))
+    simplifiedSize = np.where(
+        polygonal, shapely.area(simplifiedShapes), shapely.length(simplifiedShapes)
+    )
+    hausdorff = shapely.hausdorff_distance(shapes, simplifiedShapes)
+
+    return {
+        "features": int(both.sum()),
+        "size_change": (
+            float(np.abs(simplifiedSize - size).sum() / size.sum())
+            if size.sum()
+            else 0.0
+        ),
+        "hausdorff_mean": float(hausdorff.mean()) if len(hausdorff) else 0.0,
+        "hausdorff_max": float(hausdorff.max()) if len(hausdorff) else 0.0,
+    }
+
+
+def compare_engines(shapes, threshold, runs=tuple(RUNS), reference=None):
+    """
+    Simplifies 'shapes' (a NumPy object array) with every run of 'runs' (see RUNS) and
+    returns one result per run. A run that fails (an engine that is not installed, or
+    lines given to the coverage engine) is recorded with its error.
+
+    reference = the run the others are compared with (default: the first that works)
+    """
+    results = []
+    outputs = {}
+    for run in runs:
+        engine, topology = RUNS[run]
+        result = {"run": run, "engine": engine, "topology": topology}
+        results.append(result)
+        process = SimplifyProcess()
+        try:
+            simplifiedShapes = process.simplify_geometries(
+                shapes, threshold, topology, Engine=engine
+            )
+        except Exception as error:
+            result["error"] = repr(error)
+            continue
+
+        outputs[run] = simplifiedShapes
+        report = process.metrics.report()
+        counts = report["counts"]
+        result.update(
+            {
+                "seconds": report["total_seconds"],
+                "elimination_seconds": report["phases"].get("elimination", 0.0),
+                "features_in": counts["features_in"],
+                "features_out": counts["features_out"],
+                "vertices_in": counts["vertices_in"],
+                "vertices_out": counts["vertices_out"],
+                "vertex_reduction": (
+                    1 - counts["vertices_out"] / counts["vertices_in"]
+                    if counts["vertices_in"]
+                    else 0.0
+                ),
+                "input": differences(shapes, simplifiedShapes),
+            }
+        )
+
+    if reference is None and outputs:
+        reference = next(run for run in runs if run in outputs)
+    for result in results:
+        if result["run"] in outputs and reference in outputs:
+            result["reference"] = reference
+            result["to_reference"] = differences(
+                outputs[reference], outputs[result["run"]]
+            )
+    return results
+
+
+def format_result(result):
+    """
+    Returns one line of the printed comparison.
+    """
+    if "error" in result:
+        return "%-21s failed: %s" % (result["run"], result["error"])
+    line = (
+        "%-21s %8.3fs %10d -> %10d vertices (-%4.1f%%)  size %+.4f%%  hausdorff %g"
+        % (
+            result["run"],
+            result["seconds"],
+            result["vertices_in"],
+            result["vertices_out"],
+            100 * result["vertex_reduction"],
+            100 * result["input"]["size_change"],
+            result["input"]["hausdorff_max"],
+        )
+    )
+    if "to_reference" in result and result["run"] != result["reference"]:
+        line += "  (hausdorff to %s %g)" % (
+            result["reference"],
+            result["to_reference"]["hausdorff_max"],
+        )
+    return line
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-i",
+        "--input_file",
+        dest="inputFile",
+        help="Input file with geometries to be simplified",
+        metavar="FILE",
+    )
+    parser.add_option(
+        "-t",
+        "--threshold",
+        dest="threshold",
+        type="float",
+        help="Threshold for simplification (the GEOS tolerance is its square root)",
+    )
+    parser.add_option(
+        "-r",
+        "--runs",
+        dest="runs",
+        default=",".join(RUNS),
+        help="Comma separated runs among " + ", ".join(RUNS),
+    )
+    parser.add_option(
+        "--reference",
+        dest="reference",
+        help="Run the others are compared with (default: the first that works)",
+    )
+    parser.add_option(
+        "-o",
+        "--output_file",
+        dest="outputFile",
+        help="JSON report (default: print it)",
+        metavar="FILE",
+    )
+
+    options, args = parser.parse_args()
+
+    if not options.inputFile or options.threshold is None:
+        parser.error("Must specify input file and threshold")
+    runs = options.runs.split(",")
+    for run in runs:
+        if run not in RUNS:
+            parser.error("Unknown run: " + repr(run))
+
+    shapes = ShapeStore.read(options.inputFile).shapes
+    results = compare_engines(shapes, options.threshold, runs, options.reference)
+    for result in results:
+        print(format_result(result))
+
+    report = {
+        "input": options.inputFile,
+        "threshold": options.threshold,
+        "shapely": shapely.__version__,
+        "geos": shapely.geos_version_string,
+        "engines": available_engines(),
+        "results": results,
+    }
+    if options.outputFile:
+        with open(options.outputFile, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
+
+# example usage:
+# python compare_engines.py -i input/input.shp -t 0.0001
+# python compare_engines.py -i input/input.shp -t 0.0001 -r visvalingam_topology,coverage -o engines.json
@@ -0,0 +1,435 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import heapq
+import numpy as np
+from array import array
+
+# Area given to vertices that can never be eliminated (line start/end points)
+FIXED_AREA = float("inf")
+
+# Area given to vertices once they have been eliminated
+REMOVED_AREA = -1.0
+
+
+class EliminationEngine(object):
+    """
+    EliminationEngine() - Visvalingam elimination over a compact vertex store.
+
+    Every chain (a line or a ring) added to the engine is appended to flat arrays
+    of coordinates and prev/next links. Each vertex caches the area of its current
+    triangle, and each chain has a heap of (area, vertexIndex) entries. When a vertex
+    is eliminated only its two neighbours are recomputed and pushed again; heap
+    entries that went out of date are skipped when they reach the top of the heap
+    (lazy deletion), so a complete run is O(n log n).
+
+    Each chain keeps its own threshold and minimum number of points.
+
+    With preventIntersections, a vertex is only eliminated if no other point of its group
+    (a ring, or a set of arcs, see add_chains) lies in or on the triangle it removes.
+    For a valid input that means the new segment crosses no other segment of the group,
+    so the result stays valid without repair. The points are found in a uniform grid
+    built when eliminate() starts; eliminated points are skipped, not removed from it.
+    A vertex that is refused stays until the elimination of a neighbour gives it a new
+    triangle.
+    """
+
+    __slots__ = (
+        "xs",
+        "ys",
+        "prevIndex",
+        "nextIndex",
+        "areas",
+        "effectiveAreas",
+        "chainStarts",
+        "chainCounts",
+        "chainMinimums",
+        "chainThresholds",
+        "heaps",
+        "chainGroups",
+        "preventIntersections",
+        "grid",
+        "gridOrigin",
+        "cellSize",
+    )
+
+    # Heap pushes and pops of every engine of this process (see Metrics)
+    heapOperations = 0
+
+    def __init__(self, preventIntersections=False):
+        # Per vertex storage
+        self.xs = array("d")
+        self.ys = array("d")
+        self.prevIndex = array("q")
+        self.nextIndex = array("q")
+        self.areas = array("d")  # current triangle area (REMOVED_AREA once gone)
+        self.effectiveAreas = array("d")  # area at elimination, monotonic per chain
+
+        # Per chain storage
+        self.chainStarts = [0]
+        self.chainCounts = []
+        self.chainMinimums = []
+        self.chainThresholds = []
+        self.heaps = []
+        self.chainGroups = []
+
+        # Point grid used when preventIntersections is on
+        self.preventIntersections = preventIntersections
+        self.grid = None
+        self.gridOrigin = (0.0, 0.0)
+        self.cellSize = 1.0
+
+    @staticmethod
+    def triangle_area(x1, y1, x2, y2, x3, y3):
+        # Same cross product as TriangleCalculator.calcArea, where point 1 is the
+        # vertex and points 2 and 3 are its previous and next neighbours
+        return abs(x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2)) / 2.0
+
+    def __add_chain(self, points, closed, threshold, minimumPoints, group):
+        chain = len(self.chainCounts)
+        start = len(self.xs)
+        count = len(points)
+
+        for point in points:
+            self.xs.append(point[0])
+            self.ys.append(point[1])
+        self.effectiveAreas.extend([FIXED_AREA] * count)
+
+        # Hook up vertices with next and prev references (doubly-linked list over
+        # indices). Rings wrap around, lines stop at their end points (-1).
+        for local in range(count):
+            index = start + local
+            if local > 0:
+                self.prevIndex.append(index - 1)
+            elif closed:
+                self.prevIndex.append(start + count - 1)
+            else:
+                self.prevIndex.append(-1)
+
+            if local < count - 1:
+                self.nextIndex.append(index + 1)
+            elif closed:
+                self.nextIndex.append(start)
+            else:
+                self.nextIndex.append(-1)
+
+        # Cache the initial areas and fill the heap. Line end points are fixed.
+        xs = self.xs
+        ys = self.ys
+        heap = []
+        for index in range(start, start + count):
+            prev = self.prevIndex[index]
+            next = self.nextIndex[index]
+            if prev < 0 or next < 0:
+                self.areas.append(FIXED_AREA)
+            else:
+                area = self.triangle_area(
+                    xs[index], ys[index], xs[prev], ys[prev], xs[next], ys[next]
+                )
+                self.areas.append(area)
+                heap.append((area, index))
+
+        self.chainStarts.append(start + count)
+        self.chainCounts.append(count)
+        self.chainMinimums.append(minimumPoints)
+        self.chainThresholds.append(threshold)
+        self.heaps.append(heap)
+        # Chains without a group are only checked against themselves
+        self.chainGroups.append(-1 - chain if group is None else group)
+
+        return chain
+
+    def add_line(self, points, threshold=FIXED_AREA, group=None):
+        """
+        Adds a line to the engine. Returns the chain id.
+
+        The first and last points are never eliminated, so a line can go down to 2 points.
+        """
+        return self.__add_chain(points, False, threshold, 2, group)
+
+    def add_ring(self, points, threshold=FIXED_AREA, minimumPoints=2, group=None):
+        """
+        Adds a ring to the engine. Returns the chain id.
+
+        'points' must not repeat the first point at the end. Elimination stops once the
+        ring is down to 'minimumPoints' points.
+        """
+        return self.__add_chain(points, True, threshold, minimumPoints, group)
+
+    def add_chains(
+        self, xs, ys, offsets, closed, thresholds, minimumPoints=2, groups=None
+    ):
+        """
+        Adds many chains at once from flat coordinate arrays. Returns the chain ids.
+
+        xs, ys = NumPy arrays of the points of every chain, one chain after another
+        offsets = NumPy array of len(chains) + 1 where each chain starts in xs/ys
+        closed = True if the chains are rings (their first point must NOT be repeated at the end)
+        thresholds = one threshold for every chain, or a single value
+        groups = one integer (>= 0) for every chain, or a single value: with
+            preventIntersections the chains of a group are checked against each other.
+            By default every chain is only checked against itself.
+
+        The initial triangle areas of all chains are computed in one vectorized pass.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        chainCount = len(offsets) - 1
+        base = len(self.xs)
+        firstChain = len(self.chainCounts)
+
+        # Hook up vertices with next and prev references over indices. Rings wrap
+        # around, lines stop at their end points (-1).
+        index = np.arange(len(xs), dtype=np.int64)
+        prev = index - 1
+        next = index + 1
+        starts = offsets[:-1]
+        ends = offsets[1:]
+        nonEmpty = ends > starts
+        starts = starts[nonEmpty]
+        ends = ends[nonEmpty]
+        if closed:
+            prev[starts] = ends - 1
+            next[ends - 1] = starts
+        else:
+            prev[starts] = -1
+            next[ends - 1] = -1
+
+        # Same cross product as triangle_area, for every vertex at once
+        interior = (prev >= 0) & (next >= 0)
+        x1 = xs[interior]
+        y1 = ys[interior]
+        x2 = xs[prev[interior]]
+        y2 = ys[prev[interior]]
+        x3 = xs[next[interior]]
+        y3 = ys[next[interior]]
+        areas = np.full(len(xs), FIXED_AREA)
+        areas[interior] = np.abs(x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2)) / 2.0
+
+        counts = np.diff(offsets)
+        prev[prev >= 0] += base
+        next[next >= 0] += base
+
+        self.xs.extend(xs.tolist())
+        self.ys.extend(ys.tolist())
+        self.prevIndex.extend(prev.tolist())
+        self.nextIndex.extend(next.tolist())
+        self.areas.extend(areas.tolist())
+        self.effectiveAreas.extend([FIXED_AREA] * len(xs))
+
+        # One heap per chain, cut from the (area, index) entries of all chains
+        entries = list(zip(areas[interior].tolist(), (index[interior] + base).tolist()))
+        entryOffsets = np.concatenate(([0], np.cumsum(interior)))[offsets].tolist()
+        self.heaps.extend(
+            entries[entryOffsets[chain] : entryOffsets[chain + 1]]
+            for chain in range(chainCount)
+        )
+
+        self.chainStarts.extend((offsets[1:] + base).tolist())
+        self.chainCounts.extend(counts.tolist())
+        self.chainMinimums.extend(
+            np.broadcast_to(minimumPoints, (chainCount,)).tolist()
+        )
+        self.chainThresholds.extend(
+            np.broadcast_to(np.asarray(thresholds, dtype=np.float64), (chainCount,))
+            .astype(np.float64)
+            .tolist()
+        )
+        if groups is None:
+            self.chainGroups.extend(
+                range(-1 - firstChain, -1 - firstChain - chainCount, -1)
+            )
+        else:
+            self.chainGroups.extend(
+                np.broadcast_to(
+                    np.asarray(groups, dtype=np.int64), (chainCount,)
+                ).tolist()
+            )
+
+        return range(firstChain, firstChain + chainCount)
+
+    def eliminate(self):
+        """
+        Removes vertices, smallest triangle first, until every chain has reached its
+        threshold (or its minimum number of points).
+        """
+        if self.preventIntersections:
+            self.__build_grid()
+
+        for chain in range(len(self.chainCounts)):
+            if self.heaps[chain]:
+                self.__eliminate_chain(chain)
+
+    def __eliminate_chain(self, chain):
+        heap = self.heaps[chain]
+        heapq.heapify(heap)
+
+        xs = self.xs
+        ys = self.ys
+        prevIndex = self.prevIndex
+        nextIndex = self.nextIndex
+        areas = self.areas
+        effectiveAreas = self.effectiveAreas
+        threshold = self.chainThresholds[chain]
+        minimumPoints = self.chainMinimums[chain]
+        count = self.chainCounts[chain]
+        group = self.chainGroups[chain]
+        preventIntersections = self.preventIntersections
+        lastArea = 0.0
+        # heapify counts as one push per entry
+        operations = len(heap)
+
+        while heap and count > minimumPoints:
+            # if the smallest triangle is greater than the threshold, we can stop
+            area, index = heap[0]
+            if area >= threshold:
+                break
+            heapq.heappop(heap)
+            operations += 1
+
+            # Skip entries that were superseded by a recomputed area, or whose
+            # vertex has already been eliminated
+            if area != areas[index]:
+                continue
+
+            # Unlink the vertex
+            prev = prevIndex[index]
+            next = nextIndex[index]
+            if preventIntersections and self.__blocked(prev, index, next, group):
+                continue
+            nextIndex[prev] = next
+            prevIndex[next] = prev
+            areas[index] = REMOVED_AREA
+            count -= 1
+
+            # Effective areas never decrease along the elimination order
+            if area < lastArea:
+                area = lastArea
+            lastArea = area
+            effectiveAreas[index] = area
+
+            # Only the two neighbours have new triangles
+            for neighbor in (prev, next):
+                if areas[neighbor] == FIXED_AREA or areas[neighbor] == REMOVED_AREA:
+                    continue
+                p = prevIndex[neighbor]
+                n = nextIndex[neighbor]
+                newArea = self.triangle_area(
+                    xs[neighbor], ys[neighbor], xs[p], ys[p], xs[n], ys[n]
+                )
+                areas[neighbor] = newArea
+                heapq.heappush(heap, (newArea, neighbor))
+                operations += 1
+
+        EliminationEngine.heapOperations += operations
+        self.chainCounts[chain] = count
+        self.heaps[chain] = []
+
+    def __build_grid(self):
+        # One cell per point on average, over the extent of every chain
+        xs = np.frombuffer(self.xs, dtype=np.float64)
+        ys = np.frombuffer(self.ys, dtype=np.float64)
+        self.grid = {}
+        if len(xs) == 0:
+            return
+        self.gridOrigin = (float(xs.min()), float(ys.min()))
+        extent = max(xs.max() - xs.min(), ys.max() - ys.min())
+        self.cellSize = float(extent / np.sqrt(len(xs))) or 1.0
+
+        vertexGroups = np.repeat(
+            np.asarray(self.chainGroups, dtype=np.int64),
+            np.diff(np.asarray(self.chainStarts, dtype=np.int64)),
+        )
+        cellXs = np.floor((xs - self.gridOrigin[0]) / self.cellSize).astype(np.int64)
+        cellYs = np.floor((ys - self.gridOrigin[1]) / self.cellSize).astype(np.int64)
+        grid = self.grid
+        for index, key in enumerate(
+            zip(vertexGroups.tolist(), cellXs.tolist(), cellYs.tolist())
+        ):
+            if key in grid:
+                grid[key].append(index)
+            else:
+                grid[key] = [index]
+
+    def __blocked(self, prev, index, next, group):
+        # True if a point of 'group' other than the three corners lies in or on the
+        # triangle (prev, index, next)
+        xs = self.xs
+        ys = self.ys
+        areas = self.areas
+        ax, ay = xs[prev], ys[prev]
+        bx, by = xs[index], ys[index]
+        cx, cy = xs[next], ys[next]
+        minX, maxX = min(ax, bx, cx), max(ax, bx, cx)
+        minY, maxY = min(ay, by, cy), max(ay, by, cy)
+
+        originX, originY = self.gridOrigin
+        cellSize = self.cellSize
+        grid = self.grid
+        for cellX in range(
+            int((minX - originX) // cellSize), int((maxX - originX) // cellSize) + 1
+        ):
+            for cellY in range(
+                int((minY - originY) // cellSize), int((maxY - originY) // cellSize) + 1
+            ):
+                for other in grid.get((group, cellX, cellY), ()):
+                    if areas[other] == REMOVED_AREA:
+                        continue
+                    x, y = xs[other], ys[other]
+                    if x < minX or x > maxX or y < minY or y > maxY:
+                        continue
+                    if (x, y) in ((ax, ay), (bx, by), (cx, cy)):
+                        continue
+
+                    # Same side (or on an edge) of all three edges
+                    d1 = (bx - ax) * (y - ay) - (by - ay) * (x - ax)
+                    d2 = (cx - bx) * (y - by) - (cy - by) * (x - bx)
+                    d3 = (ax - cx) * (y - cy) - (ay - cy) * (x - cx)
+                    hasNegative = d1 < 0 or d2 < 0 or d3 < 0
+                    hasPositive = d1 > 0 or d2 > 0 or d3 > 0
+                    if not (hasNegative and hasPositive):
+                        return True
+        return False
+
+    def chain_count(self, chain):
+        """
+        Returns the number of points left on a chain.
+        """
+        return self.chainCounts[chain]
+
+    def kept_indices(self, chain):
+        """
+        Returns the sorted indices (relative to the chain) of the points left on a chain.
+        """
+        start = self.chainStarts[chain]
+        areas = self.areas
+        return [
+            index - start
+            for index in range(start, self.chainStarts[chain + 1])
+            if areas[index] != REMOVED_AREA
+        ]
+
+    def effective_areas(self, chain):
+        """
+        Returns, for every point of a chain, the (monotonic) area at which it was
+        eliminated. Points that were never eliminated get an infinite area.
+        """
+        start = self.chainStarts[chain]
+        return self.effectiveAreas[start : self.chainStarts[chain + 1]].tolist()
+
+    def effective_area_array(self):
+        """
+        Returns a NumPy array with the effective area of every vertex of the engine (see
+        effective_areas).
+        """
+        return np.array(self.effectiveAreas, dtype=np.float64)
+
+    def kept_mask(self):
+        """
+        Returns a NumPy boolean array over every vertex of the engine, True for the
+        points that are left.
+        """
+        return np.frombuffer(self.areas, dtype=np.float64) != REMOVED_AREA
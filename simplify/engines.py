@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import numpy as np
+import shapely
+
+try:
+    from shapely import coverage_simplify
+except ImportError:
+    # shapely < 2.1 (or GEOS < 3.12)
+    coverage_simplify = None
+
+# The simplification engines SimplifyProcess can run:
+#   visvalingam = the Visvalingam elimination of this project (GeomSimplify)
+#   geos        = shapely.simplify(preserve_topology=True), Douglas-Peucker in GEOS, one
+#                 feature at a time
+#   coverage    = shapely.coverage_simplify, Visvalingam in GEOS over a polygon coverage,
+#                 keeping the borders shared between polygons
+ENGINES = ("visvalingam", "geos", "coverage")
+
+
+def available_engines():
+    """
+    Returns the names of the engines that can run with the installed shapely.
+    """
+    return [engine for engine in ENGINES if engine != "coverage" or coverage_simplify]
+
+
+def check_engine(engine, Topology=False):
+    """
+    Raises ValueError if 'engine' is unknown, not installed, or can not run in the
+    Topology mode asked for.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine: " + repr(engine))
+    if engine not in available_engines():
+        raise ValueError(
+            "The coverage engine needs shapely 2.1 or later (GEOS 3.12 or later)"
+        )
+    if engine == "geos" and Topology:
+        raise ValueError(
+            "The geos engine simplifies every feature on its own, use the coverage engine with topology"
+        )
+    if engine == "coverage" and not Topology:
+        raise ValueError("The coverage engine always keeps topology")
+
+
+def geos_tolerance(threshold):
+    """
+    Converts a threshold (the area of the largest triangle removed) into a GEOS
+    distance tolerance. GEOS compares the triangle areas of coverage_simplify with the
+    square of its tolerance, so the square root removes the same points there; for the
+    Douglas-Peucker of shapely.simplify it is only the nearest equivalent.
+    """
+    return np.sqrt(threshold)
+
+
+def simplify_with_engine(engine, shapes, threshold):
+    """
+    Simplifies a NumPy object array of shapely geometries (none missing) with the GEOS
+    'engine' ("geos" or "coverage"). Returns a NumPy object array in the same order, with
+    None where a geometry collapsed.
+
+    threshold = a single threshold, or one threshold per geometry ("geos" only)
+    """
+    tolerance = geos_tolerance(np.asarray(threshold, dtype=np.float64))
+
+    if engine == "geos":
+        simplifiedShapes = shapely.simplify(shapes, tolerance, preserve_topology=True)
+    elif engine == "coverage":
+        if tolerance.ndim > 0:
+            raise ValueError("The coverage engine takes a single threshold")
+        if not np.isin(shapely.get_type_id(shapes), (3, 6)).all():
+            raise ValueError("The coverage engine only simplifies polygons")
+        simplifiedShapes = coverage_simplify(shapes, float(tolerance))
+    else:
+        raise ValueError("Not a GEOS engine: " + repr(engine))
+
+    simplifiedShapes = np.asarray(simplifiedShapes, dtype=object)
+    simplifiedShapes[shapely.is_empty(simplifiedShapes)] = None
+    return simplifiedShapes
@@ -0,0 +1,521 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import json
+import os
+import queue
+import threading
+import fiona
+import numpy as np
+import shapely
+from shapely.geometry import shape, mapping
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyogrio
+    import pyogrio.raw
+except ImportError:
+    pyogrio = None
+
+# Read and write features in Arrow record batches when pyogrio and pyarrow are installed
+use_arrow = pyogrio is not None
+
+# Output formats chosen by the extension of the output file. Other extensions are
+# written with the driver of the input file.
+DRIVERS = {
+    ".shp": "ESRI Shapefile",
+    ".gpkg": "GPKG",
+    ".geojson": "GeoJSON",
+    ".fgb": "FlatGeobuf",
+    ".parquet": "Parquet",
+}
+
+# Formats written with a generic geometry type. A Polygon shapefile also holds
+# MultiPolygons (and repairs can turn a Polygon into one), which FlatGeobuf rejects.
+MIXED_GEOMETRY_DRIVERS = ("FlatGeobuf", "Parquet")
+
+# Formats pyogrio can not append to. With the Arrow writer a FlatGeobuf layer is created
+# by one pyogrio call the batches are streamed to (see BatchWriter.write_stream), and
+# Parquet is streamed with pyarrow instead (see BatchWriter.write_parquet).
+NO_APPEND_DRIVERS = ("FlatGeobuf", "Parquet")
+
+# Batches queued for the thread writing a streamed output. The writer waits for room in
+# the queue, so memory does not grow with the output.
+STREAM_QUEUE_SIZE = 2
+
+# Geometry column of the batches streamed to pyogrio
+STREAM_GEOMETRY = "wkb_geometry"
+
+# Rows of every Parquet row group written with the Arrow writer. A row group is the only
+# part of a Parquet output held in memory.
+PARQUET_ROW_GROUP_SIZE = 65536
+
+# Geometry column of the GeoParquet files written with the Arrow writer
+PARQUET_GEOMETRY = "geometry"
+
+# Feature ids read at a time by read_by_id with the Arrow reader. pyogrio filters them
+# with an SQL IN clause, and drivers using the OGRSQL dialect (shapefiles) take at most
+# 4997 ids in one.
+FID_CHUNK_SIZE = 4096
+
+# Layer creation options of the output formats
+LAYER_OPTIONS = {"FlatGeobuf": {"SPATIAL_INDEX": "YES"}}
+
+# A batch is (shapes, records):
+#     shapes = NumPy object array of shapely geometries (None where there is no geometry)
+#     records = the attributes of the same features, a pyarrow Table with the Arrow reader,
+#         else a list of property dictionaries
+# With pyogrio the geometries of a whole batch are converted from WKB at once and the
+# attributes stay columns, so no feature is turned into a dictionary. Without it fiona
+# reads and writes one feature at a time.
+
+
+def read_batches(inFile, batchSize, readGeometry=True, fields=None):
+    """
+    Yields (shapes, records) batches of up to batchSize features of 'inFile', in file order.
+
+    If readGeometry is False shapes is None. If 'fields' is a list only those attributes
+    are read.
+    """
+    if use_arrow:
+        return read_arrow_batches(inFile, batchSize, readGeometry, fields)
+    return read_fiona_batches(inFile, batchSize, readGeometry, fields)
+
+
+def read_arrow_batches(inFile, batchSize, readGeometry=True, fields=None):
+    with pyogrio.raw.open_arrow(
+        inFile,
+        batch_size=batchSize,
+        columns=fields,
+        read_geometry=readGeometry,
+        use_pyarrow=True,
+    ) as (meta, reader):
+        for batch in reader:
+            yield split_geometry(
+                meta, pyarrow.Table.from_batches([batch]), readGeometry
+            )
+
+
+def read_fiona_batches(inFile, batchSize, readGeometry=True, fields=None):
+    ignored = None
+    if fields is not None:
+        with fiona.open(inFile, "r") as input:
+            ignored = [
+                name for name in input.schema["properties"] if name not in fields
+            ]
+
+    with fiona.open(
+        inFile, "r", ignore_geometry=not readGeometry, ignore_fields=ignored
+    ) as input:
+        shapes = []
+        records = []
+        for myGeom in input:
+            if readGeometry:
+                geometry = myGeom["geometry"]
+                shapes.append(None if geometry is None else shape(geometry))
+            records.append(myGeom["properties"])
+            if len(records) == batchSize:
+                yield shape_array(shapes, readGeometry), records
+                shapes = []
+                records = []
+        if records:
+            yield shape_array(shapes, readGeometry), records
+
+
+def read_fids(inFile, batchSize):
+    """
+    Yields (fids, shapes) batches of up to batchSize features of 'inFile', in file order,
+    without their attributes. fids is an int64 array of the OGR feature ids read_by_id
+    takes: they are not always the positions of the features (a GeoPackage starts at 1,
+    and can have gaps).
+    """
+    if use_arrow:
+        with pyogrio.raw.open_arrow(
+            inFile,
+            batch_size=batchSize,
+            columns=[],
+            return_fids=True,
+            use_pyarrow=True,
+        ) as (meta, reader):
+            for batch in reader:
+                shapes, records = split_geometry(
+                    meta, pyarrow.Table.from_batches([batch])
+                )
+                fids = records.column(meta["fid_column"]).to_numpy()
+                yield fids.astype(np.int64), shapes
+        return
+
+    with fiona.open(inFile, "r") as input:
+        ignored = list(input.schema["properties"])
+    with fiona.open(inFile, "r", ignore_fields=ignored) as input:
+        fids = []
+        shapes = []
+        for myGeom in input:
+            fids.append(int(myGeom["id"]))
+            geometry = myGeom["geometry"]
+            shapes.append(None if geometry is None else shape(geometry))
+            if len(fids) == batchSize:
+                yield np.array(fids, dtype=np.int64), shape_array(shapes)
+                fids = []
+                shapes = []
+        if fids:
+            yield np.array(fids, dtype=np.int64), shape_array(shapes)
+
+
+def read_by_id(inFile, featureIds, readGeometry=True):
+    """
+    Returns the (shapes, records) batch of the features 'featureIds' (OGR feature ids,
+    see read_fids) of 'inFile', in that order. If readGeometry is False shapes is None.
+    """
+    if use_arrow:
+        # Read FID_CHUNK_SIZE ids at a time (once if there are none). The rows come
+        # back in an order of the driver's choosing, so they are put back in the
+        # order of featureIds by their feature ids.
+        featureIds = np.asarray(featureIds, dtype=np.int64)
+        tables = []
+        for start in range(0, max(len(featureIds), 1), FID_CHUNK_SIZE):
+            meta, table = pyogrio.raw.read_arrow(
+                inFile,
+                read_geometry=readGeometry,
+                fids=featureIds[start : start + FID_CHUNK_SIZE],
+                return_fids=True,
+            )
+            tables.append(table)
+        records = pyarrow.concat_tables(tables)
+        readIds = records.column(meta["fid_column"]).to_numpy()
+        order = np.argsort(readIds)
+        records = records.take(order[np.searchsorted(readIds[order], featureIds)])
+        return split_geometry(
+            meta, records.drop_columns([meta["fid_column"]]), readGeometry
+        )
+
+    shapes = []
+    records = []
+    with fiona.open(inFile, "r", ignore_geometry=not readGeometry) as input:
+        for featureId in featureIds:
+            myGeom = input[int(featureId)]
+            if readGeometry:
+                geometry = myGeom["geometry"]
+                shapes.append(None if geometry is None else shape(geometry))
+            records.append(myGeom["properties"])
+    return shape_array(shapes, readGeometry), records
+
+
+def split_geometry(meta, records, readGeometry=True):
+    # Splits a pyarrow Table read by pyogrio into (shapes, records without the geometry)
+    if not readGeometry:
+        return None, records
+    geometryName = meta["geometry_name"] or "wkb_geometry"
+    shapes = shapely.from_wkb(records.column(geometryName).to_numpy())
+    records = records.select(
+        [name for name in records.column_names if name != geometryName]
+    )
+    return shapes, records
+
+
+def shape_array(shapes, readGeometry=True):
+    # Returns the list 'shapes' as a NumPy object array
+    if not readGeometry:
+        return None
+    shapeArray = np.empty(len(shapes), dtype=object)
+    shapeArray[:] = shapes
+    return shapeArray
+
+
+def record_values(records, field):
+    """
+    Returns the values of the attribute 'field' of a batch of records as a list.
+    """
+    if isinstance(records, list):
+        return [properties[field] for properties in records]
+    return records.column(field).to_pylist()
+
+
+def record_dicts(records):
+    """
+    Returns a batch of records as a list of property dictionaries.
+    """
+    if isinstance(records, list):
+        return records
+    return records.to_pylist()
+
+
+def output_driver(outFile, inDriver):
+    """
+    Returns the driver used to write 'outFile': the one of its extension (see DRIVERS),
+    else 'inDriver', the driver of the input file.
+    """
+    return DRIVERS.get(os.path.splitext(outFile)[1].lower(), inDriver)
+
+
+class BatchWriter(object):
+    """
+    BatchWriter - writes (shapes, records) batches to a new file with the crs and fields
+    of 'inFile'.
+
+    The format is chosen by the extension of 'outFile' (see output_driver). Features whose
+    shape is None are skipped. Used as a context manager:
+
+        with BatchWriter(outFile, inFile) as output:
+            output.write(shapes, records)
+
+    With the Arrow writer, batches are appended as they come, except for FlatGeobuf
+    (streamed to a thread creating the layer, see write_stream) and Parquet (written a
+    row group at a time, see write_parquet).
+    """
+
+    def __init__(self, outFile, inFile):
+        self.outFile = outFile
+        self.inFile = inFile
+        self.output = None
+        self.info = None
+        self.driver = None
+        self.pending = []
+        self.pendingRows = 0
+        self.parquetWriter = None
+        self.stream = None
+        self.streamSchema = None
+        self.streamThread = None
+        self.streamError = None
+        self.written = False
+
+    def __enter__(self):
+        if use_arrow:
+            self.info = pyogrio.read_info(self.inFile)
+            self.driver = output_driver(self.outFile, self.info["driver"])
+            if self.driver != "Parquet" and "w" not in pyogrio.list_drivers().get(
+                self.driver, ""
+            ):
+                raise ValueError("GDAL can not write " + repr(self.driver) + " files")
+        else:
+            with fiona.open(self.inFile, "r") as input:
+                meta = input.meta
+            self.driver = output_driver(self.outFile, meta["driver"])
+            enable_fiona_driver(self.driver)
+            meta["driver"] = self.driver
+            if self.driver in MIXED_GEOMETRY_DRIVERS:
+                meta["schema"]["geometry"] = "Unknown"
+            meta.update(LAYER_OPTIONS.get(self.driver, {}))
+            self.output = fiona.open(self.outFile, "w", **meta)
+        return self
+
+    def __exit__(self, *exc):
+        if self.output is not None:
+            self.output.close()
+        elif self.driver == "Parquet" and self.info is not None:
+            if exc[0] is None:
+                self.flush_parquet(True)
+            if self.parquetWriter is not None:
+                self.parquetWriter.close()
+        elif self.stream is not None:
+            self.close_stream(exc[1])
+        elif self.info is not None and exc[0] is None and not self.written:
+            # Every feature was removed, still create the (empty) layer
+            self.write_arrow(np.empty(0, dtype=object), None)
+        return False
+
+    def write(self, shapes, records):
+        shapes = np.asarray(shapes, dtype=object)
+        keep = ~shapely.is_missing(shapes)
+        if not keep.all():
+            shapes = shapes[keep]
+            if isinstance(records, list):
+                records = [
+                    properties for properties, kept in zip(records, keep) if kept
+                ]
+            else:
+                records = records.filter(pyarrow.array(keep))
+        if not len(shapes):
+            return
+
+        if self.output is not None:
+            self.output.writerecords(
+                {"geometry": mapping(simpleShape), "properties": properties}
+                for simpleShape, properties in zip(shapes, record_dicts(records))
+            )
+            return
+
+        if isinstance(records, list):
+            records = pyarrow.Table.from_pylist(records)
+        if self.driver == "Parquet":
+            self.write_parquet(shapes, records)
+        elif self.driver in NO_APPEND_DRIVERS:
+            self.write_stream(shapes, records)
+        else:
+            self.write_arrow(shapes, records)
+
+    def write_parquet(self, shapes, records):
+        """
+        Adds a batch to a GeoParquet output. The batches are gathered into row groups of
+        PARQUET_ROW_GROUP_SIZE rows, and every full row group is written out at once, so
+        memory does not grow with the output.
+        """
+        wkb = pyarrow.array(shapely.to_wkb(shapes), type=pyarrow.binary())
+        self.pending.append(records.append_column(PARQUET_GEOMETRY, wkb))
+        self.pendingRows += len(shapes)
+        self.flush_parquet()
+
+    def flush_parquet(self, last=False):
+        # Writes the full row groups gathered so far, and the rest if 'last'
+        if not last and self.pendingRows < PARQUET_ROW_GROUP_SIZE:
+            return
+        if not self.pending:
+            if self.written:
+                return
+            # Every feature was removed, still create the (empty) file
+            self.pending.append(self.empty_parquet_table())
+
+        table = pyarrow.concat_tables(self.pending)
+        rows = len(table)
+        if not last:
+            rows -= rows % PARQUET_ROW_GROUP_SIZE
+        if self.parquetWriter is None:
+            self.parquetWriter = pyarrow.parquet.ParquetWriter(
+                self.outFile, self.parquet_schema(table.schema)
+            )
+        self.parquetWriter.write_table(
+            table.slice(0, rows), row_group_size=PARQUET_ROW_GROUP_SIZE
+        )
+        self.written = True
+        rest = table.slice(rows)
+        self.pending = [rest] if len(rest) else []
+        self.pendingRows = len(rest)
+
+    def parquet_schema(self, schema):
+        # The schema of the batches, with the GeoParquet metadata of the geometry column.
+        # The crs is the WKT of the input crs, or null if it has none.
+        with fiona.open(self.inFile, "r") as input:
+            crs = input.crs.to_wkt() if input.crs else None
+        geo = {
+            "version": "1.0.0",
+            "primary_column": PARQUET_GEOMETRY,
+            "columns": {
+                PARQUET_GEOMETRY: {"encoding": "WKB", "geometry_types": [], "crs": crs}
+            },
+        }
+        return schema.with_metadata({b"geo": json.dumps(geo).encode("utf-8")})
+
+    def empty_parquet_table(self):
+        # A table without rows, with the fields of the input and the geometry column
+        meta, records = pyogrio.raw.read_arrow(
+            self.inFile, read_geometry=False, max_features=0
+        )
+        return records.append_column(
+            PARQUET_GEOMETRY, pyarrow.array([], type=pyarrow.binary())
+        )
+
+    def write_stream(self, shapes, records):
+        """
+        Adds a batch to an output pyogrio can not append to. The first batch starts a
+        thread creating the layer with one pyogrio.raw.write_arrow call, which reads the
+        batches from a queue of STREAM_QUEUE_SIZE batches, so memory does not grow with
+        the output.
+        """
+        wkb = pyarrow.array(shapely.to_wkb(shapes), type=pyarrow.binary())
+        table = records.append_column(STREAM_GEOMETRY, wkb)
+        if self.stream is None:
+            self.start_stream(table.schema)
+        elif table.schema != self.streamSchema:
+            table = table.cast(self.streamSchema)
+        for batch in table.to_batches():
+            if not self.put_stream(batch):
+                raise self.streamError
+
+    def start_stream(self, schema):
+        self.stream = queue.Queue(STREAM_QUEUE_SIZE)
+        self.streamSchema = schema
+        reader = pyarrow.RecordBatchReader.from_batches(schema, self.stream_batches())
+        self.streamThread = threading.Thread(target=self.run_stream, args=(reader,))
+        self.streamThread.start()
+        self.written = True
+
+    def stream_batches(self):
+        # The batches of the queue, up to None (the end of the output) or an exception
+        # (the output is abandoned)
+        while True:
+            batch = self.stream.get()
+            if batch is None:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+
+    def run_stream(self, reader):
+        # Run by the stream thread, the error is raised again by the writer
+        try:
+            pyogrio.raw.write_arrow(
+                reader,
+                self.outFile,
+                driver=self.driver,
+                geometry_name=STREAM_GEOMETRY,
+                geometry_type=self.geometry_type(),
+                crs=self.info["crs"],
+                encoding=self.info["encoding"],
+                layer_options=LAYER_OPTIONS.get(self.driver),
+            )
+        except BaseException as error:
+            self.streamError = error
+
+    def put_stream(self, item):
+        # Queues 'item' for the stream thread, False if the thread has stopped
+        while self.streamThread.is_alive():
+            try:
+                self.stream.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def close_stream(self, error):
+        # Ends the stream, or abandons it when the writer is closed by 'error'
+        self.put_stream(error)
+        self.streamThread.join()
+        if error is None and self.streamError is not None:
+            raise self.streamError
+
+    def geometry_type(self):
+        # The geometry type of the output layer
+        if self.driver in MIXED_GEOMETRY_DRIVERS:
+            return "Unknown"
+        return self.info["geometry_type"]
+
+    def write_arrow(self, shapes, records):
+        # Appends the batch with pyogrio, the first batch creates the file
+        if records is None:
+            fieldNames = list(self.info["fields"])
+            fieldData = [
+                np.empty(0, dtype=dtype) for dtype in self.info["dtypes"].tolist()
+            ]
+        else:
+            fieldNames = records.column_names
+            fieldData = [
+                records.column(name).to_numpy() for name in records.column_names
+            ]
+
+        pyogrio.raw.write(
+            self.outFile,
+            geometry=shapely.to_wkb(shapes),
+            field_data=fieldData,
+            fields=fieldNames,
+            driver=self.driver,
+            geometry_type=self.geometry_type(),
+            crs=self.info["crs"],
+            encoding=self.info["encoding"],
+            promote_to_multi=False,
+            append=self.written,
+            layer_options=LAYER_OPTIONS.get(self.driver),
+        )
+        self.written = True
+
+
+def enable_fiona_driver(driver):
+    # fiona only writes the drivers of fiona.supported_drivers, add GDAL's other ones
+    if driver in fiona.supported_drivers:
+        return
+    with fiona.Env() as env:
+        if driver not in env.drivers():
+            raise ValueError("GDAL can not write " + repr(driver) + " files")
+    fiona.supported_drivers[driver] = "rw"
@@ -3,6 +3,7 @@ __author__ = "asimmons"
 import sys
 import copy
 import fiona
+import numpy as np
 import shapely
 from shapely.geometry import (
     shape,
@@ -13,9 +14,11 @@ from shapely.geometry import (
     MultiPolygon,
 )
 from shapely.geometry.polygon import LinearRing
-import heapq
 from trianglecalculator import TriangleCalculator
+from eliminationengine import EliminationEngine, FIXED_AREA
 from arcthreshold import ArcThreshold
+from rankstore import RankStore
+from junctionfinder import JunctionFinder
 
 # Turns on extra validation
 validate = True
@@ -28,10 +31,22 @@ class GeomSimplify(object):
     # default quantization factor is 1
     quantitizationFactor = (1, 1)
 
-    def __init__(self, dictJunctions=None, dictArcThresholds=None):
+    def __init__(
+        self,
+        dictJunctions=None,
+        dictArcThresholds=None,
+        preventIntersections=False,
+        prefilter=None,
+    ):
         self.dictJunctions = dictJunctions
         self.dictArcThresholds = dictArcThresholds
         self.dictSimpleArcs = {}  # Stores simplified arcs from bordering polygons
+        # Refuse eliminations that would make a ring or arc set cross itself
+        # (see EliminationEngine)
+        self.preventIntersections = preventIntersections
+        # Pre-pass run before the elimination (see prefilter_chains): None for none, 0
+        # to remove collinear points, or the size of the stair steps to collapse too
+        self.prefilter = prefilter
 
     def create_ring_from_arcs(self, arcList):
         ringPoints = []
@@ -78,93 +93,16 @@ class GeomSimplify(object):
 
         """
 
-        # Build list of Triangles from the line points
-        triangleArray = []
-        ## each triangle contains an index and a point (x,y)
-        # handle line 'interior' (i.e. the vertices
-        #  between start and end) first -- explicitly
-        # defined using the below slice notation
-        # i.e. [1:-1]
-        for index, point in enumerate(line.coords[1:-1]):
-            triangleArray.append(TriangleCalculator(point, index))
-
-        # then create start/end points separate from the triangleArray (meaning
-        # we cannot have the start/end points included in the heap sort)
-        startIndex = 0
-        endIndex = len(line.coords) - 1
-        startTriangle = TriangleCalculator(line.coords[startIndex], startIndex)
-        endTriangle = TriangleCalculator(line.coords[endIndex], endIndex)
-
-        # Hook up triangles with next and prev references (doubly-linked list)
-        # NOTE: linked list are composed of nodes, which have at
-        # least one link to another node (and this is a doubly-linked list..pointing at
-        # both our prevTriangle & our nextTriangle)
-        # NOTE: in this code block the 'triangle' is our 'triangle node'
-
-        for index, triangle in enumerate(triangleArray):
-            # set prevIndex to be the adjacent point to index
-            prevIndex = index - 1
-            nextIndex = index + 1
-
-            if prevIndex >= 0:
-                triangle.prevTriangle = triangleArray[prevIndex]
-            else:
-                triangle.prevTriangle = startTriangle
-
-            if nextIndex < len(triangleArray):
-                triangle.nextTriangle = triangleArray[nextIndex]
-            else:
-                triangle.nextTriangle = endTriangle
-
-        # Build a min-heap from the TriangleCalculator list
-        # print("triangleArray: ", triangleArray)
-        heapq.heapify(triangleArray)
-
-        # Simplify steps...
-
-        # Note: in contrast
-        # to our function 'simplify_ring'
-        # we can allow our array to go down to 0 and STILL have a valid line
-        # because we will still have the start and end points
-        while len(triangleArray) > 0:
-            # if the smallest triangle is greater than the threshold, we can stop
-            # i.e. loop to point where the heap head is >= threshold
-            if triangleArray[0].calcArea() >= threshold:
-                # print "break"
-                break
-            else:
-                # print statement for debugging - prints area's and coords of deleted/simplified pts
-                # print "simplify...triangle area's and their corresponding points that were less then the threshold"
-                # print "area = " + str(triangleArray[0].calcArea()) + ", point = " + str(triangleArray[0].point)
-                prev = triangleArray[0].prevTriangle
-                next = triangleArray[0].nextTriangle
-                prev.nextTriangle = next
-                next.prevTriangle = prev
-                # This has to be done after updating the linked list
-                # in order for the areas to be correct when the
-                # heap re-sorts
-                heapq.heappop(triangleArray)
-                heapq.heapify(triangleArray)
-
-        # Create an list of indices from the triangleRing heap
-        indexList = []
-        for triangle in triangleArray:
-            # add 1 b/c the triangle array's first index is actually the second point
-            indexList.append(triangle.ringIndex + 1)
-        # Append start and end points back into the array
-        indexList.append(startTriangle.ringIndex)
-        indexList.append(endTriangle.ringIndex)
-
-        # Sort the index list
-        indexList.sort()
-
-        # Create a new simplified ring
-        simpleLine = []
-        for index in indexList:
-            simpleLine.append(line.coords[index])
+        # Eliminate the line 'interior' (i.e. the vertices between start and end).
+        # The engine keeps the start/end points out of the heap, so we can allow
+        # the line to go down to just those 2 points and STILL have a valid line
+        points = self.prefilter_points(list(line.coords))
+        engine = EliminationEngine(self.preventIntersections)
+        chain = engine.add_line(points, threshold)
+        engine.eliminate()
 
-        # Convert list into LineString
-        simpleLine = LineString(simpleLine)
+        # Create a new simplified line from the points left on the chain
+        simpleLine = LineString([points[index] for index in engine.kept_indices(chain)])
 
         return simpleLine
 
@@ -224,22 +162,20 @@ class GeomSimplify(object):
                     simpleArc = None
                     myThreshold = threshold
                     if self.dictArcThresholds:  # If we are using dynamic thresholds
-                        start = self.quantitize(arc.coords[0])
-                        end = self.quantitize(arc.coords[-1])
-                        # arcKey = ArcThreshold.get_string(start,end)
-                        arcString = ArcThreshold.get_string(start, end)
-                        myThreshold = self.dictArcThresholds[arcString]
+                        arcKey = self.arc_key(arc.coords[0], arc.coords[-1])
+                        myThreshold = self.dictArcThresholds[arcKey]
 
                         # If we have already simplified this arc, copy the existing simplified arc.
                         # This ensures the borders between polygons are simplified exactly the same.
-                        if arcString in self.dictSimpleArcs:
-                            simpleArc = self.dictSimpleArcs[arcString]
+                        if arcKey in self.dictSimpleArcs:
+                            simpleArc = self.dictSimpleArcs[arcKey]
                             # Since the saved Simple arc may be in reversed order, check that the start points match, and reverse if not
+                            start = self.quantitize(arc.coords[0])
                             if start != self.quantitize(simpleArc.coords[0]):
                                 simpleArc = self.reverse_arc(simpleArc)
                         else:
                             simpleArc = self.simplify_line(arc, myThreshold)
-                            self.dictSimpleArcs[arcString] = simpleArc
+                            self.dictSimpleArcs[arcKey] = simpleArc
                     else:  # If we are NOT using dynamic thresholds
                         simpleArc = self.simplify_line(arc, myThreshold)
 
@@ -328,74 +264,20 @@ class GeomSimplify(object):
                 if quant_point in dictJunctions:
                     raise ValueError("Ring has junctions on it")
 
-        # Build list of TriangleCalculators
-        triangleRing = []
-        ## each triangle contains an index and a point (x,y)
-        ## because rings have a point on top of a point
-        ## we are skipping the last point by using slice notation[:-1]
-        ## *i.e. 'a[:-1]' # everything except the last item*
-        for index, point in enumerate(ring.coords[:-1]):
-            triangleRing.append(TriangleCalculator(point, index))
-
-        # Hook up triangles with next and prev references (doubly-linked list)
-        for index, triangle in enumerate(triangleRing):
-            # set prevIndex to be the adjacent point to index
-            # these steps are necessary for dealing with
-            # closed rings
-            prevIndex = index - 1
-            if prevIndex < 0:
-                # if prevIndex is less than 0, then it means index = 0, and
-                # the prevIndex is set to last value in the index
-                # (i.e. adjacent to index[0])
-                prevIndex = len(triangleRing) - 1
-            # set nextIndex adjacent to index
-            nextIndex = index + 1
-            if nextIndex == len(triangleRing):
-                # if nextIndex is equivalent to the length of the array
-                # set nextIndex to 0
-                nextIndex = 0
-            triangle.prevTriangle = triangleRing[prevIndex]
-            triangle.nextTriangle = triangleRing[nextIndex]
-
-        # Build a min-heap from the TriangleCalculator list
-        heapq.heapify(triangleRing)
-
-        # Simplify
-        while len(triangleRing) > minimumPoints:
-            # if the smallest triangle is greater than the threshold, we can stop
-            # i.e. loop to point where the heap head is >= threshold
-
-            if triangleRing[0].calcArea() >= threshold:
-                break
-            else:
-                prev = triangleRing[0].prevTriangle
-                next = triangleRing[0].nextTriangle
-                prev.nextTriangle = next
-                next.prevTriangle = prev
-                # This has to be done after updating the linked list
-                # in order for the areas to be correct when the
-                # heap re-sorts
-                heapq.heappop(triangleRing)
+        # Eliminate points until the smallest triangle reaches the threshold.
+        # Because rings have a point on top of a point we are skipping the
+        # last point by using slice notation[:-1]
+        points = self.prefilter_points(list(ring.coords)[:-1], True)
+        engine = EliminationEngine(self.preventIntersections)
+        chain = engine.add_ring(points, threshold, minimumPoints)
+        engine.eliminate()
 
         # Handle case where we've removed too many points for the ring to be a polygon
-        if len(triangleRing) < 3:
+        if engine.chain_count(chain) < 3:
             return None
 
-        # Create an list of indices from the triangleRing heap
-        indexList = []
-        for triangle in triangleRing:
-            indexList.append(triangle.ringIndex)
-
-        # Sort the index list
-        indexList.sort()
-
         # Create a new simplified ring
-        simpleRing = []
-        for index in indexList:
-            simpleRing.append(ring.coords[index])
-
-        # Convert list into LinearRing
-        simpleRing = LinearRing(simpleRing)
+        simpleRing = LinearRing([points[index] for index in engine.kept_indices(chain)])
 
         # print statements for debugging to check if points are being reduced...
         # print "Starting size: " + str(len(ring.coords))
@@ -403,6 +285,356 @@ class GeomSimplify(object):
 
         return simpleRing
 
+    def simplify_batch(
+        self, coords, offsets, threshold, closed=False, minimumPoints=2, groups=None
+    ):
+        """
+        Simplifies many lines or rings at once, without building any per-point objects.
+
+        coords = (N, 2) NumPy array of the points of every line/ring, one after another
+        (the layout produced by shapely.get_coordinates)
+        offsets = NumPy array of len(lines/rings) + 1 where each line/ring starts in coords
+        (like the offsets produced by shapely.to_ragged_array)
+        threshold = a single threshold, or one threshold per line/ring
+        closed = True if coords holds rings, which repeat their first point at the end
+        groups = the lines/rings checked against each other with preventIntersections,
+        one integer per line/ring or a single value (by default each one on its own)
+
+        Returns a NumPy boolean array over coords, True for the points that are kept. The
+        closing point of a ring is always False (rebuilding the ring closes it again).
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        if closed:
+            # Rings have a point on top of a point, drop the repeated last point
+            counts = np.diff(offsets)
+            points = np.ones(len(coords), dtype=bool)
+            points[offsets[1:][counts > 0] - 1] = False
+            engineOffsets = np.concatenate(([0], np.cumsum(np.maximum(counts - 1, 0))))
+        else:
+            points = slice(None)
+            engineOffsets = offsets
+
+        engineCoords = coords[points, :2]
+        prefiltered = self.prefilter_chains(engineCoords, engineOffsets, closed)
+        if not prefiltered.all():
+            engineCoords = engineCoords[prefiltered]
+            engineOffsets = np.searchsorted(np.flatnonzero(prefiltered), engineOffsets)
+
+        engine = EliminationEngine(self.preventIntersections)
+        engine.add_chains(
+            engineCoords[:, 0],
+            engineCoords[:, 1],
+            engineOffsets,
+            closed,
+            threshold,
+            minimumPoints,
+            groups,
+        )
+        engine.eliminate()
+
+        prefiltered[prefiltered] = engine.kept_mask()
+        mask = np.zeros(len(coords), dtype=bool)
+        mask[points] = prefiltered
+        return mask
+
+    def prefilter_chains(self, coords, offsets, closed=False):
+        """
+        The linear-time pre-pass run before the elimination. Returns a NumPy boolean
+        array over 'coords', True for the points left to the elimination.
+
+        coords = (N, 2) NumPy array of the points of every line/ring, one after another
+        offsets = NumPy array of len(lines/rings) + 1 where each line/ring starts in coords
+        closed = True if the chains are rings, WITHOUT their repeated closing point
+
+        With prefilter > 0, single stair steps are collapsed first. A step is an
+        axis-parallel edge at most prefilter long (a pixel of a polygonized raster)
+        between a left and a right turn onto perpendicular axis-parallel edges; a
+        one pixel wide spike or notch turns the same way twice and is not a step.
+        Every other corner of a run of such corners
+        is removed, starting with the first, so the neighbors of a removed corner stay
+        and the outline moves by at most prefilter. The steps are not checked for
+        crossings, so they are kept with preventIntersections.
+        Then (prefilter >= 0) the points exactly collinear with their neighbors are
+        removed. Their triangles have no area, so the elimination would remove them
+        anyway, after pushing them through its heap.
+
+        The end points of lines (the junctions, once cut into arcs) are always kept.
+        A ring that would keep fewer than 3 points is left whole.
+        """
+        keep = np.ones(len(coords), dtype=bool)
+        if self.prefilter is None or not len(coords):
+            return keep
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        if self.prefilter > 0 and not self.preventIntersections:
+            previous, following, inner = chain_neighbors(offsets, closed)
+            before = coords - coords[previous]
+            after = coords[following] - coords
+            # An axis-parallel edge moves along exactly one axis
+            alongX = (before[:, 0] != 0) & (before[:, 1] == 0)
+            alongY = (before[:, 0] == 0) & (before[:, 1] != 0)
+            nextX = (after[:, 0] != 0) & (after[:, 1] == 0)
+            nextY = (after[:, 0] == 0) & (after[:, 1] != 0)
+            # +1 / -1 for a left / right turn between perpendicular axis-parallel edges
+            turn = np.where(
+                inner & ((alongX & nextY) | (alongY & nextX)),
+                np.sign(before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]),
+                0,
+            )
+            # A step is a short edge between two opposite turns
+            shortBefore = np.abs(before).sum(1) <= self.prefilter
+            shortAfter = np.abs(after).sum(1) <= self.prefilter
+            corner = (turn != 0) & (
+                (shortBefore & (turn[previous] == -turn))
+                | (shortAfter & (turn[following] == -turn))
+            )
+            if closed:
+                # Runs do not wrap around the start of a ring
+                corner[offsets[:-1][np.diff(offsets) > 0]] = False
+
+            if corner.any():
+                runStart = corner & ~np.concatenate(([False], corner[:-1]))
+                position = (
+                    np.arange(len(coords))
+                    - np.flatnonzero(runStart)[np.maximum(np.cumsum(runStart) - 1, 0)]
+                )
+                keep &= ~(corner & (position % 2 == 0))
+
+        # Collinear points of what is left
+        kept = np.flatnonzero(keep)
+        keptOffsets = np.searchsorted(kept, offsets)
+        keptCoords = coords[kept]
+        previous, following, inner = chain_neighbors(keptOffsets, closed)
+        before = keptCoords - keptCoords[previous]
+        after = keptCoords[following] - keptCoords
+        cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+        keep[kept[inner & (cross == 0)]] = False
+
+        if closed:
+            counts = np.diff(offsets)
+            chainOfPoint = np.repeat(np.arange(len(counts)), counts)
+            keptCounts = np.bincount(chainOfPoint[keep], minlength=len(counts))
+            tooFew = (keptCounts < 3)[chainOfPoint]
+            keep[tooFew] = True
+        return keep
+
+    def prefilter_points(self, points, closed=False):
+        """
+        Returns the points of a line (or a ring, without its repeated closing point)
+        that pass prefilter_chains, or 'points' itself without a prefilter.
+        """
+        if self.prefilter is None or not points:
+            return points
+        coords = np.array([point[:2] for point in points], dtype=np.float64)
+        keep = self.prefilter_chains(coords, [0, len(points)], closed)
+        return [point for point, kept in zip(points, keep) if kept]
+
+    def simplify_geometries(self, geoms, threshold):
+        """
+        Simplifies a whole array of LineStrings, MultiLineStrings, Polygons and
+        MultiPolygons in one pass. Returns a NumPy object array of shapely geometries in
+        the same order, with None where simplify_polygon/simplify_multipolygon would
+        return None.
+
+        threshold = a single threshold, or one threshold per geometry
+
+        Coordinates are gathered with shapely.get_coordinates, every line and ring is
+        eliminated by one engine and the results are rebuilt in bulk with the shapely
+        constructors. Only 2D coordinates are kept. With preventIntersections the lines
+        and rings of a feature are checked against each other.
+        """
+        geoms = np.asarray(geoms, dtype=object)
+        thresholds = np.broadcast_to(
+            np.asarray(threshold, dtype=np.float64), (len(geoms),)
+        )
+        result = np.full(len(geoms), None, dtype=object)
+
+        typeIds = shapely.get_type_id(geoms)
+        isLine = (typeIds == 1) | (typeIds == 5)
+        isPolygon = (typeIds == 3) | (typeIds == 6)
+        unhandled = ~(isLine | isPolygon)
+        if unhandled.any():
+            raise ValueError(
+                "Unhandled geometry type: "
+                + repr(shapely.get_type_id(geoms[unhandled][0]))
+            )
+
+        # Empty geometries have no lines or rings: an empty LineString is kept as
+        # simplify_line keeps it, the other types are removed
+        empty = shapely.is_empty(geoms)
+        emptyLine = empty & (typeIds == 1)
+        result[emptyLine] = geoms[emptyLine]
+        isLine &= ~empty
+        isPolygon &= ~empty
+
+        # Lines keep their start and end points, so no line can be removed
+        if isLine.any():
+            featureIndex = np.flatnonzero(isLine)
+            lines, lineFeature = shapely.get_parts(geoms[isLine], return_index=True)
+            coords, lineOfCoord = shapely.get_coordinates(lines, return_index=True)
+            offsets = np.concatenate(
+                ([0], np.cumsum(np.bincount(lineOfCoord, minlength=len(lines))))
+            )
+            mask = self.simplify_batch(
+                coords,
+                offsets,
+                thresholds[featureIndex][lineFeature],
+                groups=featureIndex[lineFeature],
+            )
+            simpleLines = shapely.linestrings(coords[mask], indices=lineOfCoord[mask])
+
+            single = typeIds[featureIndex] == 1
+            result[featureIndex[single]] = simpleLines[single[lineFeature]]
+            multi = ~single[lineFeature]
+            if multi.any():
+                shapely.multilinestrings(
+                    simpleLines[multi],
+                    indices=featureIndex[lineFeature[multi]],
+                    out=result,
+                )
+
+        if isPolygon.any():
+            featureIndex = np.flatnonzero(isPolygon)
+            polys, polyFeature = shapely.get_parts(geoms[isPolygon], return_index=True)
+            rings, ringPoly = shapely.get_rings(polys, return_index=True)
+            coords, ringOfCoord = shapely.get_coordinates(rings, return_index=True)
+            offsets = np.concatenate(
+                ([0], np.cumsum(np.bincount(ringOfCoord, minlength=len(rings))))
+            )
+            mask = self.simplify_batch(
+                coords,
+                offsets,
+                thresholds[featureIndex][polyFeature][ringPoly],
+                True,
+                groups=featureIndex[polyFeature][ringPoly],
+            )
+
+            # A ring needs at least 3 points, and a polygon needs its exterior ring
+            # (the first ring of each polygon)
+            keptCounts = np.bincount(ringOfCoord[mask], minlength=len(rings))
+            isExterior = np.concatenate(([True], ringPoly[1:] != ringPoly[:-1]))
+            validPoly = np.zeros(len(polys), dtype=bool)
+            validPoly[ringPoly[isExterior]] = keptCounts[isExterior] >= 3
+            keepRing = (keptCounts >= 3) & validPoly[ringPoly]
+
+            keepCoord = mask & keepRing[ringOfCoord]
+            ringNumbers = np.cumsum(keepRing) - 1
+            simpleRings = shapely.linearrings(
+                coords[keepCoord], indices=ringNumbers[ringOfCoord[keepCoord]]
+            )
+            polyNumbers = np.cumsum(validPoly) - 1
+            simplePolys = shapely.polygons(
+                simpleRings, indices=polyNumbers[ringPoly[keepRing]]
+            )
+
+            polyFeatureKept = featureIndex[polyFeature[validPoly]]
+            single = typeIds[polyFeatureKept] == 3
+            result[polyFeatureKept[single]] = simplePolys[single]
+            if (~single).any():
+                shapely.multipolygons(
+                    simplePolys[~single], indices=polyFeatureKept[~single], out=result
+                )
+
+        return result
+
+    def rank_line(self, line):
+        """
+        Runs the elimination of a LineString to the end. Returns a chain tuple
+        (points, areas, False) with the effective area of every point (start and end
+        points get an infinite area).
+        """
+        points = list(line.coords)
+        engine = EliminationEngine()
+        chain = engine.add_line(points)
+        engine.eliminate()
+        return (points, engine.effective_areas(chain), False)
+
+    def rank_ring(self, ring, dictJunctions=None):
+        """
+        Runs the elimination of a ring down to 2 points. Returns a chain tuple
+        (points, areas, True); the repeated last point of the ring is left out.
+        """
+        # A ring must not have any junctions on it!
+        if validate and dictJunctions:
+            for point in ring.coords:
+                if self.quantitize(point) in dictJunctions:
+                    raise ValueError("Ring has junctions on it")
+
+        points = list(ring.coords)[:-1]
+        engine = EliminationEngine()
+        chain = engine.add_ring(points)
+        engine.eliminate()
+        return (points, engine.effective_areas(chain), True)
+
+    def rank_lines(self, coords, offsets):
+        """
+        Runs the elimination of many lines to the end at once (coords and offsets in the
+        layout of simplify_batch). Returns a NumPy array over coords with the effective
+        area of every point, the same areas rank_line gives each line, in the same engine
+        simplify_batch uses.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        engine = EliminationEngine()
+        engine.add_chains(coords[:, 0], coords[:, 1], offsets, False, FIXED_AREA)
+        engine.eliminate()
+        return engine.effective_area_array()
+
+    def rank_polygon(self, poly):
+        """
+        Returns the chains of a polygon, exterior ring first.
+        """
+        chains = [self.rank_ring(poly.exterior)]
+        for ring in poly.interiors:
+            chains.append(self.rank_ring(ring))
+
+        return chains
+
+    def rank_shape(self, myShape):
+        """
+        Ranks every vertex of a shape so it can be simplified for any threshold later
+        (see RankStore). Returns (geometry type name, [part, ...]) where a part is a list
+        of (points, areas, isRing) chains.
+
+        Every line and ring is ranked on its own; in topology mode the unique arcs of the
+        layer are ranked instead (see ArcStore.rank_store).
+        """
+        if isinstance(myShape, LineString):
+            return ("LineString", [[self.rank_line(myShape)]])
+
+        elif isinstance(myShape, MultiLineString):
+            parts = [[self.rank_line(line)] for line in myShape.geoms]
+            return ("MultiLineString", parts)
+
+        elif isinstance(myShape, Polygon):
+            return ("Polygon", [self.rank_polygon(myShape)])
+
+        elif isinstance(myShape, MultiPolygon):
+            parts = [self.rank_polygon(poly) for poly in myShape.geoms]
+            return ("MultiPolygon", parts)
+
+        else:
+            raise ValueError("Unhandled geometry type: " + repr(myShape.type))
+
+    def simplify_to_budget(self, shapes, budget, perFeature=False):
+        """
+        Simplifies shapes to a vertex budget instead of an area threshold. Returns a
+        NumPy object array of the simplified shapes (None where a shape was removed).
+
+        budget = number of points to keep, or fraction of points to keep if below 1
+        perFeature = apply the budget to every shape instead of to all shapes together
+
+        Every shape is simplified on its own; see ArcStore.simplify_to_budget for
+        topology mode.
+        """
+        rankStore = RankStore()
+        for myShape in shapes:
+            rankStore.append(self.rank_shape(myShape))
+        rankStore.finish()
+
+        return rankStore.extract(rankStore.threshold_for_budget(budget, perFeature))
+
     def reverse_arc(self, arc):
         coords = arc.coords
         rev_coords = []
@@ -454,6 +686,22 @@ class GeomSimplify(object):
 
         return (x_quantitized, y_quantitized)
 
+    def quantitize_grid(self, point):
+        # Same rounding as quantitize, but returns the integer grid position
+        return (
+            int(round(point[0] / self.quantitizationFactor[0])),
+            int(round(point[1] / self.quantitizationFactor[1])),
+        )
+
+    def arc_key(self, start, end):
+        """
+        Returns the key of the arc between the points 'start' and 'end' in dictArcThresholds
+        and dictSimpleArcs (the same for both directions).
+        """
+        return ArcThreshold.get_key(
+            self.quantitize_grid(start), self.quantitize_grid(end)
+        )
+
     def __append_junctions(self, dictJunctions, dictNeighbors, pointsList):
         """
         Builds a global dictionary of all the junctions and neighbors found in a
@@ -508,68 +756,74 @@ class GeomSimplify(object):
         Builds a global dictionary of all the junctions and neighbors found in a shapefile.
         """
 
-        # declare dictNeighbors as a global
-        # key = checked quantitized points, value = array of quantitized neighbors
-        dictNeighbors = {}
-
         # loop over each
         with fiona.open(inFile, "r") as input:
 
             # read shapely geometries from file
-            for myGeom in input:
-                myShape = shape(myGeom["geometry"])
+            self.find_all_junctions_in_shapes(
+                (shape(myGeom["geometry"]) for myGeom in input), dictJunctions
+            )
 
-                if isinstance(myShape, LineString):
-                    self.append_junctions_line(myShape, dictJunctions, dictNeighbors)
+    def find_all_junctions_in_shapes(self, shapes, dictJunctions):
+        """
+        Builds a global dictionary of all the junctions and neighbors found in an
+        iterable of shapely geometries.
+        """
 
-                elif isinstance(myShape, MultiLineString):
-                    self.append_junctions_mline(myShape, dictJunctions, dictNeighbors)
+        # The points are quantized and compared in NumPy arrays (see JunctionFinder), which
+        # gives the same junctions as calling append_junctions_* on every shape
+        finder = JunctionFinder(self.quantitizationFactor)
+        finder.find_dict(list(shapes), dictJunctions)
 
-                elif isinstance(myShape, Polygon):
-                    self.append_junctions_polygon(myShape, dictJunctions, dictNeighbors)
+    def find_all_arc_thresholds(self, inFile, dictJunctions, dictIsoThresholds):
+        """
+        Return a dictionary of arc thresholds keyed by GeomSimplify.arc_key(arc_start, arc_end)
+        """
 
-                elif isinstance(myShape, MultiPolygon):
-                    self.append_junctions_mpolygon(
-                        myShape, dictJunctions, dictNeighbors
-                    )
+        with fiona.open(inFile, "r") as input:
+            # read shapely geometries from file
+            shapes = []
+            isoCodes = []
+            for s in input:
+                shapes.append(shape(s["geometry"]))
+                isoCodes.append(s["properties"]["iso3"])
 
-                else:
-                    raise ValueError("Unhandled geometry type: " + repr(myShape.type))
+        return self.find_all_arc_thresholds_in_shapes(
+            shapes, isoCodes, dictJunctions, dictIsoThresholds
+        )
 
-    def find_all_arc_thresholds(self, inFile, dictJunctions, dictIsoThresholds):
+    def find_all_arc_thresholds_in_shapes(
+        self, shapes, isoCodes, dictJunctions, dictIsoThresholds
+    ):
         """
-        Return a dictionary of arc thresholds keyed by ArcThreshold.get_string(arc_start, arc_end)
+        Return a dictionary of arc thresholds keyed by GeomSimplify.arc_key(arc_start, arc_end)
+        for shapely geometries and the iso3 code of each of them.
         """
 
         dictArcThresholds = {}
 
-        with fiona.open(inFile, "r") as input:
-            # read shapely geometries from file
-            for s in input:
-                myShape = shape(s["geometry"])
-                myIso3 = s["properties"]["iso3"]
-
-                # Set threshold from iso thresholds input
-                myThreshold = None
-                if myIso3 in dictIsoThresholds:
-                    myThreshold = dictIsoThresholds[myIso3]
-                else:
-                    raise ValueError(
-                        "iso3 is missing from dictIsoThresholds. Iso3: " + repr(myIso3)
-                    )
+        for myShape, myIso3 in zip(shapes, isoCodes):
+            # Set threshold from iso thresholds input
+            myThreshold = None
+            if myIso3 in dictIsoThresholds:
+                myThreshold = dictIsoThresholds[myIso3]
+            else:
+                raise ValueError(
+                    "iso3 is missing from dictIsoThresholds. Iso3: " + repr(myIso3)
+                )
+
+            # Update thresholds for each arc for polygons and multi-polygons
+            if isinstance(myShape, Polygon):
+                self.update_arc_thresholds_polygon(
+                    myShape, myThreshold, dictJunctions, dictArcThresholds
+                )
 
-                # Update thresholds for each arc for polygons and multi-polygons
-                if isinstance(myShape, Polygon):
+            if isinstance(myShape, MultiPolygon):
+                for polygon in myShape.geoms:
                     self.update_arc_thresholds_polygon(
-                        myShape, myThreshold, dictJunctions, dictArcThresholds
+                        polygon, myThreshold, dictJunctions, dictArcThresholds
                     )
 
-                if isinstance(myShape, MultiPolygon):
-                    for polygon in myShape.geoms:
-                        self.update_arc_thresholds_polygon(
-                            polygon, myThreshold, dictJunctions, dictArcThresholds
-                        )
-
         return dictArcThresholds
 
     def update_arc_thresholds_polygon(
@@ -588,22 +842,19 @@ class GeomSimplify(object):
 
         arcList = self.cut_ring_by_junctions(polygon.exterior, dictJunctions)
         for arc in arcList:
-            start = self.quantitize(arc.coords[0])
-            end = self.quantitize(arc.coords[-1])
-            if not ArcThreshold.get_string(start, end) in dictArcThresholds:
-                dictArcThresholds[ArcThreshold.get_string(start, end)] = threshold
+            arcKey = self.arc_key(arc.coords[0], arc.coords[-1])
+            if not arcKey in dictArcThresholds:
+                dictArcThresholds[arcKey] = threshold
                 if validate:
-                    dictArcThresholdCounts[ArcThreshold.get_string(start, end)] = 1
+                    dictArcThresholdCounts[arcKey] = 1
             else:
-                dictArcThresholds[ArcThreshold.get_string(start, end)] = (
-                    dictArcThresholds[ArcThreshold.get_string(start, end)] + threshold
-                ) / 2
+                dictArcThresholds[arcKey] = (dictArcThresholds[arcKey] + threshold) / 2
                 if validate:
-                    dictArcThresholdCounts[ArcThreshold.get_string(start, end)] += 1
-                    if dictArcThresholdCounts[ArcThreshold.get_string(start, end)] > 2:
+                    dictArcThresholdCounts[arcKey] += 1
+                    if dictArcThresholdCounts[arcKey] > 2:
                         raise ValueError(
                             "More than 2 arcs have the same start and end points: "
-                            + ArcThreshold.get_string(start, end)
+                            + repr((arc.coords[0], arc.coords[-1]))
                         )
 
     def append_junctions_line(self, myShape, dictJunctions, dictNeighbors):
@@ -798,6 +1049,28 @@ class GeomSimplify(object):
                 junctionPoints.append(qp)
         return len(junctionPoints)
 
+    def add_junctions_to_shapes(self, shapes, dictJunctions):
+        """
+        Adds the artificial junctions (see add_junctions_to_ring) of every polygon
+        exterior ring of 'shapes' with 1 or 2 junctions, in order, so the rings are
+        later cut with the same junctions whichever feature is simplified first.
+        """
+        for myShape in shapes:
+            if isinstance(myShape, Polygon):
+                polygons = [myShape]
+            elif isinstance(myShape, MultiPolygon):
+                polygons = myShape.geoms
+            else:
+                continue
+            for polygon in polygons:
+                junctionCount = self.count_junctions_in_points_list(
+                    polygon.exterior.coords, dictJunctions
+                )
+                if junctionCount > 0 and junctionCount < 3:
+                    self.add_junctions_to_ring(
+                        polygon.exterior, 3 - junctionCount, dictJunctions
+                    )
+
     # Add artificial junctions to a ring that prevent it from being simplified at the artificial junctions
     def add_junctions_to_ring(self, ring, junctionsToAdd, dictJunctions):
         # Copy ring to temporary
@@ -852,19 +1125,44 @@ class GeomSimplify(object):
                         end_point = self.quantitize(simpleRing.coords[end_index])
 
                     # Get threshold
-                    arc_string = ArcThreshold.get_string(start_point, end_point)
-                    if validate and arc_string not in self.dictArcThresholds:
+                    arcKey = self.arc_key(
+                        simpleRing.coords[start_index], simpleRing.coords[end_index]
+                    )
+                    if validate and arcKey not in self.dictArcThresholds:
                         raise ValueError(
-                            "Arc not found in dictArcThresholds. Arc string: "
-                            + arc_string
+                            "Arc not found in dictArcThresholds. Arc: "
+                            + repr((start_point, end_point))
                         )
-                    threshold = self.dictArcThresholds[arc_string]
+                    threshold = self.dictArcThresholds[arcKey]
 
                     # Now that we have the threshold, add the 2 new arcs that were created by this point
-                    point = self.quantitize(simpleRing.coords[index])
-                    left = self.quantitize(simpleRing.coords[index - 1])
-                    right = self.quantitize(simpleRing.coords[index + 1])
-                    arc1 = ArcThreshold.get_string(left, point)
-                    arc2 = ArcThreshold.get_string(point, right)
+                    point = simpleRing.coords[index]
+                    left = simpleRing.coords[index - 1]
+                    right = simpleRing.coords[index + 1]
+                    arc1 = self.arc_key(left, point)
+                    arc2 = self.arc_key(point, right)
                     self.dictArcThresholds[arc1] = threshold
                     self.dictArcThresholds[arc2] = threshold
+
+
+def chain_neighbors(offsets, closed=False):
+    """
+    For the chains of 'offsets' (the layout of GeomSimplify.simplify_batch), returns the
+    index of the previous and the next point of every point (around the ring if
+    'closed') and a boolean array of the points that have both.
+    """
+    counts = np.diff(offsets)
+    chainOfPoint = np.repeat(np.arange(len(counts)), counts)
+    starts = offsets[:-1][chainOfPoint]
+    ends = offsets[1:][chainOfPoint]
+    index = np.arange(offsets[-1])
+
+    if closed:
+        previous = np.where(index == starts, ends - 1, index - 1)
+        following = np.where(index + 1 == ends, starts, index + 1)
+        inner = (ends - starts) >= 3
+    else:
+        previous = np.maximum(index - 1, starts)
+        following = np.minimum(index + 1, ends - 1)
+        inner = (index != starts) & (index + 1 != ends)
+    return previous, following, inner
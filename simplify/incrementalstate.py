@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import hashlib
+import os
+import numpy as np
+import shapely
+from checkpoint import pack_wkb, unpack_wkb
+
+# Length of the digests of geometries and arcs (sha1)
+DIGEST_SIZE = 20
+
+
+class IncrementalState(object):
+    """
+    IncrementalState - what an incremental run keeps for the next run on an updated
+    version of the same layer (see SimplifyProcess.process_file_incremental).
+
+    The state is a directory:
+        features.npz = for every input feature, in input order: the digest of its WKB
+            (see geometry_digests), the geometry itself and its simplified geometry,
+            both as WKB (see checkpoint.pack_wkb), and the digests of its arcs
+        junctions.npz = (n, 2) int64 quantized grid positions (see JunctionFinder.find)
+            of the junctions found (junctions) and of all the points the arcs were cut at,
+            with the artificial junctions of GeomSimplify.add_junctions_to_ring (cuts)
+        arcs.npz = the digest of every arc of the features (see arc_digest) and its
+            simplified LineString; the arcs no feature uses anymore are left out
+        source.txt = the options of the run (see describe_source), written last
+
+    A state saved with other options is not used.
+    """
+
+    def __init__(
+        self,
+        source,
+        digests,
+        shapes,
+        simplifiedShapes,
+        featureArcs,
+        junctions,
+        cuts,
+        arcCache,
+    ):
+        self.source = source
+        # list of bytes, NumPy object arrays
+        self.digests = digests
+        self.shapes = shapes
+        self.simplifiedShapes = simplifiedShapes
+        # list of the arc digests of every feature
+        self.featureArcs = featureArcs
+        # sets of (x, y) grid positions
+        self.junctions = junctions
+        self.cuts = cuts
+        # arc digest: simplified LineString
+        self.arcCache = arcCache
+
+    @staticmethod
+    def describe_source(
+        quantitizationFactor, threshold, Topology, PreventIntersections, Prefilter
+    ):
+        """
+        Returns a string identifying the options the output depends on (the input is
+        expected to change between runs).
+        """
+        return repr(
+            (
+                tuple(quantitizationFactor),
+                threshold,
+                Topology,
+                PreventIntersections,
+                Prefilter,
+            )
+        )
+
+    def save(self, path):
+        """
+        Saves the state to the directory 'path'. source.txt is removed first and written
+        last, so a state that was only partly written is never loaded.
+        """
+        os.makedirs(path, exist_ok=True)
+        sourceFile = os.path.join(path, "source.txt")
+        if os.path.exists(sourceFile):
+            os.remove(sourceFile)
+
+        shapesWkb, shapesOffsets = pack_wkb(self.shapes)
+        simplifiedWkb, simplifiedOffsets = pack_wkb(self.simplifiedShapes)
+        np.savez(
+            os.path.join(path, "features.npz"),
+            digests=pack_digests(self.digests),
+            wkb=shapesWkb,
+            wkbOffsets=shapesOffsets,
+            simplifiedWkb=simplifiedWkb,
+            simplifiedOffsets=simplifiedOffsets,
+            arcDigests=pack_digests(
+                [digest for arcs in self.featureArcs for digest in arcs]
+            ),
+            arcOffsets=np.concatenate(
+                ([0], np.cumsum([len(arcs) for arcs in self.featureArcs]))
+            ).astype(np.int64),
+        )
+        np.savez(
+            os.path.join(path, "junctions.npz"),
+            junctions=grid_array(self.junctions),
+            cuts=grid_array(self.cuts),
+        )
+        # Only the arcs of the features are kept
+        used = set(digest for arcs in self.featureArcs for digest in arcs)
+        arcCache = {
+            digest: arc for digest, arc in self.arcCache.items() if digest in used
+        }
+        arcWkb, arcOffsets = pack_wkb(list(arcCache.values()))
+        np.savez(
+            os.path.join(path, "arcs.npz"),
+            digests=pack_digests(arcCache),
+            wkb=arcWkb,
+            wkbOffsets=arcOffsets,
+        )
+        with open(sourceFile, "w") as output:
+            output.write(self.source)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads the state saved in the directory 'path'. Returns None if there is no
+        complete state there.
+        """
+        sourceFile = os.path.join(path, "source.txt")
+        if not os.path.exists(sourceFile):
+            return None
+
+        with open(sourceFile, "r") as input:
+            source = input.read()
+        with np.load(os.path.join(path, "features.npz")) as features:
+            digests = unpack_digests(features["digests"])
+            shapes = unpack_wkb(features["wkb"], features["wkbOffsets"])
+            simplifiedShapes = unpack_wkb(
+                features["simplifiedWkb"], features["simplifiedOffsets"]
+            )
+            arcDigests = unpack_digests(features["arcDigests"])
+            arcOffsets = features["arcOffsets"].tolist()
+            featureArcs = [
+                arcDigests[start:end] for start, end in zip(arcOffsets, arcOffsets[1:])
+            ]
+        with np.load(os.path.join(path, "junctions.npz")) as junctions:
+            junctionSet = set(map(tuple, junctions["junctions"].tolist()))
+            cutSet = set(map(tuple, junctions["cuts"].tolist()))
+        with np.load(os.path.join(path, "arcs.npz")) as arcs:
+            arcCache = dict(
+                zip(
+                    unpack_digests(arcs["digests"]),
+                    unpack_wkb(arcs["wkb"], arcs["wkbOffsets"]),
+                )
+            )
+        return IncrementalState(
+            source,
+            digests,
+            shapes,
+            simplifiedShapes,
+            featureArcs,
+            junctionSet,
+            cutSet,
+            arcCache,
+        )
+
+
+def geometry_digests(shapes):
+    """
+    Returns the sha1 digest of the WKB of every geometry of 'shapes' (None where
+    missing). Equal geometries, with the same points in the same order, have equal
+    digests.
+    """
+    return [
+        hashlib.sha1(wkb).digest() if wkb is not None else None
+        for wkb in shapely.to_wkb(np.asarray(shapes, dtype=object))
+    ]
+
+
+def arc_digest(points):
+    """
+    Returns the sha1 digest of the x, y coordinates of an arc (a list of points).
+    """
+    return hashlib.sha1(np.asarray(points, dtype=np.float64)[:, :2].tobytes()).digest()
+
+
+def pack_digests(digests):
+    # Returns the digests (bytes, or None) as an (n, DIGEST_SIZE) uint8 array, zeros
+    # where None
+    return np.frombuffer(
+        b"".join(digest or bytes(DIGEST_SIZE) for digest in digests), dtype=np.uint8
+    ).reshape(-1, DIGEST_SIZE)
+
+
+def unpack_digests(array):
+    # The reverse of pack_digests
+    empty = bytes(DIGEST_SIZE)
+    return [
+        digest if digest != empty else None
+        for digest in map(bytes, np.asarray(array, dtype=np.uint8))
+    ]
+
+
+def grid_array(points):
+    # Returns a set of (x, y) grid positions as an (n, 2) int64 array
+    return np.array(sorted(points), dtype=np.int64).reshape(-1, 2)
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import hashlib
+import os
+import numpy as np
+from arcthreshold import ArcThreshold
+
+# Shapefile parts that change the geometries or the iso3 attribute
+SHAPEFILE_PARTS = (".shp", ".shx", ".dbf")
+
+
+class JunctionCache(object):
+    """
+    JunctionCache - the junctions (and arc thresholds) of a layer, saved between runs.
+
+    Finding the junctions is the most expensive step of topology mode and does not depend
+    on the threshold. The cache is a directory of .npy files:
+        junctions = (n, 2) int64 quantized grid positions (see JunctionFinder.find)
+        arcEnds = (m, 4) int64 grid positions of the start and end of every arc with a
+            dynamic threshold (see ArcThreshold.split_key)
+        arcThresholds = the threshold of every arc of arcEnds
+        source.txt = the input it was built from (see describe_source)
+
+    The arrays are memory mapped when loaded. A cache built from another input file,
+    quantization factor or threshold CSV is rebuilt instead of reused.
+    """
+
+    def __init__(self, source, junctions, arcEnds=None, arcThresholds=None):
+        self.source = source
+        self.junctions = junctions
+        if arcEnds is None:
+            arcEnds = np.zeros((0, 4), dtype=np.int64)
+            arcThresholds = np.zeros(0, dtype=np.float64)
+        self.arcEnds = arcEnds
+        self.arcThresholds = arcThresholds
+
+    @staticmethod
+    def from_dicts(source, quantitizationFactor, dictJunctions, dictArcThresholds=None):
+        """
+        Builds a cache from the dictionaries GeomSimplify uses.
+        """
+        factor = np.asarray(quantitizationFactor, dtype=np.float64)
+        junctions = np.rint(
+            np.array(list(dictJunctions), dtype=np.float64).reshape(-1, 2) / factor
+        ).astype(np.int64)
+
+        arcEnds = None
+        arcThresholds = None
+        if dictArcThresholds is not None:
+            arcEnds = np.array(
+                [
+                    start + end
+                    for start, end in map(ArcThreshold.split_key, dictArcThresholds)
+                ],
+                dtype=np.int64,
+            ).reshape(-1, 4)
+            arcThresholds = np.array(list(dictArcThresholds.values()), dtype=np.float64)
+        return JunctionCache(source, junctions, arcEnds, arcThresholds)
+
+    @staticmethod
+    def describe_source(inFile, quantitizationFactor, DynamicThresholdFile=None):
+        """
+        Returns a string identifying what a cache was built from: a hash of the content of
+        the input file (all the parts of a shapefile), the quantization factor, and a
+        hash of the dynamic threshold CSV file if any.
+        """
+        root, extension = os.path.splitext(inFile)
+        if extension.lower() == ".shp":
+            paths = [root + part for part in SHAPEFILE_PARTS]
+            paths = [path for path in paths if os.path.exists(path)]
+        else:
+            paths = [inFile]
+
+        inputHash = hashlib.sha256()
+        for path in paths:
+            hash_file(path, inputHash)
+
+        thresholdHash = None
+        if DynamicThresholdFile:
+            thresholdHash = hash_file(DynamicThresholdFile).hexdigest()
+
+        return repr((inputHash.hexdigest(), tuple(quantitizationFactor), thresholdHash))
+
+    def save(self, path):
+        """
+        Saves the cache to the directory 'path'. source.txt is written last, so a cache
+        that was only partly written is never loaded.
+        """
+        os.makedirs(path, exist_ok=True)
+        sourceFile = os.path.join(path, "source.txt")
+        if os.path.exists(sourceFile):
+            os.remove(sourceFile)
+
+        np.save(os.path.join(path, "junctions.npy"), self.junctions)
+        np.save(os.path.join(path, "arcEnds.npy"), self.arcEnds)
+        np.save(os.path.join(path, "arcThresholds.npy"), self.arcThresholds)
+        with open(sourceFile, "w") as output:
+            output.write(self.source)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads (memory maps) the cache saved in the directory 'path'. Returns None if there
+        is no complete cache there.
+        """
+        sourceFile = os.path.join(path, "source.txt")
+        if not os.path.exists(sourceFile):
+            return None
+
+        with open(sourceFile, "r") as input:
+            source = input.read()
+        return JunctionCache(
+            source,
+            np.load(os.path.join(path, "junctions.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "arcEnds.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "arcThresholds.npy"), mmap_mode="r"),
+        )
+
+    def junction_dict(self, quantitizationFactor):
+        """
+        Returns the junctions as a dictionary keyed like GeomSimplify.quantitize (the
+        dictJunctions of GeomSimplify).
+        """
+        factorX, factorY = quantitizationFactor
+        return {
+            (x * factorX, y * factorY): 1
+            for x, y in np.asarray(self.junctions).tolist()
+        }
+
+    def arc_threshold_dict(self):
+        """
+        Returns the arc thresholds keyed by GeomSimplify.arc_key (the dictArcThresholds of
+        GeomSimplify).
+        """
+        return {
+            ArcThreshold.get_key((sx, sy), (ex, ey)): threshold
+            for (sx, sy, ex, ey), threshold in zip(
+                np.asarray(self.arcEnds).tolist(),
+                np.asarray(self.arcThresholds).tolist(),
+            )
+        }
+
+
+def hash_file(path, fileHash=None):
+    # Adds the content of the file 'path' to 'fileHash' (a new sha256 if None)
+    if fileHash is None:
+        fileHash = hashlib.sha256()
+    with open(path, "rb") as input:
+        for block in iter(lambda: input.read(1 << 20), b""):
+            fileHash.update(block)
+    return fileHash
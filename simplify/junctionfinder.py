@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import numpy as np
+import shapely
+
+# Turns on extra validation
+validate = True
+
+# shapely geometry type ids
+LINESTRING = 1
+POLYGON = 3
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+
+
+class JunctionFinder(object):
+    """
+    JunctionFinder - finds the junctions of a layer with NumPy instead of per point dictionaries.
+
+    A point is a junction if it is shared by several lines/rings AND its neighbors are not
+    the same everywhere (the same rule as GeomSimplify.find_all_junctions). Here all points
+    are quantized into int64 arrays at once, each point gets an integer id, the neighbors
+    of every occurrence are encoded as a sorted pair of ids, and junctions are the ids
+    with more than one distinct pair (a sort and a group count).
+
+    Like GeomSimplify.__append_junctions:
+        - the first point of a line/ring is not counted as the neighbor of the second one
+        - rings do not wrap around (their closing point is dropped)
+        - interior rings only take part when validate is on, and must have no junctions
+        - two points of the same line/ring may not quantize to the same value
+    """
+
+    def __init__(self, quantitizationFactor=(1, 1)):
+        self.quantitizationFactor = quantitizationFactor
+
+    def chains(self, shapes):
+        """
+        Returns (coords, offsets, isInterior) of every line and ring of 'shapes' in the
+        order __append_junctions visits them. Rings do not repeat their first point.
+        """
+        shapes = np.asarray(shapes, dtype=object)
+        typeIds = shapely.get_type_id(shapes)
+        unhandled = ~np.isin(
+            typeIds, (LINESTRING, POLYGON, MULTILINESTRING, MULTIPOLYGON)
+        )
+        if unhandled.any():
+            raise ValueError(
+                "Unhandled geometry type: "
+                + repr(shapes[np.flatnonzero(unhandled)[0]].geom_type)
+            )
+
+        parts = shapely.get_parts(shapes)
+        isPolygon = shapely.get_type_id(parts) == POLYGON
+
+        # Lines, exterior rings and (if validating) interior rings, in part order
+        chainGeoms = []
+        chainParts = []
+        chainOrder = []
+        chainIsRing = []
+        lineParts = np.flatnonzero(~isPolygon)
+        chainGeoms.append(parts[lineParts])
+        chainParts.append(lineParts)
+        chainOrder.append(np.zeros(len(lineParts), dtype=np.int64))
+        chainIsRing.append(np.zeros(len(lineParts), dtype=bool))
+
+        polygonParts = np.flatnonzero(isPolygon)
+        chainGeoms.append(shapely.get_exterior_ring(parts[polygonParts]))
+        chainParts.append(polygonParts)
+        chainOrder.append(np.zeros(len(polygonParts), dtype=np.int64))
+        chainIsRing.append(np.ones(len(polygonParts), dtype=bool))
+
+        if validate and len(polygonParts):
+            interiorCounts = shapely.get_num_interior_rings(parts[polygonParts])
+            interiorParts = np.repeat(polygonParts, interiorCounts)
+            interiorNumbers = np.arange(interiorCounts.sum()) - np.repeat(
+                np.cumsum(interiorCounts) - interiorCounts, interiorCounts
+            )
+            chainGeoms.append(
+                shapely.get_interior_ring(parts[interiorParts], interiorNumbers)
+            )
+            chainParts.append(interiorParts)
+            chainOrder.append(interiorNumbers + 1)
+            chainIsRing.append(np.ones(len(interiorParts), dtype=bool))
+
+        chainGeoms = np.concatenate(chainGeoms)
+        order = np.lexsort((np.concatenate(chainOrder), np.concatenate(chainParts)))
+        chainGeoms = chainGeoms[order]
+        isRing = np.concatenate(chainIsRing)[order]
+        isInterior = np.concatenate(chainOrder)[order] > 0
+
+        coords, chainOfCoord = shapely.get_coordinates(chainGeoms, return_index=True)
+        counts = np.bincount(chainOfCoord, minlength=len(chainGeoms))
+        ends = np.cumsum(counts)
+
+        # Drop the closing point of the rings
+        keep = np.ones(len(coords), dtype=bool)
+        keep[ends[isRing & (counts > 0)] - 1] = False
+        coords = coords[keep]
+        counts = counts - isRing * (counts > 0)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        return coords, offsets, isInterior
+
+    def quantitize(self, coords):
+        """
+        Returns the quantized grid position of every point as an int64 array of shape (n, 2).
+        Same rounding as GeomSimplify.quantitize (round half to even).
+        """
+        factor = np.asarray(self.quantitizationFactor, dtype=np.float64)
+        return np.rint(coords / factor).astype(np.int64)
+
+    def point_ids(self, grid):
+        """
+        Returns (ids, points): an integer id for every row of 'grid', equal for equal rows,
+        and the grid position of every id.
+        """
+        if len(grid) == 0:
+            return np.zeros(0, dtype=np.int64), grid
+        low = grid.min(axis=0)
+        span = grid.max(axis=0) - low
+        if (span < 2**31).all():
+            # Pack both coordinates into one int64, unique over 1d is much faster
+            packed = ((grid[:, 0] - low[0]) << 32) | (grid[:, 1] - low[1])
+            keys, ids = np.unique(packed, return_inverse=True)
+            points = np.column_stack((keys >> 32, keys & 0xFFFFFFFF)) + low
+            return ids.reshape(-1), points
+        points, ids = np.unique(grid, axis=0, return_inverse=True)
+        return ids.reshape(-1), points
+
+    def find(self, shapes):
+        """
+        Returns the junctions of 'shapes' as an int64 array of quantized grid positions
+        (multiply by the quantization factor to get the GeomSimplify.quantitize values).
+        """
+        coords, offsets, isInterior = self.chains(shapes)
+        grid = self.quantitize(coords)
+        ids, points = self.point_ids(grid)
+
+        count = len(ids)
+        chainCounts = np.diff(offsets)
+        chainOfCoord = np.repeat(np.arange(len(chainCounts)), chainCounts)
+        position = np.arange(count) - offsets[chainOfCoord]
+        length = chainCounts[chainOfCoord]
+
+        if validate:
+            self.check_duplicates(ids, chainOfCoord, position, coords, grid)
+
+        # Neighbors of every occurrence: the previous point (only from the third point on)
+        # and the next point, as a set encoded by a sorted pair (-1 = none)
+        prev = np.full(count, -1, dtype=np.int64)
+        next = np.full(count, -1, dtype=np.int64)
+        hasPrev = position >= 2
+        hasNext = position < length - 1
+        prev[hasPrev] = ids[np.flatnonzero(hasPrev) - 1]
+        next[hasNext] = ids[np.flatnonzero(hasNext) + 1]
+        next[next == prev] = -1
+        low = np.minimum(prev, next)
+        high = np.maximum(prev, next)
+
+        # A point is a junction if its occurrences have more than one distinct neighbor set
+        order = np.lexsort((high, low, ids))
+        ids = ids[order]
+        low = low[order]
+        high = high[order]
+        newSet = np.ones(count, dtype=bool)
+        newSet[1:] = (
+            (ids[1:] != ids[:-1]) | (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+        )
+        setCounts = np.bincount(ids[newSet], minlength=len(points))
+        junctionIds = np.flatnonzero(setCounts > 1)
+
+        if validate and len(junctionIds):
+            interiorIds = np.unique(ids[isInterior[chainOfCoord][order]])
+            if np.isin(junctionIds, interiorIds).any():
+                raise ValueError("Junction found on interior ring")
+
+        return points[junctionIds]
+
+    def check_duplicates(self, ids, chainOfCoord, position, coords, grid):
+        # Two points of the same line/ring must not quantize to the same value
+        order = np.lexsort((position, ids, chainOfCoord))
+        same = (chainOfCoord[order][1:] == chainOfCoord[order][:-1]) & (
+            ids[order][1:] == ids[order][:-1]
+        )
+        if not same.any():
+            return
+
+        first = order[:-1][same]
+        second = order[1:][same]
+        pick = np.lexsort((position[second], chainOfCoord[second]))[0]
+        quant_point = tuple(
+            int(value) * factor
+            for value, factor in zip(grid[second[pick]], self.quantitizationFactor)
+        )
+        raise ValueError(
+            "Two points in the same shape quantitized to the same value - you may need to lower the quantitization factor: "
+            + repr(quant_point)
+            + ".  Points: "
+            + repr(tuple(coords[second[pick]].tolist()))
+            + ", "
+            + repr(tuple(coords[first[pick]].tolist()))
+        )
+
+    def find_dict(self, shapes, dictJunctions):
+        """
+        Adds the junctions of 'shapes' to 'dictJunctions', keyed like GeomSimplify.quantitize.
+        """
+        factorX, factorY = self.quantitizationFactor
+        for x, y in self.find(shapes).tolist():
+            dictJunctions[(x * factorX, y * factorY)] = 1
+        return dictJunctions
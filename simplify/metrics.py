@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import json
+import time
+from contextlib import contextmanager
+
+
+class Metrics(object):
+    """
+    Metrics - where the time of a run goes, and how much it processed.
+
+        phases = {phase name: seconds}, in the order the phases first ran
+        counts = {name: count} (features, vertices, junctions, arcs, ...)
+
+    Phases nest: while a phase runs inside another one, the outer phase is paused, so
+    every second is counted in exactly one phase. That way a phase can wrap a generator
+    (see timed) that pulls from another timed generator.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+        self.stack = []
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the time spent in the 'with' block (minus nested phases) to phase 'name'.
+        """
+        now = time.perf_counter()
+        if self.stack:
+            self.add_time(self.stack[-1][0], now - self.stack[-1][1])
+        self.stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.add_time(name, now - self.stack.pop()[1])
+            if self.stack:
+                self.stack[-1][1] = now
+
+    def timed(self, iterable, name):
+        """
+        Yields the items of 'iterable', the time spent getting each one counted in phase
+        'name'.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """
+        Adds 'value' to the count 'name'.
+        """
+        self.counts[name] = self.counts.get(name, 0) + int(value)
+
+    def finish(self):
+        # Stops the total time of the run
+        self.finished = time.perf_counter()
+
+    def report(self):
+        """
+        Returns the metrics as a dictionary that can be saved as JSON.
+        """
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        total = finished - self.started
+        report = {
+            "total_seconds": total,
+            "phases": dict(self.phases),
+            "counts": dict(self.counts),
+        }
+        if total > 0 and "vertices_in" in self.counts:
+            report["vertices_per_second"] = self.counts["vertices_in"] / total
+        return report
+
+    def save(self, path):
+        """
+        Writes report() to the JSON file 'path'.
+        """
+        with open(path, "w") as output:
+            json.dump(self.report(), output, indent=2)
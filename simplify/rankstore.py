@@ -0,0 +1,345 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import os
+import numpy as np
+import shapely
+
+# shapely geometry type ids
+LINESTRING = 1
+POLYGON = 3
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+
+# Layout of the arrays, part of describe_source so an older sidecar file is rebuilt
+RANK_FORMAT = 2
+
+GEOMETRY_TYPE_IDS = {
+    "LineString": LINESTRING,
+    "Polygon": POLYGON,
+    "MultiLineString": MULTILINESTRING,
+    "MultiPolygon": MULTIPOLYGON,
+}
+
+
+class RankStore(object):
+    """
+    RankStore - effective areas of every vertex of a layer, independent of the threshold.
+
+    Visvalingam's elimination order does not depend on the threshold. The elimination is
+    run to the end once per line, ring or arc (see GeomSimplify.rank_shape and
+    ArcStore.rank_store) and records the (monotonic) area at which each vertex was
+    removed. A vertex is kept for threshold t if its area is >= t, so any threshold can
+    be extracted with a single filter over the arrays.
+
+    The store is kept as flat arrays:
+        coords, areas = every ranked point. In topology mode every unique arc is ranked
+            once, in the direction ArcStore keeps it, and the junctions at its ends are
+            shared with the other arcs that end there.
+        points = for every point of every chain of the features, its index in coords
+        chainOffsets = where each chain starts in points
+        chainIsRing = True for rings (which do not repeat their first point), False for
+            lines
+        partOffsets = where each part (a line, or a polygon with its rings) starts in the chains
+        featureOffsets = where each feature starts in the parts
+        featureTypes = shapely geometry type id of each simplified feature
+
+    Both sides of a border read the same ranked points, so they are kept or removed
+    together for any threshold. The store can be saved next to the output as a sidecar
+    .npz file.
+    """
+
+    def __init__(self, source=""):
+        self.source = source
+        self.coords = []
+        self.areas = []
+        self.points = []
+        self.chainOffsets = [0]
+        self.chainIsRing = []
+        self.partOffsets = [0]
+        self.featureOffsets = [0]
+        self.featureTypes = []
+
+    def append(self, rankedShape):
+        """
+        Appends a shape returned by GeomSimplify.rank_shape:
+        (geometry type name, [part, ...]) where a part is a list of (points, areas, isRing)
+        """
+        geomType, parts = rankedShape
+        self.append_chains(
+            geomType,
+            [
+                [
+                    (self.add_points(points, areas), isRing)
+                    for points, areas, isRing in part
+                ]
+                for part in parts
+            ],
+        )
+
+    def add_points(self, points, areas):
+        """
+        Adds ranked points (and their effective areas) that no feature uses yet. Returns
+        their indices in coords.
+        """
+        start = len(self.areas)
+        self.coords.extend((point[0], point[1]) for point in points)
+        self.areas.extend(areas)
+        return range(start, len(self.areas))
+
+    def append_chains(self, geomType, parts):
+        """
+        Appends a feature made of points already added: (geometry type name, [part, ...])
+        where a part is a list of (indices in coords, isRing) chains.
+        """
+        for part in parts:
+            for indices, isRing in part:
+                self.points.extend(indices)
+                self.chainOffsets.append(len(self.points))
+                self.chainIsRing.append(isRing)
+            self.partOffsets.append(len(self.chainIsRing))
+        self.featureOffsets.append(len(self.partOffsets) - 1)
+        self.featureTypes.append(GEOMETRY_TYPE_IDS[geomType])
+
+    def finish(self):
+        """
+        Converts the store to NumPy arrays once every shape has been appended.
+        """
+        self.coords = np.asarray(self.coords, dtype=np.float64).reshape(-1, 2)
+        self.areas = np.asarray(self.areas, dtype=np.float64)
+        self.points = np.asarray(self.points, dtype=np.int64)
+        self.chainOffsets = np.asarray(self.chainOffsets, dtype=np.int64)
+        self.chainIsRing = np.asarray(self.chainIsRing, dtype=bool)
+        self.partOffsets = np.asarray(self.partOffsets, dtype=np.int64)
+        self.featureOffsets = np.asarray(self.featureOffsets, dtype=np.int64)
+        self.featureTypes = np.asarray(self.featureTypes, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.featureTypes)
+
+    def save(self, path):
+        np.savez(
+            path,
+            source=np.array(self.source),
+            coords=self.coords,
+            areas=self.areas,
+            points=self.points,
+            chainOffsets=self.chainOffsets,
+            chainIsRing=self.chainIsRing,
+            partOffsets=self.partOffsets,
+            featureOffsets=self.featureOffsets,
+            featureTypes=self.featureTypes,
+        )
+
+    @staticmethod
+    def load(path):
+        store = RankStore()
+        with np.load(path) as data:
+            store.source = str(data["source"])
+            store.coords = data["coords"]
+            store.areas = data["areas"]
+            store.points = data["points"]
+            store.chainOffsets = data["chainOffsets"]
+            store.chainIsRing = data["chainIsRing"]
+            store.partOffsets = data["partOffsets"]
+            store.featureOffsets = data["featureOffsets"]
+            store.featureTypes = data["featureTypes"]
+        return store
+
+    @staticmethod
+    def describe_source(inFile, Topology, quantitizationFactor):
+        """
+        Returns a string identifying the input a store was built from, so a stale sidecar
+        file is rebuilt instead of reused.
+        """
+        stat = os.stat(inFile)
+        return repr(
+            (
+                os.path.abspath(inFile),
+                stat.st_size,
+                stat.st_mtime_ns,
+                bool(Topology),
+                tuple(quantitizationFactor),
+                RANK_FORMAT,
+            )
+        )
+
+    def feature_of_point(self):
+        """
+        Returns the index of the feature every entry of points belongs to.
+        """
+        chainOfFeature = self.partOffsets[self.featureOffsets]
+        return np.repeat(
+            np.arange(len(self.featureTypes), dtype=np.int64),
+            np.diff(self.chainOffsets[chainOfFeature]),
+        )
+
+    def vertex_thresholds(self, threshold):
+        """
+        Returns the threshold of every ranked point (of coords) for a single threshold
+        or one threshold per feature. A point used by several features (a border arc in
+        topology mode) gets the largest threshold of those features, so shared borders
+        stay identical and no feature keeps more points than its own threshold keeps.
+        """
+        threshold = np.asarray(threshold, dtype=np.float64)
+        if threshold.ndim == 0:
+            return threshold
+
+        largest = np.zeros(len(self.areas))
+        np.maximum.at(largest, self.points, threshold[self.feature_of_point()])
+        return largest
+
+    def vertex_count(self, threshold):
+        """
+        Returns the number of ranked points kept for a threshold, or one threshold per
+        feature. A border shared by two features is counted once.
+        """
+        return int(np.count_nonzero(self.areas >= self.vertex_thresholds(threshold)))
+
+    @staticmethod
+    def budget_threshold(areas, budget):
+        """
+        Returns the smallest threshold that keeps at most 'budget' of the points with
+        'areas'. Points with an infinite area (line ends, junctions, the last points of
+        a ring) are always kept, so the budget can not go below their number.
+        """
+        if budget >= len(areas):
+            return 0.0
+        if budget <= 0:
+            return np.inf
+
+        # k-th largest area, moved just above it when there is a tie at the cut
+        ordered = np.sort(areas)[::-1]
+        threshold = ordered[budget - 1]
+        if ordered[budget] == threshold:
+            threshold = np.nextafter(threshold, np.inf)
+        return float(threshold)
+
+    def threshold_for_budget(self, budget, perFeature=False):
+        """
+        Returns the threshold that meets a vertex budget: the number of points to keep,
+        or the fraction of points to keep if 'budget' is below 1.
+
+        For the whole layer this is the same as running one priority queue across every
+        line, ring and unique arc until only 'budget' points are left: the effective
+        areas grow along each chain's elimination order, so the smallest areas are the
+        points that queue would remove first. A border is ranked once, so it counts once
+        against the budget and both of its sides are cut at the same point. With
+        'perFeature' the budget applies to every feature (counting all of its own
+        points) and one threshold per feature is returned.
+        """
+        if not perFeature:
+            if budget < 1:
+                budget = int(np.ceil(budget * len(self.areas)))
+            return self.budget_threshold(self.areas, int(budget))
+
+        # Sort the areas of every feature from largest to smallest and pick the
+        # budget-th one of each feature
+        featureOfPoint = self.feature_of_point()
+        areas = self.areas[self.points]
+        counts = np.bincount(featureOfPoint, minlength=len(self.featureTypes))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ordered = areas[np.lexsort((-areas, featureOfPoint))]
+
+        if budget < 1:
+            budgets = np.ceil(budget * counts).astype(np.int64)
+        else:
+            budgets = np.full(len(counts), int(budget), dtype=np.int64)
+
+        thresholds = np.zeros(len(counts))
+        thresholds[budgets <= 0] = np.inf
+        cut = (budgets > 0) & (budgets < counts)
+        kth = ordered[starts[cut] + budgets[cut] - 1]
+        following = ordered[starts[cut] + budgets[cut]]
+        thresholds[cut] = np.where(following == kth, np.nextafter(kth, np.inf), kth)
+        return thresholds
+
+    def extract(self, threshold):
+        """
+        Returns a NumPy object array with the simplified shape of every feature for a
+        threshold, or one threshold per feature (None where simplification removed the
+        feature). The shapes are the same as the ones GeomSimplify's simplify_* methods
+        return for that threshold.
+        """
+        keep = self.areas >= self.vertex_thresholds(threshold)
+        return self.build_geometries(keep[self.points])
+
+    def build_geometries(self, keep):
+        """
+        Rebuilds every feature from the points flagged in 'keep' (a boolean array over
+        points), in bulk.
+        """
+        coords = self.coords[self.points]
+        chainCount = len(self.chainIsRing)
+        partCount = len(self.partOffsets) - 1
+        featureCount = len(self.featureTypes)
+        result = np.full(featureCount, None, dtype=object)
+
+        chainOfCoord = np.repeat(
+            np.arange(chainCount, dtype=np.int64), np.diff(self.chainOffsets)
+        )
+        partOfChain = np.repeat(
+            np.arange(partCount, dtype=np.int64), np.diff(self.partOffsets)
+        )
+        featureOfPart = np.repeat(
+            np.arange(featureCount, dtype=np.int64), np.diff(self.featureOffsets)
+        )
+
+        # A ring needs at least 3 points, and a polygon needs its exterior ring (the
+        # first chain of each part). Lines always keep their start and end points.
+        keptCounts = np.bincount(chainOfCoord[keep], minlength=chainCount)
+        validChain = ~self.chainIsRing | (keptCounts >= 3)
+        validPart = validChain[self.partOffsets[:-1]]
+        keepChain = validChain & validPart[partOfChain]
+        keepCoord = keep & keepChain[chainOfCoord]
+
+        chainNumbers = np.cumsum(keepChain) - 1
+        chainGeoms = np.empty(int(keepChain.sum()), dtype=object)
+        keptChainIsRing = self.chainIsRing[keepChain]
+
+        ringCoord = keepCoord & self.chainIsRing[chainOfCoord]
+        if ringCoord.any():
+            ringNumbers = np.cumsum(keepChain & self.chainIsRing) - 1
+            chainGeoms[keptChainIsRing] = shapely.linearrings(
+                coords[ringCoord], indices=ringNumbers[chainOfCoord[ringCoord]]
+            )
+        lineCoord = keepCoord & ~self.chainIsRing[chainOfCoord]
+        if lineCoord.any():
+            lineNumbers = np.cumsum(keepChain & ~self.chainIsRing) - 1
+            chainGeoms[~keptChainIsRing] = shapely.linestrings(
+                coords[lineCoord], indices=lineNumbers[chainOfCoord[lineCoord]]
+            )
+
+        # Parts: a line is its own part, polygons are built from their rings
+        featureTypes = self.featureTypes[featureOfPart]
+        isPolygonPart = (featureTypes == POLYGON) | (featureTypes == MULTIPOLYGON)
+        partGeoms = np.empty(partCount, dtype=object)
+        lineParts = validPart & ~isPolygonPart
+        partGeoms[lineParts] = chainGeoms[
+            chainNumbers[self.partOffsets[:-1][lineParts]]
+        ]
+        polygonParts = validPart & isPolygonPart
+        if polygonParts.any():
+            polygonChains = keepChain & isPolygonPart[partOfChain]
+            partGeoms[polygonParts] = shapely.polygons(
+                chainGeoms[chainNumbers[polygonChains]],
+                indices=np.cumsum(polygonParts)[partOfChain[polygonChains]] - 1,
+            )
+
+        # Features
+        single = (self.featureTypes == LINESTRING) | (self.featureTypes == POLYGON)
+        singleParts = validPart & single[featureOfPart]
+        result[featureOfPart[singleParts]] = partGeoms[singleParts]
+
+        multiParts = validPart & ~single[featureOfPart]
+        for geomType, constructor in (
+            (MULTILINESTRING, shapely.multilinestrings),
+            (MULTIPOLYGON, shapely.multipolygons),
+        ):
+            parts = multiParts & (featureTypes == geomType)
+            if parts.any():
+                constructor(partGeoms[parts], indices=featureOfPart[parts], out=result)
+
+        return result
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import fiona
+import numpy as np
+from featureio import read_batches, record_values, record_dicts
+
+# Number of features read at a time
+batch_size = 1000
+
+
+class ShapeStore(object):
+    """
+    ShapeStore - the geometries of a file, parsed once and kept in memory.
+
+    Topology mode needs every geometry more than once (junction detection, arc thresholds,
+    then simplification). ShapeStore.read parses each feature once and keeps:
+        shapes = NumPy object array of shapely geometries (one per feature)
+        fields = {field name: list of values} for the few attributes that were requested
+
+    The other attributes are not kept; batches() streams them back from the file when
+    the output is written.
+    """
+
+    def __init__(self, inFile, shapes, fields):
+        self.inFile = inFile
+        self.shapes = shapes
+        self.fields = fields
+
+    @staticmethod
+    def read(inFile, fields=()):
+        """
+        Reads 'inFile' once, a batch at a time (see featureio.read_batches). Only the
+        attributes named in 'fields' are parsed.
+        """
+        with fiona.open(inFile, "r") as input:
+            schemaFields = input.schema["properties"]
+            for field in fields:
+                if field not in schemaFields:
+                    raise ValueError("Field missing from input file: " + repr(field))
+
+        shapes = []
+        values = {field: [] for field in fields}
+        for batchShapes, records in read_batches(
+            inFile, batch_size, fields=list(fields)
+        ):
+            shapes.append(batchShapes)
+            for field, fieldValues in values.items():
+                fieldValues.extend(record_values(records, field))
+
+        if shapes:
+            shapeArray = np.concatenate(shapes)
+        else:
+            shapeArray = np.empty(0, dtype=object)
+        return ShapeStore(inFile, shapeArray, values)
+
+    def batches(self, shapes=None, batchSize=batch_size):
+        """
+        Yields (shapes, records) batches of 'shapes' (default: the shapes read) with the
+        attributes of the same features, read back from the file without the geometry.
+        """
+        if shapes is None:
+            shapes = self.shapes
+        start = 0
+        for _, records in read_batches(self.inFile, batchSize, readGeometry=False):
+            yield shapes[start : start + len(records)], records
+            start += len(records)
+
+    def records(self):
+        """
+        Yields the properties of every feature, reading the attributes only.
+        """
+        for _, records in read_batches(self.inFile, batch_size, readGeometry=False):
+            for properties in record_dicts(records):
+                yield properties
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __iter__(self):
+        return iter(self.shapes)
@@ -0,0 +1,394 @@
+__author__ = "asimmons"
+
+import gzip
+import json
+import math
+import os
+import sqlite3
+import fiona
+import numpy as np
+import shapely
+from simplify_topology import SimplifyProcess, batch_size, repair_geometries
+from featureio import read_batches, record_dicts
+from vectortile import VectorTile
+from optparse import OptionParser
+
+################################################################################################################################################
+# 1) This script builds a vector tile pyramid (zoom levels minzoom to maxzoom) from a lines, multilines, polygons or multipolygons shapefile   #
+#    and writes it to a local MBTiles (SQLite) file.                                                                                          #
+#                                                                                                                                              #
+# 2) Every zoom level is simplified with the Visvalingam algorithm (topology preserved), with a threshold derived from the size of a tile      #
+#    pixel at that zoom. Junctions are detected and the elimination is run once; every zoom level is then a filter over the ranks            #
+#    (see RankStore), and the invalid polygons are repaired before they are encoded.                                                           #
+#                                                                                                                                              #
+# 3) The input must be in Web Mercator (EPSG:3857), use reproject_shapefile first if it is not.                                               #
+#                                                                                                                                              #
+################################################################################################################################################
+
+# Half the width of the Web Mercator world, in meters
+ORIGIN_SHIFT = 20037508.342789244
+EARTH_RADIUS = 6378137.0
+
+TILE_SIZE = 256
+
+debug = True
+
+
+class TileProcess:
+    def process_file(
+        self,
+        inFile,
+        outFile,
+        maxZoom,
+        minZoom=0,
+        Topology=True,
+        RankFile=None,
+        PixelArea=1.0,
+        Extent=4096,
+        Buffer=64,
+        LayerName=None,
+    ):
+        """
+        Writes the tiles of zoom levels minZoom to maxZoom of 'inFile' to the MBTiles file
+        'outFile' (replaced if it exists).
+
+        The threshold of a zoom level is PixelArea times the area of one (256 px) tile pixel,
+        so a triangle smaller than about a pixel is removed. Features are clipped to
+        every tile they touch, with a margin of Buffer tile units (out of Extent) so lines
+        and borders do not show seams. With Topology every shared border is ranked once
+        (see ArcStore.rank_store), so both of its sides are the same at every zoom, and the
+        polygons that simplification made invalid are repaired before they are encoded.
+        If 'RankFile' is set the ranks are loaded from (or saved to) that sidecar file,
+        and can be shared with simplify_topology.py runs.
+        """
+        if minZoom < 0 or maxZoom < minZoom:
+            raise ValueError(
+                "Invalid zoom range: " + repr(minZoom) + " to " + repr(maxZoom)
+            )
+
+        with fiona.open(inFile, "r") as input:
+            meta = input.meta
+            crs = input.crs
+        epsg = crs.to_epsg() if crs else None
+        if epsg is not None and epsg != 3857:
+            raise ValueError(
+                "Input must be in Web Mercator (EPSG:3857), reproject it first: "
+                + repr(crs.to_string())
+            )
+
+        simplifyProcess = SimplifyProcess()
+        records = []
+        if RankFile:
+            rankStore = simplifyProcess.load_rank_store(
+                inFile, RankFile, Topology, records
+            )
+        else:
+            rankStore = simplifyProcess.build_rank_store(inFile, Topology, records)
+        if not records:
+            records = [
+                batchRecords
+                for _, batchRecords in read_batches(
+                    inFile, batch_size, readGeometry=False
+                )
+            ]
+        # One property dictionary per feature
+        records = [
+            dict(properties)
+            for batchRecords in records
+            for properties in record_dicts(batchRecords)
+        ]
+
+        if LayerName is None:
+            LayerName = os.path.splitext(os.path.basename(inFile))[0]
+
+        if os.path.exists(outFile):
+            os.remove(outFile)
+        connection = sqlite3.connect(outFile)
+        try:
+            create_mbtiles(connection)
+            totalTiles = 0
+            for zoom in range(minZoom, maxZoom + 1):
+                threshold = zoom_threshold(zoom, PixelArea)
+                simplifiedShapes, repaired = self.zoom_shapes(rankStore, threshold)
+                tileCount = 0
+                for x, y, data in self.build_tiles(
+                    simplifiedShapes, records, zoom, LayerName, Extent, Buffer
+                ):
+                    connection.execute(
+                        "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                        (zoom, x, (1 << zoom) - 1 - y, sqlite3.Binary(data)),
+                    )
+                    tileCount += 1
+                totalTiles += tileCount
+                if debug:
+                    print(
+                        "Zoom "
+                        + str(zoom)
+                        + " (threshold "
+                        + str(threshold)
+                        + "): "
+                        + str(tileCount)
+                        + " tiles, "
+                        + str(repaired)
+                        + " geometries repaired"
+                    )
+
+            write_metadata(
+                connection,
+                LayerName,
+                meta["schema"]["properties"],
+                rankStore.coords,
+                minZoom,
+                maxZoom,
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+        print(str(totalTiles) + " tiles written to " + outFile)
+
+    def zoom_shapes(self, rankStore, threshold):
+        """
+        Returns (the simplified shapes of every feature for the threshold of a zoom level,
+        the number repaired). Invalid polygons are repaired the way simplify_topology.py
+        repairs its output, before they are clipped and encoded.
+        """
+        return repair_geometries(rankStore.extract(threshold))
+
+    def build_tiles(self, shapes, records, zoom, layerName, extent=4096, buffer=64):
+        """
+        Clips 'shapes' to the tiles of a zoom level and yields (x, y, gzipped tile data)
+        for every tile with at least one feature. y counts from the top (XYZ scheme).
+        """
+        shapes = np.asarray(shapes, dtype=object)
+        present = np.flatnonzero(
+            ~shapely.is_missing(shapes) & ~shapely.is_empty(shapes)
+        )
+        if len(present) == 0:
+            return
+
+        tileCount = 1 << zoom
+        tileSize = 2 * ORIGIN_SHIFT / tileCount
+        margin = tileSize * buffer / extent
+
+        # Range of tiles touched by every feature
+        bounds = shapely.bounds(shapes[present])
+        lastTile = tileCount - 1
+        x0 = np.clip(
+            np.floor((bounds[:, 0] - margin + ORIGIN_SHIFT) / tileSize), 0, lastTile
+        ).astype(np.int64)
+        x1 = np.clip(
+            np.floor((bounds[:, 2] + margin + ORIGIN_SHIFT) / tileSize), 0, lastTile
+        ).astype(np.int64)
+        y0 = np.clip(
+            np.floor((ORIGIN_SHIFT - bounds[:, 3] - margin) / tileSize), 0, lastTile
+        ).astype(np.int64)
+        y1 = np.clip(
+            np.floor((ORIGIN_SHIFT - bounds[:, 1] + margin) / tileSize), 0, lastTile
+        ).astype(np.int64)
+
+        # One (tile, feature) pair for every tile in those ranges
+        widths = x1 - x0 + 1
+        counts = widths * (y1 - y0 + 1)
+        pairFeature = np.repeat(np.arange(len(present)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pairX = x0[pairFeature] + local % widths[pairFeature]
+        pairY = y0[pairFeature] + local // widths[pairFeature]
+
+        order = np.lexsort((pairFeature, pairY, pairX))
+        pairFeature = present[pairFeature[order]]
+        pairX = pairX[order]
+        pairY = pairY[order]
+        tileStarts = np.flatnonzero(
+            np.concatenate(
+                ([True], (pairX[1:] != pairX[:-1]) | (pairY[1:] != pairY[:-1]))
+            )
+        )
+        tileEnds = np.append(tileStarts[1:], len(pairFeature))
+
+        for start, end in zip(tileStarts, tileEnds):
+            x = int(pairX[start])
+            y = int(pairY[start])
+            features = pairFeature[start:end]
+
+            minX = -ORIGIN_SHIFT + x * tileSize
+            maxY = ORIGIN_SHIFT - y * tileSize
+            clipped = shapely.clip_by_rect(
+                shapes[features],
+                minX - margin,
+                maxY - tileSize - margin,
+                minX + tileSize + margin,
+                maxY + margin,
+            )
+            # To tile coordinates, y pointing down
+            scale = extent / tileSize
+            clipped = shapely.transform(
+                clipped, lambda coords: (coords - (minX, maxY)) * (scale, -scale)
+            )
+
+            tile = VectorTile(extent)
+            if tile.add_layer(
+                layerName,
+                clipped,
+                [records[feature] for feature in features],
+                features + 1,
+            ):
+                yield x, y, gzip.compress(tile.encode())
+
+
+def zoom_threshold(zoom, pixelArea=1.0):
+    """
+    Returns the simplification threshold of a zoom level: 'pixelArea' times the area of
+    one pixel of a 256 px tile, in square meters.
+    """
+    pixelSize = 2 * ORIGIN_SHIFT / (TILE_SIZE * (1 << zoom))
+    return pixelArea * pixelSize * pixelSize
+
+
+def to_lon_lat(x, y):
+    """
+    Converts Web Mercator meters to longitude and latitude.
+    """
+    lon = math.degrees(x / EARTH_RADIUS)
+    lat = math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS)) - math.pi / 2)
+    return lon, lat
+
+
+def create_mbtiles(connection):
+    connection.execute("CREATE TABLE metadata (name text, value text)")
+    connection.execute(
+        "CREATE TABLE tiles (zoom_level integer, tile_column integer, "
+        "tile_row integer, tile_data blob)"
+    )
+    connection.execute(
+        "CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)"
+    )
+
+
+def write_metadata(connection, layerName, schema, coords, minZoom, maxZoom):
+    """
+    Writes the MBTiles metadata table: bounds, zoom levels and the vector layer fields.
+    """
+    if len(coords):
+        west, south = to_lon_lat(*coords.min(axis=0))
+        east, north = to_lon_lat(*coords.max(axis=0))
+    else:
+        west, south, east, north = -180.0, -85.0511, 180.0, 85.0511
+
+    fieldTypes = {"int": "Number", "float": "Number", "bool": "Boolean"}
+    fields = {
+        name: fieldTypes.get(fieldType.split(":")[0], "String")
+        for name, fieldType in schema.items()
+    }
+    vectorLayers = {
+        "vector_layers": [
+            {
+                "id": layerName,
+                "fields": fields,
+                "minzoom": minZoom,
+                "maxzoom": maxZoom,
+            }
+        ]
+    }
+
+    metadata = {
+        "name": layerName,
+        "format": "pbf",
+        "type": "overlay",
+        "version": "1",
+        "minzoom": str(minZoom),
+        "maxzoom": str(maxZoom),
+        "bounds": ",".join(repr(value) for value in (west, south, east, north)),
+        "center": ",".join(
+            repr(value) for value in ((west + east) / 2, (south + north) / 2, minZoom)
+        ),
+        "json": json.dumps(vectorLayers),
+    }
+    connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-i",
+        "--input_file",
+        dest="inputFile",
+        help="Input file (Web Mercator) with geometries to be simplified",
+        metavar="FILE",
+    )
+    parser.add_option(
+        "-o",
+        "--output_file",
+        dest="outputFile",
+        help="Output MBTiles file",
+        metavar="FILE",
+    )
+    parser.add_option(
+        "-z",
+        "--max_zoom",
+        dest="maxZoom",
+        type="int",
+        help="Highest zoom level of the pyramid",
+    )
+    parser.add_option(
+        "--min_zoom",
+        dest="minZoom",
+        type="int",
+        default=0,
+        help="Lowest zoom level of the pyramid (default 0)",
+    )
+    parser.add_option(
+        "-a",
+        "--pixel_area",
+        dest="pixelArea",
+        type="float",
+        default=1.0,
+        help="Threshold of every zoom level, in square pixels of that zoom (default 1)",
+    )
+    parser.add_option(
+        "-l",
+        "--layer",
+        dest="layerName",
+        help="Name of the vector tile layer (default: input file name)",
+    )
+    parser.add_option(
+        "-r",
+        "--ranks",
+        dest="rankFile",
+        help="Sidecar .npz file with the effective area of every vertex (see "
+        "simplify_topology.py -r)",
+        metavar="FILE",
+    )
+
+    options, args = parser.parse_args()
+
+    if not options.inputFile or not options.outputFile or options.maxZoom is None:
+        print("Must specify input file, output file and max zoom")
+        usage()
+        exit()
+
+    TileProcess().process_file(
+        options.inputFile,
+        options.outputFile,
+        options.maxZoom,
+        options.minZoom,
+        True,
+        options.rankFile,
+        options.pixelArea,
+        LayerName=options.layerName,
+    )
+    print("Finished building tiles (topology was preserved)!")
+
+
+def usage():
+    print(
+        "python simplify_tiles.py -i <input file path> -o <output .mbtiles path> -z <max zoom>"
+    )
+
+
+if __name__ == "__main__":
+    main()
+
+# example usage:
+# python simplify_tiles.py -i input/input.shp -o output/output.mbtiles -z 12
+# python simplify_tiles.py -i input/input.shp -o output/output.mbtiles -z 14 --min_zoom 4 -a 2 -r output/input_ranks.npz
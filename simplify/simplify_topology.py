@@ -1,12 +1,29 @@
 __author__ = "asimmons"
 
+import cProfile
 import csv
-import fiona
+import os
+import shapely
+import numpy as np
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
 from geomsimplify import GeomSimplify
+from eliminationengine import EliminationEngine
+from engines import ENGINES, check_engine, simplify_with_engine
+from metrics import Metrics
+from rankstore import RankStore, POLYGON, MULTIPOLYGON
+from shapestore import ShapeStore
+import arcstore
+from arcstore import ArcStore
+from tilegrid import TileGrid, pinned_points
+from junctioncache import JunctionCache
+from checkpoint import Checkpoint
+from incrementalstate import IncrementalState, geometry_digests
+from junctionfinder import JunctionFinder
+from featureio import BatchWriter, read_batches, read_by_id
 from optparse import OptionParser
 from shapely.geometry import (
-    shape,
-    mapping,
     LineString,
     Polygon,
     MultiLineString,
@@ -33,10 +50,34 @@ debug = True
 self_intersections_fixed = 0
 validate = True
 
+# Number of features simplified, repaired and written at a time
+batch_size = 1000
+
 
 class SimplifyProcess:
+    def __init__(self):
+        # Timings and counts of the last run (see Metrics)
+        self.metrics = Metrics()
+
     def process_file(
-        self, inFile, outFile, threshold, Topology=False, DynamicThresholdFile=None
+        self,
+        inFile,
+        outFile,
+        threshold,
+        Topology=False,
+        DynamicThresholdFile=None,
+        RankFile=None,
+        VertexBudget=None,
+        BudgetPerFeature=False,
+        Workers=1,
+        TileSize=None,
+        JunctionCacheDir=None,
+        PreventIntersections=False,
+        Engine="visvalingam",
+        Prefilter=None,
+        CheckpointDir=None,
+        Resume=False,
+        IncrementalDir=None,
     ):
         """
         Takes an 'inFile' of an ESRI shapefile, converts it into a Shapely geometry - simplifies.
@@ -55,139 +96,1324 @@ class SimplifyProcess:
         - Identical features on top of one another DO NOT have different
         neighbors, and therefor DO NOT have any junctions.
 
+        IF RankFile is set
+        The effective area of every vertex is read from that sidecar .npz file (or
+        computed once and saved there), and the output is extracted from it without
+        running the elimination again. Not available with dynamic thresholds.
+
+        IF VertexBudget is set
+        The threshold is ignored, and points are removed until only VertexBudget points
+        are left (or the fraction VertexBudget of the points, if below 1) in the whole
+        layer, or in every feature if BudgetPerFeature is True. Junctions are always kept.
+
+        IF Workers > 1
+        Without Topology, batches of features are simplified and checked in a pool of
+        Workers processes, and written in input order as they come back. With Topology (and
+        a single threshold), the unique arcs are split between Workers processes that read
+        them from shared memory (see ArcStore.simplify).
+
+        IF TileSize is set (Topology with a single threshold only)
+        The input is split into square tiles of TileSize map units, and one tile (plus the
+        neighbors its borders need) is read and simplified at a time, in parallel if
+        Workers > 1 (see process_file_tiled). Memory grows with the tile, not the layer.
+
+        IF JunctionCacheDir is set (Topology only)
+        The junctions (and dynamic arc thresholds) are loaded from that directory, or
+        found once and saved there if it holds none for this input, quantization factor
+        and threshold CSV (see JunctionCache). Another threshold then skips that step.
+
+        IF PreventIntersections = True
+        A point is not removed if that would make its ring (or the arcs of the layer, with
+        Topology) cross itself (see EliminationEngine), so the output needs no repair.
+        Not available with multiple thresholds, a vertex budget or a rank file.
+
+        IF Prefilter is set
+        Before the elimination, the points exactly collinear with their neighbors are
+        removed (Prefilter = 0), and the single stair steps up to Prefilter map units
+        (the pixels of a polygonized raster) are collapsed (Prefilter > 0), in linear
+        time (see GeomSimplify.prefilter_chains). Not available with multiple
+        thresholds, a vertex budget, a rank file or another engine.
+
+        IF threshold is a list
+        One output is written per threshold, from a single pass over the input (see
+        process_file_ranked). 'outFile' is either a list with one path per threshold, or
+        a single path that gets the threshold appended (see threshold_output_file).
+
+        IF Engine is "geos" or "coverage" (a single threshold only)
+        The layer is simplified by GEOS instead of the Visvalingam elimination of this
+        project: shapely.simplify without Topology, shapely.coverage_simplify with
+        Topology (see engines and simplify_geometries).
+
+        IF CheckpointDir is set (a single threshold only)
+        Every batch of simplified features (every tile with TileSize, the whole layer with
+        Topology and a single threshold), the junctions and the arcs simplified for
+        dynamic thresholds are saved in that directory as they are done (see Checkpoint).
+        With Resume = True a run stopped before the end restores them and only simplifies
+        what is left; 'outFile' is written again from the start, the same as a run that
+        never stopped. Without Resume, or for another input or other options, the
+        checkpoint is cleared first.
+
+        IF IncrementalDir is set (a single threshold only)
+        The features whose geometry did not change since the run saved in that directory
+        keep their output, and only the junctions, arcs and features the changes reach
+        are found and simplified again (see process_file_incremental). The output is the
+        same as a full run, and this run is saved there for the next one. Not available
+        with dynamic thresholds, tiles, a junction cache, a checkpoint, or
+        PreventIntersections with Topology.
+
+        The time of every phase (read, junctions, elimination, repair, write, ...) and
+        the features, vertices, junctions, arcs, heap operations and repairs of the run
+        are kept in self.metrics (see Metrics).
+        """
+        self.metrics = Metrics()
+        repairedBefore = self_intersections_fixed
+        heapOperationsBefore = EliminationEngine.heapOperations
+
+        # Convert threshold(s) from str to float
+        if isinstance(threshold, (list, tuple)):
+            thresholds = [float(value) for value in threshold]
+        elif threshold is None:
+            thresholds = [None]
+        else:
+            thresholds = [float(threshold)]
+
+        if Resume and not CheckpointDir:
+            raise ValueError("Resume needs a checkpoint directory")
+        # Whether every option that only some modes take is set (see check_options)
+        options = {
+            "multiple thresholds": len(thresholds) > 1,
+            "dynamic thresholds": bool(DynamicThresholdFile),
+            "a rank file": bool(RankFile),
+            "a vertex budget": VertexBudget is not None,
+            "tiles": bool(TileSize),
+            "a junction cache": bool(JunctionCacheDir),
+            "a checkpoint": bool(CheckpointDir),
+            "another engine": Engine != "visvalingam",
+            "PreventIntersections": PreventIntersections,
+            "PreventIntersections with topology": Topology and PreventIntersections,
+            "a prefilter": Prefilter is not None,
+        }
+        ranked = len(thresholds) > 1 or RankFile or VertexBudget is not None
+
+        if IncrementalDir:
+            check_options(
+                "The incremental mode",
+                options,
+                "multiple thresholds",
+                "dynamic thresholds",
+                "a rank file",
+                "a vertex budget",
+                "tiles",
+                "a junction cache",
+                "a checkpoint",
+                "another engine",
+                "PreventIntersections with topology",
+            )
+            if thresholds[0] is None:
+                raise ValueError("The incremental mode needs a threshold")
+            self.process_file_incremental(
+                inFile,
+                outFile,
+                thresholds[0],
+                IncrementalDir,
+                Topology=Topology,
+                Workers=Workers,
+                PreventIntersections=PreventIntersections,
+                Prefilter=Prefilter,
+            )
+        elif Engine != "visvalingam":
+            check_engine(Engine, Topology)
+            check_options(
+                "The " + Engine + " engine",
+                options,
+                "multiple thresholds",
+                "dynamic thresholds",
+                "a rank file",
+                "a vertex budget",
+                "tiles",
+                "a junction cache",
+                "a checkpoint",
+                "PreventIntersections",
+                "a prefilter",
+            )
+            self.process_file_engine(inFile, outFile, thresholds[0], Topology, Engine)
+        elif TileSize:
+            if not Topology:
+                raise ValueError("Tiles can only be used with topology")
+            check_options(
+                "Tiles",
+                options,
+                "multiple thresholds",
+                "dynamic thresholds",
+                "a rank file",
+                "a vertex budget",
+                "a junction cache",
+            )
+            self.process_file_tiled(
+                inFile,
+                outFile,
+                thresholds[0],
+                TileSize,
+                Workers=Workers,
+                PreventIntersections=PreventIntersections,
+                Prefilter=Prefilter,
+                checkpoint=open_checkpoint(
+                    CheckpointDir,
+                    Resume,
+                    inFile,
+                    thresholds[0],
+                    Topology=Topology,
+                    TileSize=TileSize,
+                    PreventIntersections=PreventIntersections,
+                    Prefilter=Prefilter,
+                ),
+            )
+        elif ranked:
+            check_options(
+                "Multiple thresholds, a vertex budget or a rank file",
+                options,
+                "dynamic thresholds",
+                "a checkpoint",
+                "PreventIntersections",
+                "a prefilter",
+            )
+            if isinstance(outFile, (list, tuple)):
+                outFiles = list(outFile)
+            elif len(thresholds) > 1:
+                outFiles = [
+                    threshold_output_file(outFile, value) for value in thresholds
+                ]
+            else:
+                outFiles = [outFile]
+            self.process_file_ranked(
+                inFile,
+                outFiles,
+                thresholds,
+                Topology=Topology,
+                RankFile=RankFile,
+                VertexBudget=VertexBudget,
+                BudgetPerFeature=BudgetPerFeature,
+            )
+        else:
+            checkpoint = open_checkpoint(
+                CheckpointDir,
+                Resume,
+                inFile,
+                thresholds[0],
+                Topology=Topology,
+                DynamicThresholdFile=DynamicThresholdFile,
+                PreventIntersections=PreventIntersections,
+                Prefilter=Prefilter,
+            )
+            if checkpoint is not None and Topology and not JunctionCacheDir:
+                JunctionCacheDir = checkpoint.junction_cache_dir()
+            self.process_file_batched(
+                inFile,
+                outFile,
+                thresholds[0],
+                Topology=Topology,
+                DynamicThresholdFile=DynamicThresholdFile,
+                Workers=Workers,
+                JunctionCacheDir=JunctionCacheDir,
+                PreventIntersections=PreventIntersections,
+                Prefilter=Prefilter,
+                checkpoint=checkpoint,
+            )
+        self.finish_metrics(repairedBefore, heapOperationsBefore)
+
+    def process_file_batched(
+        self,
+        inFile,
+        outFile,
+        threshold,
+        Topology=False,
+        DynamicThresholdFile=None,
+        Workers=1,
+        JunctionCacheDir=None,
+        PreventIntersections=False,
+        Prefilter=None,
+        checkpoint=None,
+    ):
+        """
+        Simplifies 'inFile' into 'outFile' with a single threshold (None for the
+        thresholds of DynamicThresholdFile), and writes the features a batch at a time.
+        With Topology and a single threshold the unique arcs of the whole layer are
+        simplified first (see ArcStore). The batches (or runs of arcs) are saved in
+        'checkpoint', and the ones saved there before are restored (see Checkpoint).
+        """
+        global self_intersections_fixed
+
+        metrics = self.metrics
+
+        presimplified = False
+        # Batches restored from the checkpoint, and whether the others are saved there
+        restored = 0
+        saveBatches = checkpoint is not None
+        if Topology:
+            # Read the geometries once (plus the iso3 attribute for dynamic thresholds).
+            # Junctions, arc thresholds and the simplification all reuse them, and the
+            # other attributes are only read back when the output is written.
+            with metrics.phase("read"):
+                shapeStore = ShapeStore.read(
+                    inFile, ["iso3"] if DynamicThresholdFile else []
+                )
+            self.count_shapes(shapeStore.shapes, "in")
+
+            # key = quantitized junction points, value = 1
+            # key = arc_key of the arcs between junctions, value = average threshold
+            dictJunctions, dictArcThresholds = self.find_junctions(
+                inFile, shapeStore, DynamicThresholdFile, JunctionCacheDir
+            )
+
+            simplify = GeomSimplify(
+                dictJunctions, dictArcThresholds, PreventIntersections, Prefilter
+            )  # if you need topology
+            batches = metrics.timed(shapeStore.batches(batchSize=batch_size), "read")
+
+            if not DynamicThresholdFile:
+                # The arcs are simplified together: the checkpoint holds the keep mask
+                # of every run of arcs, then the whole layer in a last chunk
+                saveBatches = False
+                chunks = checkpoint.chunk_count() if checkpoint is not None else 0
+                if chunks and checkpoint.load_mask(chunks - 1) is None:
+                    simplifiedShapes, repaired, _, _, _ = checkpoint.load_chunk(
+                        chunks - 1
+                    )
+                else:
+                    # Cut every shape into arcs once and simplify each unique arc once,
+                    # so shared borders are not simplified twice (see ArcStore)
+                    with metrics.phase("arcs"):
+                        arcStore = ArcStore.build(shapeStore, simplify)
+                    metrics.count("arcs", len(arcStore.arcs))
+                    with metrics.phase("elimination"):
+                        simplifiedShapes = arcStore.simplify(
+                            threshold, Workers, checkpoint=checkpoint
+                        )
+                    with metrics.phase("repair"):
+                        simplifiedShapes, repaired = repair_geometries(
+                            simplifiedShapes, shapeStore.shapes
+                        )
+                    if checkpoint is not None:
+                        with metrics.phase("checkpoint"):
+                            checkpoint.save_chunk(
+                                checkpoint.chunk_count(), simplifiedShapes, repaired
+                            )
+                self_intersections_fixed += repaired
+                batches = metrics.timed(
+                    shapeStore.batches(simplifiedShapes, batch_size), "read"
+                )
+                presimplified = True
+            elif checkpoint is not None:
+                restored = checkpoint.chunk_count()
+        else:
+            simplify = GeomSimplify(
+                preventIntersections=PreventIntersections, prefilter=Prefilter
+            )
+            batches = self.read_timed(read_batches(inFile, batch_size))
+            if checkpoint is not None:
+                restored = checkpoint.chunk_count()
+            if Workers > 1:
+                # Features are independent, simplify and check them in a process pool.
+                # The restored batches are read from the same iterator first.
+                batches = chain(
+                    islice(batches, restored),
+                    metrics.timed(
+                        simplify_in_pool(
+                            batches, threshold, Workers, PreventIntersections, Prefilter
+                        ),
+                        "elimination",
+                    ),
+                )
+                presimplified = True
+
+        # create an outFile has the same crs, schema as inFile
+        with metrics.phase("write"), BatchWriter(outFile, inFile) as output:
+            # Simplify, repair and write the features a batch at a time
+            fixedBefore = self_intersections_fixed
+            for index, (shapes, records) in enumerate(batches):
+                arcsBefore = len(simplify.dictSimpleArcs)
+                if index < restored:
+                    with metrics.phase("checkpoint"):
+                        simplifiedShapes, repaired, _, _, simpleArcs = (
+                            checkpoint.load_chunk(index)
+                        )
+                    # Later batches reuse the arcs simplified for this one
+                    simplify.dictSimpleArcs.update(simpleArcs)
+                    self_intersections_fixed += repaired
+                elif presimplified:
+                    simplifiedShapes = shapes
+                else:
+                    with metrics.phase("elimination"):
+                        simplifiedShapes = [
+                            simplify_shape(simplify, myShape, threshold, Topology)
+                            for myShape in shapes
+                        ]
+                    with metrics.phase("repair"):
+                        simplifiedShapes, repaired = repair_geometries(
+                            simplifiedShapes, shapes
+                        )
+                    self_intersections_fixed += repaired
+
+                if saveBatches and index >= restored:
+                    # The pool adds its repairs before the batch comes back
+                    with metrics.phase("checkpoint"):
+                        checkpoint.save_chunk(
+                            index,
+                            simplifiedShapes,
+                            self_intersections_fixed - fixedBefore,
+                            simpleArcs=dict(
+                                islice(
+                                    simplify.dictSimpleArcs.items(), arcsBefore, None
+                                )
+                            ),
+                        )
+                fixedBefore = self_intersections_fixed
+
+                # write to outfile
+                self.count_shapes(simplifiedShapes, "out")
+                output.write(simplifiedShapes, records)
+
+        print("Invalid geometries found and repaired: " + str(self_intersections_fixed))
+
+        #
+        if debug and Topology:
+            with open("debug_junctions.txt", "w") as output:
+                for key in dictJunctions:
+                    output.write(str(key))
+
+    def simplify_geometries(
+        self,
+        geometries,
+        threshold,
+        Topology=False,
+        Workers=1,
+        PreventIntersections=False,
+        Engine="visvalingam",
+        Prefilter=None,
+    ):
         """
+        Simplifies geometries held in memory, without writing or reading any file.
+        Returns the simplified geometries in the same order (None where simplification
+        removed a feature), repaired like the output of process_file.
 
-        # Convert threshold from str to float
-        threshold = float(threshold)
+        geometries = a GeoSeries, a GeoDataFrame (its geometry column), a pandas Series
+        or any sequence of shapely geometries. A (Geo)Series comes back as the same type
+        with the same index (and CRS), anything else as a NumPy object array. Missing
+        geometries stay None.
 
-        # Open input file
-        # loop over each
-        with fiona.open(inFile, "r") as input:
+        threshold = a single threshold, or one threshold per geometry
 
-            meta = input.meta
+        IF Topology = True
+        The junctions are found in 'geometries' themselves. With one threshold per
+        geometry, every arc between junctions gets the average threshold of the polygons
+        on either side (like a DynamicThresholdFile keyed by feature), and rings without
+        junctions use the threshold of their own feature.
 
-            if Topology:
-                # declare dictJunctions as a global variable
-                # key = quantitized junction points, value = 1
-                dictJunctions = {}
+        IF Workers > 1 (single threshold only)
+        The arcs (with Topology) or batches of features are simplified in a pool of
+        Workers processes, as in process_file.
 
-                # create instace of Junction
-                simplifyObj = GeomSimplify()
+        IF Engine is "geos" or "coverage"
+        The geometries are simplified by GEOS instead (see engines), with
+        shapely.simplify one feature at a time (without Topology) or with
+        shapely.coverage_simplify over the whole polygon coverage (with Topology).
 
-                # create dictionary of all junctions in all shapes
-                simplifyObj.find_all_junctions(inFile, dictJunctions)
+        IF Prefilter is set
+        Collinear points (and stair steps) are removed first, as in process_file.
 
-                dictArcThresholds = None
-                if DynamicThresholdFile:
-                    # create a dictionary of all arcs between junctions, keyed by the junction pair
-                    # with value set to the average threshold of adjacent polygons
-                    with open(DynamicThresholdFile, "rb") as iso_thresholds_file:
-                        csvreader = csv.reader(iso_thresholds_file)
-                        dictIsoThresholds = {}
-                        for line in iso_thresholds_file:
-                            line_array = (
-                                line.replace("\r", "").replace("\n", "").split(",")
-                            )
-                            if validate and len(line_array) != 2:
-                                raise ValueError(
-                                    "Unexpected number of columns in iso_thresholds_file for line: "
-                                    + repr(line_array)
-                                )
-                            iso3 = line_array[0]
-                            threshold = float(line_array[1])
-                            dictIsoThresholds[iso3] = threshold
+        The time and counts of the run are kept in self.metrics (see Metrics).
+        """
+        self.metrics = Metrics()
+        repairedBefore = self_intersections_fixed
+        heapOperationsBefore = EliminationEngine.heapOperations
+
+        # A GeoDataFrame is simplified through its active geometry column
+        series = getattr(geometries, "geometry", geometries)
+        allShapes = np.empty(len(series), dtype=object)
+        allShapes[:] = list(series)
+
+        thresholds = np.asarray(threshold, dtype=np.float64)
+        perFeature = thresholds.ndim > 0
+        if perFeature and thresholds.shape != allShapes.shape:
+            raise ValueError(
+                "Expected one threshold per geometry: "
+                + repr(len(allShapes))
+                + ", got "
+                + repr(len(thresholds))
+            )
 
-                        dictArcThresholds = simplifyObj.find_all_arc_thresholds(
-                            inFile, dictJunctions, dictIsoThresholds
-                        )
+        result = self.simplify_shapes(
+            allShapes,
+            thresholds,
+            Topology,
+            Workers,
+            PreventIntersections,
+            Engine,
+            Prefilter,
+        )
+        self.finish_metrics(repairedBefore, heapOperationsBefore)
+
+        if hasattr(series, "iloc"):
+            # A (Geo)Series: keep its index (and the CRS of a GeoSeries)
+            extra = {"crs": series.crs} if hasattr(series, "crs") else {}
+            return type(series)(result, index=series.index, **extra)
+        return result
+
+    def simplify_shapes(
+        self,
+        allShapes,
+        thresholds,
+        Topology=False,
+        Workers=1,
+        PreventIntersections=False,
+        Engine="visvalingam",
+        Prefilter=None,
+    ):
+        """
+        Simplifies and repairs a NumPy object array of shapely geometries (None where
+        missing) with a threshold array (a single one, or one per geometry), for
+        simplify_geometries and process_file_engine. Returns a NumPy object array in the
+        same order; the phases and counts are added to self.metrics.
+        """
+        global self_intersections_fixed
+
+        metrics = self.metrics
+        perFeature = thresholds.ndim > 0
+        check_engine(Engine, Topology)
+        if Engine != "visvalingam" and (PreventIntersections or Prefilter is not None):
+            raise ValueError(
+                "PreventIntersections and the prefilter need the visvalingam engine"
+            )
 
+        present = ~shapely.is_missing(allShapes)
+        shapes = allShapes[present]
+        if perFeature:
+            thresholds = thresholds[present]
+        self.count_shapes(shapes, "in")
+
+        repairedInPool = False
+        if Engine != "visvalingam":
+            with metrics.phase("elimination"):
+                simplifiedShapes = simplify_with_engine(Engine, shapes, thresholds)
+        elif Topology:
+            simplifyObj = GeomSimplify()
+            dictJunctions = {}
+            with metrics.phase("junctions"):
+                simplifyObj.find_all_junctions_in_shapes(shapes, dictJunctions)
+            metrics.count("junctions", len(dictJunctions))
+
+            if perFeature:
+                # The artificial junctions are added before the arc thresholds are
+                # averaged, so every arc they cut gets a threshold
+                with metrics.phase("junctions"):
+                    simplifyObj.add_junctions_to_shapes(shapes, dictJunctions)
+                # The index of every feature stands in for its iso3 code
+                with metrics.phase("arc_thresholds"):
+                    dictArcThresholds = simplifyObj.find_all_arc_thresholds_in_shapes(
+                        shapes,
+                        range(len(shapes)),
+                        dictJunctions,
+                        dict(enumerate(thresholds)),
+                    )
+                metrics.count("arcs", len(dictArcThresholds))
                 simplify = GeomSimplify(
-                    dictJunctions, dictArcThresholds
-                )  # if you need topology
+                    dictJunctions, dictArcThresholds, PreventIntersections, Prefilter
+                )
+                with metrics.phase("elimination"):
+                    simplifiedShapes = [
+                        simplify_shape(simplify, myShape, myThreshold, True)
+                        for myShape, myThreshold in zip(shapes, thresholds)
+                    ]
             else:
-                simplify = GeomSimplify()
+                simplify = GeomSimplify(
+                    dictJunctions, None, PreventIntersections, Prefilter
+                )
+                with metrics.phase("arcs"):
+                    arcStore = ArcStore.build(shapes, simplify)
+                metrics.count("arcs", len(arcStore.arcs))
+                with metrics.phase("elimination"):
+                    simplifiedShapes = arcStore.simplify(float(thresholds), Workers)
+        elif Workers > 1 and not perFeature:
+            # simplify_in_pool repairs the features in the pool processes
+            batches = (
+                (shapes[start : start + batch_size], None)
+                for start in range(0, len(shapes), batch_size)
+            )
+            with metrics.phase("elimination"):
+                simplifiedShapes = [
+                    myShape
+                    for batchShapes, _ in simplify_in_pool(
+                        batches,
+                        float(thresholds),
+                        Workers,
+                        PreventIntersections,
+                        Prefilter,
+                    )
+                    for myShape in batchShapes
+                ]
+            repairedInPool = True
+        else:
+            simplify = GeomSimplify(
+                preventIntersections=PreventIntersections, prefilter=Prefilter
+            )
+            with metrics.phase("elimination"):
+                simplifiedShapes = [
+                    simplify_shape(simplify, myShape, myThreshold)
+                    for myShape, myThreshold in zip(
+                        shapes, np.broadcast_to(thresholds, shapes.shape)
+                    )
+                ]
+
+        if not repairedInPool:
+            with metrics.phase("repair"):
+                simplifiedShapes, repaired = repair_geometries(simplifiedShapes, shapes)
+            self_intersections_fixed += repaired
+
+        result = np.full(len(allShapes), None, dtype=object)
+        result[present] = simplifiedShapes
+        self.count_shapes(result, "out")
+        return result
+
+    def process_file_incremental(
+        self,
+        inFile,
+        outFile,
+        threshold,
+        IncrementalDir,
+        Topology=False,
+        Workers=1,
+        PreventIntersections=False,
+        Prefilter=None,
+    ):
+        """
+        Simplifies 'inFile' into 'outFile' reusing the run saved in 'IncrementalDir' (see
+        IncrementalState) for the features that did not change, then saves this run there
+        for the next one. The output is the same as a full run.
+
+        Features are matched by their geometry (see geometry_digests): a feature whose
+        geometry is not in the previous input is changed, a previous one that is not in
+        this input is removed. With Topology:
+        - The junctions are only found again at the points of the changed and removed
+          features, from the features whose bounding box comes within the quantization
+          factor of theirs (every feature that can share one of those points). Whether
+          a point is a junction only depends on the features through it.
+        - The artificial junctions (see GeomSimplify.add_junctions_to_shapes) depend on
+          the order of the features, so they are added again over the whole layer. That
+          pass only counts junctions, it does not cut or simplify.
+        - Only the changed features and the features with a point where the junctions
+          differ from the previous run are cut into arcs again, and only the arcs missing
+          from the saved arcs are simplified (see ArcStore.simplify_arcs).
+        Without Topology only the changed features are simplified.
+
+        Without a saved state (or one with other options) every feature is changed.
+        """
+        global self_intersections_fixed
 
-            invalid_geoms_count = 0
+        metrics = self.metrics
+        simplifyObj = GeomSimplify()
+        factor = simplifyObj.quantitizationFactor
+        source = IncrementalState.describe_source(
+            factor, threshold, Topology, PreventIntersections, Prefilter
+        )
 
-            # create an outFile has the same crs, schema as inFile
-            with fiona.open(outFile, "w", **meta) as output:
-                # Read shapely geometries from file
-                # Loop through all shapely objects
-                for myGeom in input:
-
-                    myShape = shape(myGeom["geometry"])
-                    simplifiedShapes = []
-                    if isinstance(myShape, LineString):
-                        line = myShape
-                        if Topology:
-                            simplifiedShapes = [
-                                simplify.simplify_line_topology(line, threshold)
-                            ]
-                        else:
-                            simplifiedShapes = [simplify.simplify_line(line, threshold)]
-
-                    elif isinstance(myShape, MultiLineString):
-                        mline = myShape
-                        if Topology:
-                            simplifiedShapes = [
-                                simplify.simplify_multiline_topology(mline, threshold)
-                            ]
-                        else:
-                            simplifiedShapes = [
-                                simplify.simplify_multiline(mline, threshold)
-                            ]
-
-                    elif isinstance(myShape, Polygon):
-                        polygon = myShape
-                        if Topology:
-                            simplifiedShapes = [
-                                simplify.simplify_polygon_topology(polygon, threshold)
-                            ]
-                        else:
-                            simplifiedShapes = [
-                                simplify.simplify_polygon(polygon, threshold)
-                            ]
-
-                    elif isinstance(myShape, MultiPolygon):
-                        mpolygon = myShape
-                        if Topology:
-                            simplifiedShapes = [
-                                simplify.simplify_multipolygon_topology(
-                                    mpolygon, threshold
-                                )
-                            ]
-                        else:
-                            simplifiedShapes = [
-                                simplify.simplify_multipolygon(mpolygon, threshold)
-                            ]
-
-                    else:
-                        raise ValueError(
-                            "Unhandled geometry type: " + repr(myShape.type)
-                        )
+        with metrics.phase("read"):
+            shapeStore = ShapeStore.read(inFile)
+        shapes = shapeStore.shapes
+        self.count_shapes(shapes, "in")
+
+        with metrics.phase("diff"):
+            digests = geometry_digests(shapes)
+            state = IncrementalState.load(IncrementalDir)
+            if state is not None and state.source != source:
+                print("Incremental state is from other options, simplifying everything")
+                state = None
+            if state is None:
+                state = IncrementalState(
+                    source, [], np.empty(0, dtype=object), [], [], set(), set(), {}
+                )
+                previousRun = False
+            else:
+                previousRun = True
 
-                    # Check for invalid geometries in shape list
-                    check_invalid_geometry(simplifiedShapes)
-
-                    # write to outfile
-                    for simpleShape in simplifiedShapes:
-                        if simpleShape is not None:
-                            output.write(
-                                {
-                                    "geometry": mapping(simpleShape),
-                                    "properties": myGeom["properties"],
-                                }
+            # digest: index of the feature in the previous run
+            dictPrevious = {digest: index for index, digest in enumerate(state.digests)}
+            current = set(digests)
+            changed = np.array(
+                [digest not in dictPrevious for digest in digests], dtype=bool
+            )
+            removed = np.array(
+                [digest not in current for digest in state.digests], dtype=bool
+            )
+        metrics.count("features_changed", changed.sum())
+        metrics.count("features_removed", removed.sum())
+
+        junctions = set()
+        cuts = set()
+        affected = changed.copy()
+        if Topology:
+            finder = JunctionFinder(factor)
+            with metrics.phase("junctions"):
+                if previousRun:
+                    # Every feature that can share a point with a changed or removed one
+                    changedShapes = np.concatenate(
+                        (shapes[changed], state.shapes[removed])
+                    )
+                    tree = shapely.STRtree(shapes)
+                    nearby = np.unique(
+                        tree.query(expanded_boxes(changedShapes, factor))[1]
+                    )
+                    changedPoints = set(
+                        map(
+                            tuple,
+                            finder.quantitize(
+                                shapely.get_coordinates(changedShapes)
+                            ).tolist(),
+                        )
+                    )
+                    found = set(map(tuple, finder.find(shapes[nearby]).tolist()))
+                    junctions = (state.junctions - changedPoints) | (
+                        found & changedPoints
+                    )
+                else:
+                    junctions = set(map(tuple, finder.find(shapes).tolist()))
+                metrics.count("junctions", len(junctions))
+
+                dictJunctions = {
+                    (x * factor[0], y * factor[1]): 1 for x, y in junctions
+                }
+                simplify = GeomSimplify(
+                    dictJunctions, None, PreventIntersections, Prefilter
+                )
+                simplify.add_junctions_to_shapes(shapes, dictJunctions)
+                cuts = set(
+                    map(
+                        tuple,
+                        finder.quantitize(
+                            np.array(list(dictJunctions), dtype=np.float64).reshape(
+                                -1, 2
                             )
+                        ).tolist(),
+                    )
+                )
+
+                if previousRun:
+                    # The features cut at other points than in the previous run
+                    movedCuts = np.array(
+                        sorted(cuts ^ state.cuts), dtype=np.float64
+                    ).reshape(-1, 2) * np.asarray(factor, dtype=np.float64)
+                    affected[
+                        tree.query(expanded_boxes(shapely.points(movedCuts), factor))[1]
+                    ] = True
+        else:
+            simplify = GeomSimplify(
+                preventIntersections=PreventIntersections, prefilter=Prefilter
+            )
+        metrics.count("features_simplified", affected.sum())
+
+        affectedShapes = shapes[affected]
+        if Topology:
+            # The artificial junctions were added above, over the whole layer
+            arcStore = ArcStore(simplify)
+            with metrics.phase("arcs"):
+                for myShape in affectedShapes:
+                    arcStore.append(myShape)
+            metrics.count("arcs", len(arcStore.arcs))
+            arcCache = state.arcCache
+            with metrics.phase("elimination"):
+                simplifiedShapes = arcStore.simplify(threshold, Workers, arcCache)
+        elif Workers > 1:
+            # simplify_in_pool repairs the features in the pool processes
+            arcCache = {}
+            batches = (
+                (affectedShapes[start : start + batch_size], None)
+                for start in range(0, len(affectedShapes), batch_size)
+            )
+            with metrics.phase("elimination"):
+                simplifiedShapes = [
+                    myShape
+                    for batchShapes, _ in simplify_in_pool(
+                        batches, threshold, Workers, PreventIntersections, Prefilter
+                    )
+                    for myShape in batchShapes
+                ]
+        else:
+            arcCache = {}
+            with metrics.phase("elimination"):
+                simplifiedShapes = [
+                    simplify_shape(simplify, myShape, threshold)
+                    for myShape in affectedShapes
+                ]
+        if Topology or Workers == 1:
+            with metrics.phase("repair"):
+                simplifiedShapes, repaired = repair_geometries(
+                    simplifiedShapes, affectedShapes
+                )
+            self_intersections_fixed += repaired
+
+        # The other features are the same as in the previous run, with the same arcs
+        allSimplifiedShapes = np.full(len(shapes), None, dtype=object)
+        allSimplifiedShapes[affected] = simplifiedShapes
+        featureArcs = [[] for _ in shapes]
+        if Topology:
+            for index, arcs in zip(np.flatnonzero(affected), arcStore.feature_arcs()):
+                featureArcs[index] = arcs
+        for index in np.flatnonzero(~affected):
+            previous = dictPrevious[digests[index]]
+            allSimplifiedShapes[index] = state.simplifiedShapes[previous]
+            featureArcs[index] = state.featureArcs[previous]
+
+        with metrics.phase("write"), BatchWriter(outFile, inFile) as output:
+            for simplifiedBatch, records in metrics.timed(
+                shapeStore.batches(allSimplifiedShapes, batch_size), "read"
+            ):
+                self.count_shapes(simplifiedBatch, "out")
+                output.write(simplifiedBatch, records)
+
+        with metrics.phase("state"):
+            IncrementalState(
+                source,
+                digests,
+                shapes,
+                allSimplifiedShapes,
+                featureArcs,
+                junctions,
+                cuts,
+                arcCache,
+            ).save(IncrementalDir)
+
+        print("Invalid geometries found and repaired: " + str(self_intersections_fixed))
+
+    def process_file_engine(self, inFile, outFile, threshold, Topology, Engine):
+        """
+        Simplifies 'inFile' into 'outFile' with a GEOS engine (see engines). The
+        geometries are read at once, since coverage_simplify needs the whole coverage.
+        """
+        with self.metrics.phase("read"):
+            shapeStore = ShapeStore.read(inFile)
+        simplifiedShapes = self.simplify_shapes(
+            shapeStore.shapes, np.float64(threshold), Topology, Engine=Engine
+        )
 
-        print(
-            "Self-intersecting rings found and fixed: " + str(self_intersections_fixed)
+        batches = self.metrics.timed(
+            shapeStore.batches(simplifiedShapes, batch_size), "read"
         )
+        with self.metrics.phase("write"), BatchWriter(outFile, inFile) as output:
+            for shapes, records in batches:
+                output.write(shapes, records)
 
-        #
-        if debug and Topology:
-            with open("debug_junctions.txt", "w") as output:
-                for key in dictJunctions:
-                    output.write(str(key))
+    def find_junctions(
+        self, inFile, shapeStore, DynamicThresholdFile=None, JunctionCacheDir=None
+    ):
+        """
+        Returns (dictJunctions, dictArcThresholds) for the shapes of 'shapeStore'.
+        dictArcThresholds is None without DynamicThresholdFile.
+
+        If JunctionCacheDir is set, they are loaded from the cache there when it was built
+        from the same input, quantization factor and threshold file, else they are found
+        and saved there.
+        """
+        simplifyObj = GeomSimplify()
+        factor = simplifyObj.quantitizationFactor
+
+        if JunctionCacheDir:
+            with self.metrics.phase("junctions"):
+                source = JunctionCache.describe_source(
+                    inFile, factor, DynamicThresholdFile
+                )
+                junctionCache = JunctionCache.load(JunctionCacheDir)
+                if junctionCache is not None and junctionCache.source == source:
+                    dictArcThresholds = None
+                    if DynamicThresholdFile:
+                        dictArcThresholds = junctionCache.arc_threshold_dict()
+                    dictJunctions = junctionCache.junction_dict(factor)
+                    self.metrics.count("junctions", len(dictJunctions))
+                    return dictJunctions, dictArcThresholds
+
+        # create dictionary of all junctions in all shapes
+        dictJunctions = {}
+        with self.metrics.phase("junctions"):
+            simplifyObj.find_all_junctions_in_shapes(shapeStore, dictJunctions)
+        self.metrics.count("junctions", len(dictJunctions))
+
+        dictArcThresholds = None
+        if DynamicThresholdFile:
+            # create a dictionary of all arcs between junctions, keyed by the junction pair
+            # with value set to the average threshold of adjacent polygons
+            with self.metrics.phase("arc_thresholds"):
+                dictIsoThresholds = read_iso_thresholds(DynamicThresholdFile)
+                dictArcThresholds = simplifyObj.find_all_arc_thresholds_in_shapes(
+                    shapeStore,
+                    shapeStore.fields["iso3"],
+                    dictJunctions,
+                    dictIsoThresholds,
+                )
+            self.metrics.count("arcs", len(dictArcThresholds))
+
+        if JunctionCacheDir:
+            with self.metrics.phase("junctions"):
+                JunctionCache.from_dicts(
+                    source, factor, dictJunctions, dictArcThresholds
+                ).save(JunctionCacheDir)
+
+        return dictJunctions, dictArcThresholds
+
+    def read_timed(self, batches):
+        """
+        Yields the (shapes, records) 'batches', timed as the read phase, and counts their
+        features and vertices.
+        """
+        for shapes, records in self.metrics.timed(batches, "read"):
+            self.count_shapes(shapes, "in")
+            yield shapes, records
+
+    def count_shapes(self, shapes, suffix):
+        # Counts the features (not None) and vertices of 'shapes' as features_<suffix>
+        # and vertices_<suffix>
+        shapes = np.asarray(shapes, dtype=object)
+        self.metrics.count("features_" + suffix, (~shapely.is_missing(shapes)).sum())
+        self.metrics.count(
+            "vertices_" + suffix, shapely.get_num_coordinates(shapes).sum()
+        )
+
+    def finish_metrics(self, repairedBefore, heapOperationsBefore):
+        # Counts the repairs and heap operations since the start of the run
+        self.metrics.count("repaired", self_intersections_fixed - repairedBefore)
+        self.metrics.count(
+            "heap_operations", EliminationEngine.heapOperations - heapOperationsBefore
+        )
+        self.metrics.finish()
+
+    def process_file_tiled(
+        self,
+        inFile,
+        outFile,
+        threshold,
+        TileSize,
+        Workers=1,
+        PreventIntersections=False,
+        Prefilter=None,
+        checkpoint=None,
+    ):
+        """
+        Simplifies 'inFile' with topology one tile of TileSize x TileSize map units at a
+        time (see TileGrid) and writes every tile to 'outFile', tile after tile.
+
+        Only the bounding boxes of the features are kept for the whole layer. Each tile
+        reads its features and two bands of neighbors, finds their junctions, and
+        simplifies its own features (see simplify_tile). Tiles agree on the borders they
+        share, so they can run in a pool of 'Workers' processes.
+
+        With a 'checkpoint' every tile is saved as one chunk, and the tiles already
+        there are restored instead of simplified again.
+        """
+        global self_intersections_fixed
+
+        metrics = self.metrics
+        with metrics.phase("read"):
+            tileGrid = TileGrid.read(inFile, TileSize)
+        metrics.count("tiles", len(tileGrid))
+        restored = checkpoint.chunk_count() if checkpoint is not None else 0
+
+        def restoredResults():
+            for tile in range(restored):
+                simplifiedShapes, fixed, vertices, featureIds, _ = (
+                    checkpoint.load_chunk(tile)
+                )
+                yield featureIds, shapely.to_wkb(simplifiedShapes), fixed, 0, vertices
+
+        def tasks():
+            for tile in range(restored, len(tileGrid)):
+                featureIds, ringIds, contextIds = tileGrid.context(tile)
+                # Band 1 first (see pinned_points), then the rest of band 2
+                readIds = np.concatenate((ringIds, np.setdiff1d(contextIds, ringIds)))
+                yield (
+                    inFile,
+                    tileGrid.fids[featureIds],
+                    tileGrid.fids[readIds],
+                    tileGrid.tiles[readIds],
+                    len(ringIds),
+                    threshold,
+                    PreventIntersections,
+                    Prefilter,
+                )
+
+        if Workers > 1:
+            results = pool_map(simplify_tile, tasks(), Workers)
+        else:
+            results = (simplify_tile(*task) for task in tasks())
+        results = chain(restoredResults(), results)
+
+        # The properties are read back by feature id, without parsing the geometry again
+        with metrics.phase("write"), BatchWriter(outFile, inFile) as output:
+            for tile, result in enumerate(metrics.timed(results, "tiles")):
+                featureIds, simplifiedShapes, fixed, heapOperations, vertices = result
+                self_intersections_fixed += fixed
+                EliminationEngine.heapOperations += heapOperations
+                metrics.count("features_in", len(featureIds))
+                metrics.count("vertices_in", vertices)
+                simplifiedShapes = shapely.from_wkb(simplifiedShapes)
+                if checkpoint is not None and tile >= restored:
+                    with metrics.phase("checkpoint"):
+                        checkpoint.save_chunk(
+                            tile, simplifiedShapes, fixed, vertices, featureIds
+                        )
+                self.count_shapes(simplifiedShapes, "out")
+                output.write(
+                    simplifiedShapes,
+                    read_by_id(inFile, featureIds, readGeometry=False)[1],
+                )
+
+        print("Invalid geometries found and repaired: " + str(self_intersections_fixed))
+
+    def process_file_ranked(
+        self,
+        inFile,
+        outFiles,
+        thresholds,
+        Topology=False,
+        RankFile=None,
+        VertexBudget=None,
+        BudgetPerFeature=False,
+    ):
+        """
+        Writes one simplified copy of 'inFile' per threshold in 'thresholds' to the
+        matching path in 'outFiles'.
+
+        The input is read once, junctions are detected once and every line, ring and arc
+        is eliminated once (see RankStore). Each output is the same as a process_file run
+        with that single threshold. If 'RankFile' is set the ranks are loaded from (or
+        saved to) that sidecar file.
+
+        IF VertexBudget is set
+        'thresholds' is ignored and the single output keeps at most VertexBudget points
+        (a fraction of the points if below 1), for the whole layer or, with
+        BudgetPerFeature, for every feature (see RankStore.threshold_for_budget).
+        """
+        global self_intersections_fixed
+
+        if VertexBudget is None and len(outFiles) != len(thresholds):
+            raise ValueError("Expected one output file per threshold")
+
+        metrics = self.metrics
+
+        # The attributes, one batch of records per batch of features, and the input
+        # geometries: like a single threshold run, only the features simplification
+        # changed are repaired
+        records = []
+        originalShapes = []
+        if RankFile:
+            with metrics.phase("ranks"):
+                rankStore = self.load_rank_store(
+                    inFile, RankFile, Topology, records, originalShapes
+                )
+        else:
+            rankStore = self.build_rank_store(inFile, Topology, records, originalShapes)
+
+        if not records:
+            # The ranks came from the sidecar file, only the features are read
+            for batchShapes, batchRecords in metrics.timed(
+                read_batches(inFile, batch_size), "read"
+            ):
+                originalShapes.extend(batchShapes)
+                records.append(batchRecords)
+
+        if validate and sum(map(len, records)) != len(rankStore):
+            raise ValueError(
+                "Rank file does not match the input file: " + repr(RankFile)
+            )
+
+        if VertexBudget is not None:
+            thresholds = [
+                rankStore.threshold_for_budget(VertexBudget, BudgetPerFeature)
+            ]
+
+        for threshold, outFile in zip(thresholds, outFiles):
+            with metrics.phase("extract"):
+                simplifiedShapes = rankStore.extract(threshold)
+            with metrics.phase("repair"):
+                simplifiedShapes, repaired = repair_geometries(
+                    simplifiedShapes, originalShapes
+                )
+            self_intersections_fixed += repaired
+            self.count_shapes(simplifiedShapes, "out")
+
+            # create an outFile has the same crs, schema as inFile
+            with metrics.phase("write"), BatchWriter(outFile, inFile) as output:
+                start = 0
+                for batchRecords in records:
+                    output.write(
+                        simplifiedShapes[start : start + len(batchRecords)],
+                        batchRecords,
+                    )
+                    start += len(batchRecords)
+
+            vertexCount = int(shapely.get_num_coordinates(simplifiedShapes).sum())
+            if VertexBudget is not None:
+                label = "Vertex budget " + str(VertexBudget)
+            else:
+                label = "Threshold " + str(threshold)
+            print(label + ": " + str(vertexCount) + " vertices written to " + outFile)
+
+        print("Invalid geometries found and repaired: " + str(self_intersections_fixed))
+
+    def load_rank_store(
+        self, inFile, RankFile, Topology=False, records=None, shapes=None
+    ):
+        """
+        Loads the rank store saved in 'RankFile', or builds it and saves it there if the
+        file is missing or was built from a different input.
+        """
+        if not RankFile.endswith(".npz"):
+            RankFile += ".npz"
+
+        source = RankStore.describe_source(
+            inFile, Topology, GeomSimplify.quantitizationFactor
+        )
+        if os.path.exists(RankFile):
+            rankStore = RankStore.load(RankFile)
+            if rankStore.source == source:
+                return rankStore
+
+        rankStore = self.build_rank_store(inFile, Topology, records, shapes)
+        rankStore.save(RankFile)
+        return rankStore
+
+    def build_rank_store(self, inFile, Topology=False, records=None, shapes=None):
+        """
+        Runs the elimination once for every line, ring and unique arc of 'inFile' and
+        records the effective area of every vertex (see ArcStore.rank_store). The input
+        is read once; if 'records' is a list the attributes of every batch of features
+        are appended to it, and if 'shapes' is a list the geometries.
+        """
+        if shapes is None:
+            shapes = []
+        for batchShapes, batchRecords in self.read_timed(
+            read_batches(inFile, batch_size)
+        ):
+            shapes.extend(batchShapes)
+            if records is not None:
+                records.append(batchRecords)
+
+        source = RankStore.describe_source(
+            inFile, Topology, GeomSimplify.quantitizationFactor
+        )
+        if Topology:
+            dictJunctions = {}
+            with self.metrics.phase("junctions"):
+                GeomSimplify().find_all_junctions_in_shapes(shapes, dictJunctions)
+            self.metrics.count("junctions", len(dictJunctions))
+
+            # Rank every unique arc once, with the same arcs as a single threshold run
+            with self.metrics.phase("arcs"):
+                arcStore = ArcStore.build(shapes, GeomSimplify(dictJunctions))
+            self.metrics.count("arcs", len(arcStore.arcs))
+            with self.metrics.phase("ranks"):
+                return arcStore.rank_store(source)
+
+        simplify = GeomSimplify()
+        rankStore = RankStore(source)
+        with self.metrics.phase("ranks"):
+            for myShape in shapes:
+                rankStore.append(simplify.rank_shape(myShape))
+            rankStore.finish()
+
+        return rankStore
+
+
+def threshold_output_file(outFile, threshold):
+    """
+    Returns the output path used for one threshold of a multi-threshold run:
+    output/output.shp -> output/output_t0.0001.shp
+    """
+    root, extension = os.path.splitext(outFile)
+    return root + "_t" + repr(threshold) + extension
+
+
+def simplify_shape(simplify, myShape, threshold, Topology=False):
+    """
+    Simplifies one shape with the simplify_* (or simplify_*_topology) method of its type.
+    """
+    if isinstance(myShape, LineString):
+        if Topology:
+            return simplify.simplify_line_topology(myShape, threshold)
+        return simplify.simplify_line(myShape, threshold)
+
+    elif isinstance(myShape, MultiLineString):
+        if Topology:
+            return simplify.simplify_multiline_topology(myShape, threshold)
+        return simplify.simplify_multiline(myShape, threshold)
+
+    elif isinstance(myShape, Polygon):
+        if Topology:
+            return simplify.simplify_polygon_topology(myShape, threshold)
+        return simplify.simplify_polygon(myShape, threshold)
+
+    elif isinstance(myShape, MultiPolygon):
+        if Topology:
+            return simplify.simplify_multipolygon_topology(myShape, threshold)
+        return simplify.simplify_multipolygon(myShape, threshold)
+
+    raise ValueError("Unhandled geometry type: " + repr(myShape.geom_type))
+
+
+def simplify_worker(batch, threshold, PreventIntersections=False, Prefilter=None):
+    """
+    Runs in a pool process: simplifies and repairs a batch of WKB geometries. Returns the
+    simplified geometries as WKB (None where removed), the number repaired and the
+    number of heap operations.
+    """
+    heapOperations = EliminationEngine.heapOperations
+    simplify = GeomSimplify(
+        preventIntersections=PreventIntersections, prefilter=Prefilter
+    )
+    shapes = shapely.from_wkb(batch)
+    simplifiedShapes, repaired = repair_geometries(
+        [simplify_shape(simplify, myShape, threshold) for myShape in shapes], shapes
+    )
+
+    return (
+        shapely.to_wkb(simplifiedShapes),
+        repaired,
+        EliminationEngine.heapOperations - heapOperations,
+    )
+
+
+def simplify_in_pool(
+    batches, threshold, Workers, PreventIntersections=False, Prefilter=None
+):
+    """
+    Simplifies (shapes, records) batches (see featureio.read_batches) in a pool of
+    'Workers' processes and yields (simplified shapes, records) in input order.
+
+    The shapes of every batch are sent as WKB (see pool_map), the records stay here.
+    """
+    global self_intersections_fixed
+
+    records = deque()
+
+    def tasks():
+        for shapes, batchRecords in batches:
+            records.append(batchRecords)
+            yield (
+                shapely.to_wkb(shapes),
+                threshold,
+                PreventIntersections,
+                Prefilter,
+            )
+
+    for simplifiedShapes, fixed, heapOperations in pool_map(
+        simplify_worker, tasks(), Workers
+    ):
+        self_intersections_fixed += fixed
+        EliminationEngine.heapOperations += heapOperations
+        yield shapely.from_wkb(simplifiedShapes), records.popleft()
+
+
+def pool_map(function, tasks, Workers):
+    """
+    Yields function(*task) for every task of 'tasks', in order, computed in a pool of
+    'Workers' processes.
+
+    At most 2 tasks per worker are in flight; once that many are queued the oldest one is
+    waited for and yielded, so the caller gets results in order while memory stays bounded.
+    """
+    pending = deque()
+    with ProcessPoolExecutor(Workers) as pool:
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+
+            while len(pending) >= 2 * Workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def simplify_tile(
+    inFile,
+    featureIds,
+    readIds,
+    readTiles,
+    ringCount,
+    threshold,
+    PreventIntersections=False,
+    Prefilter=None,
+):
+    """
+    Runs in a pool process (or inline): simplifies the features 'featureIds' of one tile.
+    Features are given by their OGR feature ids (see TileGrid.fids).
+
+    readIds = the features to read, band 1 (which holds 'featureIds') first, then band 2
+    readTiles = the tile of every feature of readIds
+    ringCount = the number of features in band 1
+
+    The junctions are found over all of readIds, the shared points of band 1 rings with
+    few junctions are pinned (see pinned_points), and the tile's own features are cut
+    into arcs and simplified (see ArcStore). Returns featureIds, the simplified geometries
+    as WKB (None where removed), the number repaired, the number of heap operations and
+    the number of vertices of the tile's features.
+    """
+    heapOperations = EliminationEngine.heapOperations
+    shapes, _ = read_by_id(inFile, readIds)
+
+    dictJunctions = {}
+    simplify = GeomSimplify(
+        dictJunctions, preventIntersections=PreventIntersections, prefilter=Prefilter
+    )
+    simplify.find_all_junctions_in_shapes(shapes, dictJunctions)
+    for quant_point in pinned_points(
+        simplify, shapes, readTiles, ringCount, dictJunctions
+    ):
+        dictJunctions[quant_point] = 0
+
+    ringShapes = shapes[:ringCount]
+    ownShapes = ringShapes[np.isin(readIds[:ringCount], featureIds)]
+    arcStore = ArcStore.build(ownShapes, simplify, ringShapes)
+    simplifiedShapes, repaired = repair_geometries(
+        arcStore.simplify(threshold), ownShapes
+    )
+
+    return (
+        featureIds,
+        shapely.to_wkb(simplifiedShapes),
+        repaired,
+        EliminationEngine.heapOperations - heapOperations,
+        int(shapely.get_num_coordinates(ownShapes).sum()),
+    )
+
+
+def expanded_boxes(shapes, quantitizationFactor):
+    """
+    Returns the bounding boxes of 'shapes' grown by the quantization factor, so they hold
+    every point that quantizes like one of their points.
+    """
+    bounds = shapely.bounds(shapes) + np.tile(
+        np.asarray(quantitizationFactor, dtype=np.float64), 2
+    ) * np.array([-1, -1, 1, 1])
+    return shapely.box(*bounds.T)
+
+
+def read_iso_thresholds(DynamicThresholdFile):
+    """
+    Reads the dynamic threshold CSV (no header): one 'iso3,threshold' line per entity.
+    Returns a dictionary of thresholds keyed by iso3.
+    """
+    dictIsoThresholds = {}
+    with open(DynamicThresholdFile, "r", newline="") as iso_thresholds_file:
+        csvreader = csv.reader(iso_thresholds_file)
+        for line_array in csvreader:
+            if not line_array:
+                continue
+            if validate and len(line_array) != 2:
+                raise ValueError(
+                    "Unexpected number of columns in iso_thresholds_file for line: "
+                    + repr(line_array)
+                )
+            iso3 = line_array[0]
+            threshold = float(line_array[1])
+            dictIsoThresholds[iso3] = threshold
+
+    return dictIsoThresholds
 
 
 def str2bool(v):
@@ -211,7 +1437,8 @@ def main():
         "-o",
         "--output_file",
         dest="outputFile",
-        help="Output file with simplified geometries",
+        help="Output file with simplified geometries. The format follows the extension "
+        "(.shp, .gpkg, .geojson, .fgb or .parquet), else the format of the input",
         metavar="FILE",
     )
     parser.add_option(
@@ -219,7 +1446,8 @@ def main():
         "--threshold",
         dest="threshold",
         default=0,
-        help="Threshold for simplification. Exclusive with -d",
+        help="Threshold for simplification, or a comma separated list of thresholds to "
+        "write one output per threshold (output_t<threshold>.shp). Exclusive with -d",
     )
     parser.add_option(
         "-j",
@@ -236,6 +1464,120 @@ def main():
         help="CSV file containing iso3 and corresponding threshold value. Exclusive with -t",
         metavar="FILE",
     )
+    parser.add_option(
+        "-r",
+        "--ranks",
+        dest="rankFile",
+        help="Sidecar .npz file with the effective area of every vertex. Built on the first run, "
+        "later runs with any threshold reuse it. Exclusive with -d",
+        metavar="FILE",
+    )
+    parser.add_option(
+        "-n",
+        "--vertex_budget",
+        dest="vertexBudget",
+        type="float",
+        help="Keep at most this many points instead of using a threshold (a fraction "
+        "of the points if below 1). Exclusive with -t and -d",
+        metavar="COUNT",
+    )
+    parser.add_option(
+        "-w",
+        "--workers",
+        dest="workers",
+        type="int",
+        default=1,
+        help="Number of processes used to simplify the features (default 1). With -j, "
+        "the shared arcs are split between the processes (not with -d)",
+    )
+    parser.add_option(
+        "-c",
+        "--junction_cache",
+        dest="junctionCache",
+        help="With -j, directory caching the junctions (and -d arc thresholds). Built on the "
+        "first run, later runs on the same input reuse it",
+        metavar="DIR",
+    )
+    parser.add_option(
+        "--prevent_intersections",
+        action="store_true",
+        dest="preventIntersections",
+        default=False,
+        help="Keep points whose removal would make a ring (or, with -j, the arcs) cross "
+        "itself, so the output needs no repair. Not with -r, -n or several -t",
+    )
+    parser.add_option(
+        "--tile_size",
+        dest="tileSize",
+        type="float",
+        help="With -j, simplify square tiles of SIZE map units one at a time, so large "
+        "inputs fit in memory. Features are written tile by tile",
+        metavar="SIZE",
+    )
+    parser.add_option(
+        "--budget_per_feature",
+        dest="budgetPerFeature",
+        action="store_true",
+        default=False,
+        help="Apply the vertex budget to every feature instead of the whole layer",
+    )
+    parser.add_option(
+        "-e",
+        "--engine",
+        dest="engine",
+        default="visvalingam",
+        choices=list(ENGINES),
+        help="Simplification engine: visvalingam (default), geos (shapely.simplify, "
+        "not with -j) or coverage (shapely.coverage_simplify, with -j). The GEOS "
+        "tolerance is the square root of -t",
+    )
+    parser.add_option(
+        "--prefilter",
+        dest="prefilter",
+        type="float",
+        help="Before simplifying, remove the points collinear with their neighbors, "
+        "and collapse the single stair steps up to SIZE map units (the pixel size of a "
+        "polygonized raster; 0 for collinear points only). Not with -r, -n or several -t",
+        metavar="SIZE",
+    )
+    parser.add_option(
+        "--checkpoint",
+        dest="checkpoint",
+        help="Save the simplified batches (tiles with --tile_size) and the junctions in "
+        "this directory as they are done, so a stopped run can be resumed. Not with -r, "
+        "-n, several -t or another -e",
+        metavar="DIR",
+    )
+    parser.add_option(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        default=False,
+        help="With --checkpoint, continue a stopped run of the same input and options "
+        "from its checkpoint. The output is the same as a run that never stopped",
+    )
+    parser.add_option(
+        "--incremental",
+        dest="incremental",
+        help="Keep the state of the run in this directory, and only simplify again the "
+        "features (and with -j the junctions and arcs) that changed since the last run "
+        "there. The output is the same as a full run. Not with -d, -r, -n, several -t, "
+        "--tile_size, -c or --checkpoint",
+        metavar="DIR",
+    )
+    parser.add_option(
+        "--metrics",
+        dest="metricsFile",
+        help="Write the time of every phase and the counts of the run (features, "
+        "vertices, junctions, arcs, heap operations, repairs) to this JSON file",
+        metavar="FILE",
+    )
+    parser.add_option(
+        "--profile",
+        dest="profileFile",
+        help="Write a cProfile dump of the run to this file (see pstats)",
+        metavar="FILE",
+    )
 
     (options, args) = parser.parse_args()
 
@@ -255,10 +1597,13 @@ def main():
 
     threshold = options.threshold
     dynamic_thresholds = options.dynamicThresholds
-    if (not threshold and not dynamic_thresholds) or (threshold and dynamic_thresholds):
-        print(
-            "Must set either threshold or dynamic_thresholds, but NOT both and NOT nothing."
-        )
+    vertexBudget = options.vertexBudget
+    if vertexBudget is not None and vertexBudget >= 1:
+        vertexBudget = int(vertexBudget)
+    if [bool(threshold), bool(dynamic_thresholds), vertexBudget is not None].count(
+        True
+    ) != 1:
+        print("Must set exactly one of threshold, dynamic_thresholds or vertex_budget.")
         usage()
         exit()
 
@@ -266,18 +1611,49 @@ def main():
     # if len(sys.argv) == 6:
     #     dynamic_thresholds = sys.argv[5]
 
+    # A comma separated list of thresholds writes one output per threshold
+    if threshold:
+        threshold = [float(value) for value in str(threshold).split(",")]
+        if len(threshold) == 1:
+            threshold = threshold[0]
+
     geomSimplifyObject = SimplifyProcess()
 
-    if topology is False:
-        geomSimplifyObject.process_file(
-            inputFile, outputFile, float(threshold), topology
-        )
-        print("Finished simplifying file (with topology NOT preserved)!")
-    elif topology is True:
-        geomSimplifyObject.process_file(
-            inputFile, outputFile, float(threshold), topology, dynamic_thresholds
-        )
+    profiler = None
+    if options.profileFile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Dynamic thresholds, tiles and the junction cache only apply with topology
+    geomSimplifyObject.process_file(
+        inputFile,
+        outputFile,
+        threshold,
+        Topology=topology,
+        DynamicThresholdFile=dynamic_thresholds if topology else None,
+        RankFile=options.rankFile,
+        VertexBudget=vertexBudget,
+        BudgetPerFeature=options.budgetPerFeature,
+        Workers=options.workers,
+        TileSize=options.tileSize if topology else None,
+        JunctionCacheDir=options.junctionCache if topology else None,
+        PreventIntersections=options.preventIntersections,
+        Engine=options.engine,
+        Prefilter=options.prefilter,
+        CheckpointDir=options.checkpoint,
+        Resume=options.resume,
+        IncrementalDir=options.incremental,
+    )
+    if topology:
         print("Finished simplifying file (topology was preserved)!")
+    else:
+        print("Finished simplifying file (with topology NOT preserved)!")
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(options.profileFile)
+    if options.metricsFile:
+        geomSimplifyObject.metrics.save(options.metricsFile)
 
 
 def usage():
@@ -286,61 +1662,99 @@ def usage():
     )
 
 
-def check_invalid_geometry(shapeList):
-    # Check for self-intersecting rings, and fix
-    checkedShapeList = []
-    for shape in shapeList:
-        if isinstance(shape, Polygon):
-            shape = fix_self_intersections_polygon(shape)
-        elif isinstance(shape, MultiPolygon):
-            shape = fix_self_intersections_mpolygon(shape)
-
-        # TODO
-        # Check for interior rings that have points outside the exterior ring,
-
-        # Check if more than one interior ring touches the exterior ring
-
-        checkedShapeList.append(shape)
-
-    return checkedShapeList
+def check_options(mode, options, *excluded):
+    """
+    Raises a ValueError if any option of 'excluded' is set in 'options' (option name:
+    whether it is set), naming the ones 'mode' can not be used with.
+    """
+    conflicts = [name for name in excluded if options[name]]
+    if conflicts:
+        raise ValueError(mode + " can not be used with " + ", ".join(conflicts))
+
+
+def open_checkpoint(
+    CheckpointDir,
+    Resume,
+    inFile,
+    threshold,
+    Topology=False,
+    TileSize=None,
+    DynamicThresholdFile=None,
+    PreventIntersections=False,
+    Prefilter=None,
+):
+    """
+    Returns the Checkpoint of a run in 'CheckpointDir' (see Checkpoint.open), or None
+    without CheckpointDir. Workers is left out of the source, the output does not
+    depend on it.
+    """
+    if not CheckpointDir:
+        return None
+    source = Checkpoint.describe_source(
+        JunctionCache.describe_source(
+            inFile, GeomSimplify().quantitizationFactor, DynamicThresholdFile
+        ),
+        threshold,
+        Topology,
+        TileSize,
+        PreventIntersections,
+        Prefilter,
+        batch_size,
+        arcstore.checkpoint_points,
+    )
+    return Checkpoint.open(CheckpointDir, source, Resume)
 
 
-def fix_self_intersections_polygon(polygon):
-    global self_intersections_fixed
+def repair_geometries(shapes, originalShapes=None):
+    """
+    Repairs the invalid polygons and multipolygons of 'shapes' (simplified geometries,
+    None where removed) in one batch. Returns (NumPy object array, number repaired).
 
-    if validate:
-        if not isinstance(polygon, Polygon):
-            raise ValueError(
-                "Non-Polygon passed to fix_self_intersections_polygon: "
-                + repr(polygon.type)
-            )
+    If 'originalShapes' is given (the geometries before simplification, in the same
+    order), only the geometries that simplification changed are checked; the others are
+    written as they were read. Validity is tested with one shapely.is_valid call and the
+    invalid geometries are fixed with one shapely.make_valid call (see polygonal_parts).
+    """
+    shapeArray = np.empty(len(shapes), dtype=object)
+    shapeArray[:] = list(shapes)
+    shapes = shapeArray
+    check = np.isin(shapely.get_type_id(shapes), (POLYGON, MULTIPOLYGON))
+    if originalShapes is not None:
+        originalShapes = np.asarray(originalShapes, dtype=object)
+        check &= shapely.get_num_coordinates(shapes) != shapely.get_num_coordinates(
+            originalShapes
+        )
 
-    shape = polygon
-    if not polygon.is_valid:
-        shape = polygon.buffer(0)
-        self_intersections_fixed += 1
+    invalid = np.zeros(len(shapes), dtype=bool)
+    invalid[check] = ~shapely.is_valid(shapes[check])
+    if not invalid.any():
+        return shapes, 0
 
-    return shape
+    repairedShapes = shapely.make_valid(shapes[invalid])
+    for index, repairedShape in zip(np.flatnonzero(invalid), repairedShapes):
+        shapes[index] = polygonal_parts(repairedShape, shapes[index].geom_type)
 
+    return shapes, int(invalid.sum())
 
-def fix_self_intersections_mpolygon(mpolygon):
-    if validate:
-        if not isinstance(mpolygon, MultiPolygon):
-            raise ValueError(
-                "Non-MultiPolygon passed to fix_self_intersections_mpolygon: "
-                + repr(mpolygon.type)
-            )
 
-    checked_polygons = []
-    for polygon in mpolygon.geoms:
-        if not polygon.is_valid:
-            cleaned_shape = fix_self_intersections_polygon(polygon)
-            for p in cleaned_shape.geoms:
-                checked_polygons.append(p)
-        else:
-            checked_polygons.append(polygon)
+def polygonal_parts(myShape, geomType):
+    """
+    Returns the polygons of a shapely.make_valid result as a shape of 'geomType' (a
+    Polygon stays a Polygon if it was repaired into a single polygon), or None if
+    nothing but collapsed lines and points are left.
+    """
+    polygons = []
+    for part in shapely.get_parts(myShape):
+        if isinstance(part, Polygon):
+            polygons.append(part)
+        elif isinstance(part, MultiPolygon):
+            polygons.extend(part.geoms)
 
-    return MultiPolygon(checked_polygons)
+    if not polygons:
+        return None
+    if geomType == "Polygon" and len(polygons) == 1:
+        return polygons[0]
+    return MultiPolygon(polygons)
 
 
 if __name__ == "__main__":
@@ -350,3 +1764,5 @@ if __name__ == "__main__":
 # python simplify_topology.py -i input/input.shp -o output/output.shp -t 0.0001
 # python simplify_topology.py -i input/input.shp -o output/output.shp -t 0.0001 -j
 # python simplify_topology.py -i input/input.shp -o output/output.shp -d dynamic_thresholds.csv
+# python simplify_topology.py -i input/input.shp -o output/output.shp -t 0.0001 -j --tile_size 10000 -w 8
+# python simplify_topology.py -i input/input.shp -o output/output.shp -t 0.0001 -j -c output/input_junctions
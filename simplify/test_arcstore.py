@@ -0,0 +1,139 @@
+__author__ = "asimmons"
+
+from geomsimplify import *
+from arcstore import ArcStore, partition_arcs
+from nose.tools import *
+import unittest
+
+
+class test_ArcStore(unittest.TestCase):
+    """
+    'ArcStore' keeps every border between two polygons once, and must give the same shapes
+    as the simplify_*_topology methods.
+    """
+
+    def setUp(self):
+        # Two squares sharing a wavy border, and a line crossing nothing
+        border = [(10, 0), (11, 2), (9, 4), (11, 6), (9, 8), (10, 10)]
+        self.shapes = [
+            Polygon([(0, 0)] + border + [(0, 10)]),
+            Polygon([(20, 0), (20, 10)] + border[::-1]),
+            LineString([(30, 0), (31, 5), (30, 10)]),
+        ]
+        dictJunctions = {}
+        GeomSimplify().find_all_junctions_in_shapes(self.shapes, dictJunctions)
+        self.dictJunctions = dictJunctions
+
+    def test_shared_border_stored_once(self):
+        arcStore = ArcStore.build(self.shapes, GeomSimplify(dict(self.dictJunctions)))
+
+        # the wavy border is one arc, used forwards by one square and backwards by the other
+        borderArcs = [points for points in arcStore.arcs if (11.0, 2.0) in points]
+        assert_equal(len(borderArcs), 1)
+        firstIds = set(arcStore.features[0][1][0][0])
+        secondIds = set(arcStore.features[1][1][0][0])
+        shared = [arcId for arcId in firstIds if ~arcId in secondIds]
+        assert_equal(len(shared), 1)
+
+    def test_matches_simplify_topology(self):
+        for threshold in (0, 3, 10, 1000):
+            arcStore = ArcStore.build(
+                self.shapes, GeomSimplify(dict(self.dictJunctions))
+            )
+            result = arcStore.simplify(threshold)
+
+            g = GeomSimplify(dict(self.dictJunctions))
+            expected = [
+                g.simplify_polygon_topology(self.shapes[0], threshold),
+                g.simplify_polygon_topology(self.shapes[1], threshold),
+                g.simplify_line_topology(self.shapes[2], threshold),
+            ]
+            for simpleShape, expectedShape in zip(result, expected):
+                if expectedShape is None:
+                    assert_equal(simpleShape, None)
+                else:
+                    assert simpleShape.equals_exact(expectedShape, 0)
+
+    def test_shared_border_identical(self):
+        arcStore = ArcStore.build(self.shapes, GeomSimplify(dict(self.dictJunctions)))
+        first, second, line = arcStore.simplify(3)
+
+        border = first.exterior.intersection(second.exterior)
+        assert_true(border.length > 10)
+
+    def test_workers_match_serial(self):
+        for threshold in (0, 3, 10):
+            arcStore = ArcStore.build(
+                self.shapes, GeomSimplify(dict(self.dictJunctions))
+            )
+            serial = arcStore.simplify(threshold)
+            parallel = arcStore.simplify(threshold, Workers=2)
+
+            for simpleShape, expectedShape in zip(parallel, serial):
+                if expectedShape is None:
+                    assert_equal(simpleShape, None)
+                else:
+                    assert simpleShape.equals_exact(expectedShape, 0)
+
+    def test_arc_cache(self):
+        arcStore = ArcStore.build(self.shapes, GeomSimplify(dict(self.dictJunctions)))
+        expected = arcStore.simplify(3)
+        arcCache = {}
+        arcStore.simplify(3, arcCache=arcCache)
+        assert_equal(len(arcCache), len(arcStore.arcs))
+
+        # Cached arcs are not simplified again
+        heapOperations = EliminationEngine.heapOperations
+        for simpleShape, expectedShape in zip(
+            arcStore.simplify(3, arcCache=arcCache), expected
+        ):
+            assert simpleShape.equals_exact(expectedShape, 0)
+        assert_equal(EliminationEngine.heapOperations, heapOperations)
+
+    def test_rank_store_matches_simplify(self):
+        arcStore = ArcStore.build(self.shapes, GeomSimplify(dict(self.dictJunctions)))
+        rankStore = arcStore.rank_store()
+
+        for threshold in (0, 0.6, 3, 10, 1000):
+            for simpleShape, expectedShape in zip(
+                rankStore.extract(threshold), arcStore.simplify(threshold)
+            ):
+                if expectedShape is None:
+                    assert_equal(simpleShape, None)
+                else:
+                    assert_equal(simpleShape.geom_type, expectedShape.geom_type)
+                    assert simpleShape.equals_exact(expectedShape, 0)
+
+    def test_rank_store_shares_border(self):
+        # The zigzag is ranked once, so both squares drop the same points of it
+        arcStore = ArcStore.build(self.shapes, GeomSimplify(dict(self.dictJunctions)))
+        first, second, line = arcStore.rank_store().extract(3)
+
+        border = first.exterior.intersection(second.exterior)
+        assert_true(border.length > 10)
+        assert_equal(
+            sorted(set(first.exterior.coords) & set(second.exterior.coords)),
+            sorted(set(first.exterior.coords) - {(0.0, 0.0), (0.0, 10.0)}),
+        )
+
+    def test_budget_counts_border_once(self):
+        arcStore = ArcStore.build(self.shapes, GeomSimplify(dict(self.dictJunctions)))
+        first, second, line = arcStore.simplify_to_budget(12)
+
+        # The border is kept whole on both sides, and its points count once
+        assert_true(first.exterior.intersection(second.exterior).length > 10)
+        points = set(first.exterior.coords) | set(second.exterior.coords)
+        assert_true(len(points) + len(line.coords) <= 12)
+
+    def test_partition_arcs(self):
+        offsets = np.array([0, 10, 12, 30, 31, 40])
+        bounds = partition_arcs(offsets, 3)
+
+        assert_equal(bounds[0], 0)
+        assert_equal(bounds[-1], 5)
+        assert_true(len(bounds) <= 4)
+        assert_true(np.all(np.diff(bounds) > 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
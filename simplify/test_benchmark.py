@@ -0,0 +1,76 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+from geomsimplify import *
+from benchmark import *
+from nose.tools import *
+import unittest
+
+
+class test_Benchmark(unittest.TestCase):
+    def test_inputs_are_reproducible(self):
+        for case in CASES:
+            first = GENERATORS[case](20, 3)
+            second = GENERATORS[case](20, 3)
+            assert_true(shapely.equals_exact(first, second, 0).all())
+
+    def test_mosaics_are_valid_coverages(self):
+        for cells in (voronoi_mosaic(30), staircase_polygons(30)):
+            assert_true(shapely.is_valid(cells).all())
+            assert_almost_equal(
+                shapely.area(cells).sum(), shapely.union_all(cells).area, 3
+            )
+
+    def test_run_case(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        inFile, csvFile = write_input(directory, "voronoi", 20)
+        result = run_case(inFile, csvFile, "topology", directory)
+
+        assert_equal(result["input"], "voronoi_20_0")
+        assert_equal(result["features"], 20)
+        assert_true(0 < result["vertices_out"] < result["vertices_in"])
+        assert_true(result["peak_rss_mb"] > 0)
+
+    def test_compare_reports(self):
+        baseline = {
+            "results": [
+                {
+                    "input": "a",
+                    "mode": "plain",
+                    "seconds": 2.0,
+                    "peak_rss_mb": 10.0,
+                    "vertices_out": 5,
+                },
+                {"input": "b", "mode": "plain", "error": "ValueError()"},
+            ]
+        }
+        report = {
+            "results": [
+                {
+                    "input": "a",
+                    "mode": "plain",
+                    "seconds": 1.0,
+                    "peak_rss_mb": 10.0,
+                    "vertices_out": 6,
+                },
+                {
+                    "input": "b",
+                    "mode": "plain",
+                    "seconds": 1.0,
+                    "peak_rss_mb": 10.0,
+                    "vertices_out": 6,
+                },
+            ]
+        }
+        lines = compare_reports(baseline, report)
+
+        assert_equal(len(lines), 2)
+        assert_true("(x0.50)" in lines[0] and "vertices 5 -> 6" in lines[0])
+        assert_true("ValueError() -> ok" in lines[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
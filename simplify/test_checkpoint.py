@@ -0,0 +1,150 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from shapely.geometry import Point
+from geomsimplify import *
+from checkpoint import Checkpoint, pack_wkb, unpack_wkb
+from testshapes import wavy_grid, write_polygons
+from simplify_topology import SimplifyProcess
+import simplify_topology
+import arcstore
+from nose.tools import *
+import unittest
+
+
+class test_Checkpoint(unittest.TestCase):
+    def setUp(self):
+        # A 4 x 4 grid of squares with wavy shared borders, written 3 features a batch
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inFile = os.path.join(self.directory, "squares.shp")
+        self.csvFile = os.path.join(self.directory, "iso.csv")
+        self.checkpointDir = os.path.join(self.directory, "checkpoint")
+        write_polygons(
+            self.inFile,
+            wavy_grid(),
+            [{"iso3": "AAA" if index % 4 < 2 else "BBB"} for index in range(16)],
+        )
+        with open(self.csvFile, "w") as csvFile:
+            csvFile.write("AAA,3\r\nBBB,5\r\n")
+        self.batchSize = simplify_topology.batch_size
+        simplify_topology.batch_size = 3
+        self.checkpointPoints = arcstore.checkpoint_points
+        arcstore.checkpoint_points = 50
+
+    def tearDown(self):
+        simplify_topology.batch_size = self.batchSize
+        arcstore.checkpoint_points = self.checkpointPoints
+
+    def read_output(self, outFile):
+        with fiona.open(outFile, "r") as input:
+            return [
+                (shape(myGeom["geometry"]), dict(myGeom["properties"]))
+                for myGeom in input
+            ]
+
+    def stop_after(self, chunks):
+        # Leaves the checkpoint as a run stopped after 'chunks' chunks would
+        checkpoint = Checkpoint(self.checkpointDir, None)
+        for index in range(chunks, checkpoint.chunk_count()):
+            os.remove(checkpoint.chunk_file(index))
+
+    def assert_resumes(self, threshold, chunks, **options):
+        outFile = os.path.join(self.directory, "output.shp")
+        resumedFile = os.path.join(self.directory, "resumed.shp")
+        process = SimplifyProcess()
+        process.process_file(
+            self.inFile, outFile, threshold, CheckpointDir=self.checkpointDir, **options
+        )
+        heapOperations = process.metrics.counts["heap_operations"]
+        self.stop_after(chunks)
+
+        process = SimplifyProcess()
+        process.process_file(
+            self.inFile,
+            resumedFile,
+            threshold,
+            CheckpointDir=self.checkpointDir,
+            Resume=True,
+            **options
+        )
+
+        resumed = self.read_output(resumedFile)
+        expected = self.read_output(outFile)
+        assert_equal(len(resumed), 16)
+        assert_equal(len(resumed), len(expected))
+        for (simpleShape, properties), (expectedShape, expectedProperties) in zip(
+            resumed, expected
+        ):
+            assert simpleShape.equals_exact(expectedShape, 0)
+            assert_equal(properties, expectedProperties)
+        assert_true(process.metrics.counts["heap_operations"] < heapOperations)
+        return process
+
+    def test_pack_wkb(self):
+        shapes = [Point(1, 2), None, LineString([(0, 0), (1, 1)])]
+        unpacked = unpack_wkb(*pack_wkb(shapes))
+
+        assert_equal(unpacked[1], None)
+        assert unpacked[0].equals_exact(shapes[0], 0)
+        assert unpacked[2].equals_exact(shapes[2], 0)
+
+    def test_resume_no_topology(self):
+        self.assert_resumes(8.0, 2)
+
+    def test_resume_pool(self):
+        self.assert_resumes(8.0, 3, Workers=2)
+
+    def test_resume_topology(self):
+        # The keep masks of the first 2 runs of arcs are restored
+        self.assert_resumes(8.0, 2, Topology=True)
+        assert_true(Checkpoint(self.checkpointDir, None).chunk_count() > 3)
+
+    def test_resume_topology_done(self):
+        # The last chunk holds the simplified layer, nothing is simplified again
+        process = self.assert_resumes(8.0, 100, Topology=True)
+        assert_equal(process.metrics.counts["heap_operations"], 0)
+
+    def test_resume_dynamic(self):
+        # The later batches reuse the arcs of the restored ones
+        self.assert_resumes(None, 2, Topology=True, DynamicThresholdFile=self.csvFile)
+
+    def test_resume_tiles(self):
+        self.assert_resumes(8.0, 2, Topology=True, TileSize=40)
+
+    def test_other_options_start_over(self):
+        outFile = os.path.join(self.directory, "output.shp")
+        SimplifyProcess().process_file(
+            self.inFile, outFile, 8.0, CheckpointDir=self.checkpointDir
+        )
+        assert_equal(Checkpoint(self.checkpointDir, None).chunk_count(), 6)
+
+        process = SimplifyProcess()
+        process.process_file(
+            self.inFile, outFile, 9.0, CheckpointDir=self.checkpointDir, Resume=True
+        )
+        fresh = SimplifyProcess()
+        fresh.process_file(self.inFile, outFile, 9.0)
+        # Nothing restored from the run with another threshold
+        assert_equal(
+            process.metrics.counts["heap_operations"],
+            fresh.metrics.counts["heap_operations"],
+        )
+        assert_equal(Checkpoint(self.checkpointDir, None).chunk_count(), 6)
+
+    def test_resume_needs_checkpoint(self):
+        assert_raises(
+            ValueError,
+            SimplifyProcess().process_file,
+            self.inFile,
+            os.path.join(self.directory, "output.shp"),
+            8.0,
+            Resume=True,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
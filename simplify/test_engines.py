@@ -0,0 +1,133 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from shapely.geometry import box, mapping
+from geomsimplify import *
+from engines import *
+from compare_engines import RUNS, compare_engines, differences
+from simplify_topology import SimplifyProcess
+from featureio import read_batches
+from nose.tools import *
+import unittest
+
+
+class test_Engines(unittest.TestCase):
+    def setUp(self):
+        # Two squares sharing a wavy border
+        border = [(10, 0), (12, 2), (8, 4), (12, 6), (8, 8), (10, 10)]
+        self.shapes = np.empty(2, dtype=object)
+        self.shapes[:] = [
+            Polygon([(0, 0)] + border + [(0, 10)]),
+            Polygon([(20, 0), (20, 10)] + border[::-1]),
+        ]
+
+    def test_geos_engine(self):
+        simplifiedShapes = SimplifyProcess().simplify_geometries(
+            self.shapes, 16, Engine="geos"
+        )
+
+        for myShape, simpleShape in zip(self.shapes, simplifiedShapes):
+            expected = shapely.simplify(myShape, 4, preserve_topology=True)
+            assert_true(simpleShape.equals_exact(expected, 0))
+
+    def test_engine_modes(self):
+        process = SimplifyProcess()
+        assert_raises(
+            ValueError,
+            process.simplify_geometries,
+            self.shapes,
+            16,
+            True,
+            1,
+            False,
+            "geos",
+        )
+        assert_raises(
+            ValueError, process.simplify_geometries, self.shapes, 16, Engine="coverage"
+        )
+        assert_raises(
+            ValueError, process.simplify_geometries, self.shapes, 16, Engine="other"
+        )
+
+    def test_coverage_engine(self):
+        if coverage_simplify is None:
+            assert_false("coverage" in available_engines())
+            assert_raises(ValueError, check_engine, "coverage", True)
+            return
+
+        first, second = SimplifyProcess().simplify_geometries(
+            self.shapes, 16, Topology=True, Engine="coverage"
+        )
+        assert_almost_equal(first.intersection(second).area, 0)
+        assert_almost_equal(first.area + second.area, 200)
+
+    def test_process_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        inFile = os.path.join(directory, "squares.shp")
+        schema = {"geometry": "Polygon", "properties": {"name": "str"}}
+        with fiona.open(inFile, "w", "ESRI Shapefile", schema) as output:
+            for index, square in enumerate(self.shapes):
+                output.write(
+                    {"geometry": mapping(square), "properties": {"name": str(index)}}
+                )
+
+        outFile = os.path.join(directory, "output.shp")
+        process = SimplifyProcess()
+        process.process_file(inFile, outFile, 16, Engine="geos")
+
+        # The shapefile reverses the rings, which changes what Douglas-Peucker keeps
+        inShapes = next(read_batches(inFile, 10))[0]
+        shapes = next(read_batches(outFile, 10))[0]
+        assert_equal(len(shapes), 2)
+        for myShape, simpleShape in zip(inShapes, shapes):
+            expected = shapely.simplify(myShape, 4, preserve_topology=True)
+            assert_true(simpleShape.equals_exact(expected, 0))
+        assert_true("write" in process.metrics.phases)
+        assert_raises(
+            ValueError,
+            process.process_file,
+            inFile,
+            outFile,
+            16,
+            False,
+            None,
+            None,
+            None,
+            False,
+            1,
+            None,
+            None,
+            True,
+            "geos",
+        )
+
+    def test_compare_engines(self):
+        results = compare_engines(self.shapes, 16)
+
+        assert_equal([result["run"] for result in results], list(RUNS))
+        for result in results:
+            if result["engine"] == "coverage" and coverage_simplify is None:
+                assert_true("error" in result)
+                continue
+            assert_true(result["vertices_out"] < result["vertices_in"])
+            assert_equal(result["reference"], "visvalingam")
+        assert_equal(results[0]["to_reference"]["hausdorff_max"], 0)
+
+    def test_differences(self):
+        shapes = np.empty(2, dtype=object)
+        shapes[:] = [box(0, 0, 2, 2), None]
+        simplifiedShapes = np.empty(2, dtype=object)
+        simplifiedShapes[:] = [box(0, 0, 2, 1), box(0, 0, 1, 1)]
+
+        result = differences(shapes, simplifiedShapes)
+        assert_equal(result["features"], 1)
+        assert_almost_equal(result["size_change"], 0.5)
+        assert_almost_equal(result["hausdorff_max"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from shapely.geometry import mapping, Point
+from geomsimplify import *
+from featureio import (
+    BatchWriter,
+    output_driver,
+    read_batches,
+    read_by_id,
+    record_dicts,
+    record_values,
+)
+import featureio
+from simplify_topology import SimplifyProcess
+from nose.tools import *
+import unittest
+
+
+class test_FeatureIO(unittest.TestCase):
+    def setUp(self):
+        self.squares = [
+            Polygon([(i, 0), (i + 1, 0), (i + 1, 1), (i, 1)]) for i in range(5)
+        ]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inFile = os.path.join(self.directory, "squares.shp")
+        schema = {"geometry": "Polygon", "properties": {"name": "str", "rank": "int"}}
+        with fiona.open(self.inFile, "w", "ESRI Shapefile", schema) as output:
+            for index, square in enumerate(self.squares):
+                output.write(
+                    {
+                        "geometry": mapping(square),
+                        "properties": {"name": str(index), "rank": index},
+                    }
+                )
+
+    def read_by_name(self, outFile):
+        return {
+            properties["name"]: myShape
+            for shapes, records in read_batches(outFile, 10)
+            for myShape, properties in zip(shapes, record_dicts(records))
+        }
+
+    def test_read_batches(self):
+        batches = list(read_batches(self.inFile, 2))
+
+        assert_equal([len(shapes) for shapes, _ in batches], [2, 2, 1])
+        shapes = np.concatenate([shapes for shapes, _ in batches])
+        for myShape, square in zip(shapes, self.squares):
+            assert myShape.equals(square)
+        assert_equal(record_dicts(batches[2][1]), [{"name": "4", "rank": 4}])
+
+    def test_read_fields_only(self):
+        batches = list(
+            read_batches(self.inFile, 10, readGeometry=False, fields=["name"])
+        )
+
+        assert_equal(batches[0][0], None)
+        assert_equal(
+            [properties["name"] for properties in record_dicts(batches[0][1])],
+            ["0", "1", "2", "3", "4"],
+        )
+
+    def test_read_by_id(self):
+        shapes, records = read_by_id(self.inFile, [3, 1])
+
+        assert shapes[0].equals(self.squares[3])
+        assert_equal(
+            [properties["rank"] for properties in record_dicts(records)], [3, 1]
+        )
+
+    @unittest.skipIf(featureio.pyogrio is None, "needs pyogrio and pyarrow")
+    def test_read_by_id_many(self):
+        # More ids than one OGRSQL filter takes, in reverse order. A GeoPackage
+        # returns the rows by feature id (which starts at 1) whatever the order asked.
+        inFile = os.path.join(self.directory, "points.gpkg")
+        schema = {"geometry": "Point", "properties": {"rank": "int"}}
+        with fiona.open(inFile, "w", "GPKG", schema) as output:
+            output.writerecords(
+                {"geometry": mapping(Point(index, 0)), "properties": {"rank": index}}
+                for index in range(6000)
+            )
+        ranks = list(range(5999, -1, -2))
+        shapes, records = read_by_id(inFile, [rank + 1 for rank in ranks])
+
+        assert_equal(record_values(records, "rank"), ranks)
+        assert_equal(list(shapely.get_x(shapes)), ranks)
+
+    def test_writer_skips_removed(self):
+        outFile = os.path.join(self.directory, "output.shp")
+        with BatchWriter(outFile, self.inFile) as output:
+            for shapes, records in read_batches(self.inFile, 2):
+                shapes[0] = None
+                output.write(shapes, records)
+
+        with fiona.open(self.inFile, "r") as input:
+            schema = input.schema
+        with fiona.open(outFile, "r") as input:
+            assert_equal(input.schema, schema)
+            names = [myGeom["properties"]["name"] for myGeom in input]
+        assert_equal(names, ["1", "3"])
+
+    def test_output_driver(self):
+        assert_equal(output_driver("output.fgb", "ESRI Shapefile"), "FlatGeobuf")
+        assert_equal(output_driver("output.PARQUET", "ESRI Shapefile"), "Parquet")
+        assert_equal(output_driver("output.tab", "ESRI Shapefile"), "ESRI Shapefile")
+
+    def test_write_flatgeobuf(self):
+        # A Polygon shapefile also holds MultiPolygons. The spatial index stores the
+        # features in spatial order
+        outFile = os.path.join(self.directory, "output.fgb")
+        shapes = np.empty(2, dtype=object)
+        shapes[:] = [self.squares[0], MultiPolygon(self.squares[2:4])]
+        with BatchWriter(outFile, self.inFile) as output:
+            output.write(shapes, [{"name": "a", "rank": 1}, {"name": "b", "rank": 2}])
+
+        shapes, records = next(read_batches(outFile, 10))
+        result = {
+            properties["name"]: myShape.geom_type
+            for myShape, properties in zip(shapes, record_dicts(records))
+        }
+        assert_equal(result, {"a": "Polygon", "b": "MultiPolygon"})
+
+    def test_process_file_to_flatgeobuf(self):
+        outFile = os.path.join(self.directory, "output.shp")
+        fgbFile = os.path.join(self.directory, "output.fgb")
+        SimplifyProcess().process_file(self.inFile, outFile, 0.1, True)
+        SimplifyProcess().process_file(self.inFile, fgbFile, 0.1, True)
+
+        expected = self.read_by_name(outFile)
+        result = self.read_by_name(fgbFile)
+        assert_equal(sorted(result), sorted(expected))
+        for name, simpleShape in result.items():
+            assert simpleShape.equals_exact(expected[name], 0)
+
+    @unittest.skipIf(featureio.pyogrio is None, "pyogrio and pyarrow are not installed")
+    def test_parquet_streamed_by_row_group(self):
+        outFile = os.path.join(self.directory, "output.parquet")
+        rowGroupSize = featureio.PARQUET_ROW_GROUP_SIZE
+        featureio.PARQUET_ROW_GROUP_SIZE = 2
+        try:
+            with BatchWriter(outFile, self.inFile) as output:
+                for shapes, records in read_batches(self.inFile, 3):
+                    output.write(shapes, records)
+                    # Only the rows of an unfinished row group are held
+                    assert_true(output.pendingRows < 2)
+        finally:
+            featureio.PARQUET_ROW_GROUP_SIZE = rowGroupSize
+
+        parquetFile = featureio.pyarrow.parquet.ParquetFile(outFile)
+        assert_equal(parquetFile.num_row_groups, 3)
+        assert_true(b"geo" in parquetFile.schema_arrow.metadata)
+        table = parquetFile.read()
+        shapes = shapely.from_wkb(table.column("geometry").to_numpy(False))
+        for myShape, square in zip(shapes, self.squares):
+            assert myShape.equals(square)
+        assert_equal(table.column("rank").to_pylist(), [0, 1, 2, 3, 4])
+
+    @unittest.skipIf(featureio.pyogrio is None, "pyogrio and pyarrow are not installed")
+    def test_flatgeobuf_streamed(self):
+        # The batches go to one layer creation run by a thread, a queue of one batch
+        # at most is held
+        outFile = os.path.join(self.directory, "output.fgb")
+        queueSize = featureio.STREAM_QUEUE_SIZE
+        featureio.STREAM_QUEUE_SIZE = 1
+        try:
+            with BatchWriter(outFile, self.inFile) as output:
+                for shapes, records in read_batches(self.inFile, 1):
+                    output.write(shapes, records)
+                    assert_true(output.streamThread.is_alive())
+                    assert_true(output.stream.qsize() <= 1)
+                    assert_equal(output.pending, [])
+        finally:
+            featureio.STREAM_QUEUE_SIZE = queueSize
+
+        assert_false(output.streamThread.is_alive())
+        result = self.read_by_name(outFile)
+        assert_equal(sorted(result), ["0", "1", "2", "3", "4"])
+        for name, myShape in result.items():
+            assert myShape.equals(self.squares[int(name)])
+
+    @unittest.skipIf(featureio.pyogrio is None, "pyogrio and pyarrow are not installed")
+    def test_flatgeobuf_stream_abandoned(self):
+        # An error of the caller ends the stream thread and is raised as is
+        outFile = os.path.join(self.directory, "output.fgb")
+        with assert_raises(KeyError):
+            with BatchWriter(outFile, self.inFile) as output:
+                output.write(*next(read_batches(self.inFile, 2)))
+                raise KeyError("stop")
+
+        assert_false(output.streamThread.is_alive())
+        assert_true(output.streamError is not None)
+
+
+if __name__ == "__main__":
+    unittest.main()
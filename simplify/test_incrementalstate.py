@@ -0,0 +1,151 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from geomsimplify import *
+from incrementalstate import IncrementalState, pack_digests, unpack_digests
+from simplify_topology import SimplifyProcess
+from testshapes import wavy_edge, wavy_grid, write_polygons
+from nose.tools import *
+import unittest
+
+
+class test_IncrementalState(unittest.TestCase):
+    def setUp(self):
+        # A 4 x 4 grid of squares with wavy shared borders, plus a tab under the first
+        # square that only has 2 junctions (so it gets an artificial one)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stateDir = os.path.join(self.directory, "state")
+        self.shapes = wavy_grid()
+        self.shapes.append(
+            Polygon(wavy_edge((0, 0), (20, 0)) + [(20, -12), (9, -15), (0, -12)])
+        )
+
+    def write_input(self, name, shapes):
+        return write_polygons(os.path.join(self.directory, name + ".shp"), shapes)
+
+    def read_output(self, outFile):
+        with fiona.open(outFile, "r") as input:
+            return [
+                (shape(myGeom["geometry"]), dict(myGeom["properties"]))
+                for myGeom in input
+            ]
+
+    def assert_matches_full_run(self, inFile, Topology=True, threshold=8.0):
+        # Runs 'inFile' incrementally and from scratch, returns the incremental counts
+        outFile = os.path.join(self.directory, "incremental.shp")
+        fullFile = os.path.join(self.directory, "full.shp")
+        process = SimplifyProcess()
+        process.process_file(
+            inFile, outFile, threshold, Topology, IncrementalDir=self.stateDir
+        )
+        SimplifyProcess().process_file(inFile, fullFile, threshold, Topology)
+
+        output = self.read_output(outFile)
+        expected = self.read_output(fullFile)
+        assert_equal(len(output), len(expected))
+        for (simpleShape, properties), (expectedShape, expectedProperties) in zip(
+            output, expected
+        ):
+            assert simpleShape.equals_exact(expectedShape, 0)
+            assert_equal(properties, expectedProperties)
+        return process.metrics.counts
+
+    def edited_shapes(self):
+        # Moves a point of square 5, removes square 10 and swaps the first two squares
+        shapes = list(self.shapes)
+        points = list(shapes[5].exterior.coords)
+        points[2] = (points[2][0], points[2][1] + 1)
+        shapes[5] = Polygon(points)
+        del shapes[10]
+        shapes[0], shapes[1] = shapes[1], shapes[0]
+        return shapes
+
+    def test_digests_round_trip(self):
+        digests = [bytes(range(20)), None, bytes(range(1, 21))]
+
+        assert_equal(unpack_digests(pack_digests(digests)), digests)
+
+    def test_topology_matches_full_run(self):
+        counts = self.assert_matches_full_run(self.write_input("first", self.shapes))
+        assert_equal(counts["features_simplified"], 17)
+
+        counts = self.assert_matches_full_run(
+            self.write_input("second", self.edited_shapes())
+        )
+        # The old square 5 and square 10
+        assert_equal(counts["features_changed"], 1)
+        assert_equal(counts["features_removed"], 2)
+        assert_true(0 < counts["features_simplified"] < 16)
+
+    def test_tab_changed(self):
+        self.assert_matches_full_run(self.write_input("first", self.shapes))
+        shapes = list(self.shapes)
+        shapes[-1] = Polygon(
+            wavy_edge((0, 0), (20, 0)) + [(20, -12), (10, -18), (0, -12)]
+        )
+
+        counts = self.assert_matches_full_run(self.write_input("second", shapes))
+        assert_equal(counts["features_changed"], 1)
+        assert_true(counts["features_simplified"] < 17)
+
+    def test_unchanged_input(self):
+        inFile = self.write_input("first", self.shapes)
+        self.assert_matches_full_run(inFile)
+
+        counts = self.assert_matches_full_run(inFile)
+        assert_equal(counts["features_simplified"], 0)
+        assert_equal(counts["heap_operations"], 0)
+
+    def test_no_topology(self):
+        self.assert_matches_full_run(self.write_input("first", self.shapes), False)
+
+        counts = self.assert_matches_full_run(
+            self.write_input("second", self.edited_shapes()), False
+        )
+        assert_equal(counts["features_simplified"], 1)
+
+    def test_other_threshold_simplifies_everything(self):
+        self.assert_matches_full_run(self.write_input("first", self.shapes))
+
+        counts = self.assert_matches_full_run(
+            self.write_input("second", self.edited_shapes()), threshold=9.0
+        )
+        assert_equal(counts["features_simplified"], 16)
+        assert_not_equal(IncrementalState.load(self.stateDir), None)
+
+    def test_unused_arcs_pruned(self):
+        self.assert_matches_full_run(self.write_input("first", self.shapes))
+        inFile = self.write_input("second", self.edited_shapes())
+        self.assert_matches_full_run(inFile)
+
+        # The state keeps the arcs of a first run on the edited squares, no others
+        freshDir = os.path.join(self.directory, "fresh")
+        SimplifyProcess().process_file(
+            inFile,
+            os.path.join(self.directory, "fresh.shp"),
+            8.0,
+            True,
+            IncrementalDir=freshDir,
+        )
+        arcCache = IncrementalState.load(self.stateDir).arcCache
+        assert_equal(set(arcCache), set(IncrementalState.load(freshDir).arcCache))
+
+    def test_dynamic_thresholds_rejected(self):
+        assert_raises(
+            ValueError,
+            SimplifyProcess().process_file,
+            self.write_input("first", self.shapes),
+            os.path.join(self.directory, "output.shp"),
+            None,
+            True,
+            "iso.csv",
+            IncrementalDir=self.stateDir,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
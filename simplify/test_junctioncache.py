@@ -0,0 +1,96 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from shapely.geometry import mapping
+from geomsimplify import *
+from junctioncache import JunctionCache
+from simplify_topology import SimplifyProcess
+from nose.tools import *
+import unittest
+
+
+class test_JunctionCache(unittest.TestCase):
+    def setUp(self):
+        # Four squares with wavy shared borders, every square has 3 junctions
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inFile = os.path.join(self.directory, "squares.shp")
+        self.csvFile = os.path.join(self.directory, "iso.csv")
+        self.cacheDir = os.path.join(self.directory, "cache")
+        v1 = [(10, 0), (11, 2), (9, 4), (11, 6), (9, 8), (10, 10)]
+        v2 = [(10, 10), (11, 12), (9, 14), (11, 16), (9, 18), (10, 20)]
+        h1 = [(0, 10), (2, 11), (4, 9), (6, 11), (8, 9), (10, 10)]
+        h2 = [(10, 10), (12, 11), (14, 9), (16, 11), (18, 9), (20, 10)]
+        squares = [
+            Polygon([(0, 0)] + v1 + h1[::-1][1:]),
+            Polygon([(20, 0)] + h2[::-1] + v1[::-1][1:]),
+            Polygon(h1 + v2[1:] + [(0, 20)]),
+            Polygon(h2 + [(20, 20)] + v2[::-1]),
+        ]
+        schema = {"geometry": "Polygon", "properties": {"iso3": "str"}}
+        with fiona.open(self.inFile, "w", "ESRI Shapefile", schema) as output:
+            for square, iso3 in zip(squares, ["AAA", "BBB", "AAA", "BBB"]):
+                output.write(
+                    {"geometry": mapping(square), "properties": {"iso3": iso3}}
+                )
+        self.write_thresholds("AAA,3\r\nBBB,5\r\n")
+
+    def write_thresholds(self, text):
+        with open(self.csvFile, "w") as csvFile:
+            csvFile.write(text)
+
+    def read_output(self, outFile):
+        with fiona.open(outFile, "r") as input:
+            return [shape(myGeom["geometry"]) for myGeom in input]
+
+    def test_round_trip(self):
+        g = GeomSimplify()
+        dictJunctions = {(10, 0): 1, (-3, 10): 1}
+        dictArcThresholds = {g.arc_key((10, 0), (-3, 10)): 4.0}
+        JunctionCache.from_dicts(
+            "source", g.quantitizationFactor, dictJunctions, dictArcThresholds
+        ).save(self.cacheDir)
+
+        cache = JunctionCache.load(self.cacheDir)
+        assert_equal(cache.source, "source")
+        assert_equal(cache.junction_dict(g.quantitizationFactor), dictJunctions)
+        assert_equal(cache.arc_threshold_dict(), dictArcThresholds)
+
+    def test_missing_cache(self):
+        assert_equal(JunctionCache.load(self.cacheDir), None)
+
+    def test_source_changes_with_thresholds(self):
+        first = JunctionCache.describe_source(self.inFile, (1, 1), self.csvFile)
+        self.write_thresholds("AAA,3\r\nBBB,6\r\n")
+
+        assert_not_equal(
+            JunctionCache.describe_source(self.inFile, (1, 1), self.csvFile), first
+        )
+        assert_not_equal(JunctionCache.describe_source(self.inFile, (2, 2)), first)
+
+    def test_cached_run_matches(self):
+        outFile = os.path.join(self.directory, "output.shp")
+        cachedFile = os.path.join(self.directory, "cached.shp")
+        SimplifyProcess().process_file(self.inFile, outFile, None, True, self.csvFile)
+        for index in range(2):
+            SimplifyProcess().process_file(
+                self.inFile,
+                cachedFile,
+                None,
+                True,
+                self.csvFile,
+                JunctionCacheDir=self.cacheDir,
+            )
+            for simpleShape, expected in zip(
+                self.read_output(cachedFile), self.read_output(outFile)
+            ):
+                assert simpleShape.equals_exact(expected, 0)
+
+        assert_true(os.path.exists(os.path.join(self.cacheDir, "source.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+__author__ = "asimmons"
+
+from geomsimplify import *
+from junctionfinder import JunctionFinder
+from nose.tools import *
+import unittest
+
+
+class test_JunctionFinder(unittest.TestCase):
+    """
+    'JunctionFinder' must find the same junctions as append_junctions_*:
+
+    1) two squares sharing an edge - junctions at both ends of the shared edge
+    2) two identical lines on top of each other - no junctions
+    3) the first point of a line is not a neighbor of the second point
+    4) two points of the same shape quantized to the same value - error
+    5) a junction on an interior ring - error
+    """
+
+    def append_junctions(self, shapes):
+        g = GeomSimplify()
+        dictJunctions = {}
+        dictNeighbors = {}
+        for myShape in shapes:
+            if isinstance(myShape, LineString):
+                g.append_junctions_line(myShape, dictJunctions, dictNeighbors)
+            else:
+                g.append_junctions_polygon(myShape, dictJunctions, dictNeighbors)
+        return dictJunctions
+
+    def test_shared_edge(self):
+        shapes = [
+            Polygon([(0, 0), (0, 2), (2, 2), (2, 0)]),
+            Polygon([(2, 0), (2, 2), (4, 2), (4, 0)]),
+            Polygon([(0, 2), (0, 4), (4, 4), (4, 2), (2, 2)]),
+        ]
+        dictJunctions = JunctionFinder().find_dict(shapes, {})
+
+        assert_equal(dictJunctions, self.append_junctions(shapes))
+        assert_true((2, 2) in dictJunctions)
+
+    def test_identical_lines(self):
+        line = LineString([(0, 0), (1, 1), (2, 0)])
+
+        assert_equal(len(JunctionFinder().find([line, line])), 0)
+
+    def test_second_point_quirk(self):
+        # (1, 1) has neighbors {(2, 0)} on both lines since the first point is skipped
+        shapes = [
+            LineString([(0, 0), (1, 1), (2, 0)]),
+            LineString([(5, 5), (1, 1), (2, 0)]),
+        ]
+
+        assert_equal(
+            JunctionFinder().find_dict(shapes, {}), self.append_junctions(shapes)
+        )
+
+    def test_quantitization(self):
+        shapes = [
+            LineString([(0, 0), (10, 10), (20, 0)]),
+            LineString([(0, 20), (10.2, 10.3), (20, 20)]),
+            LineString([(30, 30), (12, 9.6), (20, 20)]),
+        ]
+        finder = JunctionFinder((5, 5))
+
+        assert_equal(finder.find_dict(shapes, {}), {(10, 10): 1})
+
+    def test_duplicate_points(self):
+        line = LineString([(0, 0), (1, 1), (0.2, 0.1)])
+
+        assert_raises(ValueError, JunctionFinder().find, [line])
+
+    def test_junction_on_interior_ring(self):
+        shapes = [
+            Polygon(
+                [(0, 0), (0, 10), (10, 10), (10, 0)],
+                [[(2, 2), (2, 4), (4, 4), (4, 2)]],
+            ),
+            Polygon([(2, 2), (2, 4), (3, 3)]),
+        ]
+
+        assert_raises(ValueError, JunctionFinder().find, shapes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import time
+import fiona
+from shapely.geometry import mapping
+from geomsimplify import *
+from metrics import Metrics
+from simplify_topology import SimplifyProcess
+from nose.tools import *
+import unittest
+
+
+class test_Metrics(unittest.TestCase):
+    def test_nested_phases_are_exclusive(self):
+        metrics = Metrics()
+        with metrics.phase("outer"):
+            time.sleep(0.01)
+            with metrics.phase("inner"):
+                time.sleep(0.05)
+
+        assert_true(metrics.phases["inner"] >= 0.05)
+        assert_true(metrics.phases["outer"] < 0.05)
+
+    def test_timed(self):
+        metrics = Metrics()
+
+        def slow():
+            for item in range(3):
+                time.sleep(0.01)
+                yield item
+
+        with metrics.phase("outer"):
+            assert_equal(list(metrics.timed(slow(), "slow")), [0, 1, 2])
+
+        assert_true(metrics.phases["slow"] >= 0.03)
+        assert_true(metrics.phases["outer"] < 0.03)
+
+    def test_report(self):
+        metrics = Metrics()
+        metrics.count("vertices_in", 10)
+        metrics.count("vertices_in", np.int64(5))
+        metrics.finish()
+        report = metrics.report()
+
+        assert_equal(report["counts"], {"vertices_in": 15})
+        assert_true(report["vertices_per_second"] > 0)
+
+
+class test_ProcessMetrics(unittest.TestCase):
+    def setUp(self):
+        # Two squares sharing a wavy border
+        border = [(10, 0), (11, 2), (9, 4), (11, 6), (9, 8), (10, 10)]
+        squares = [
+            Polygon([(0, 0)] + border + [(0, 10)]),
+            Polygon([(20, 0), (20, 10)] + border[::-1]),
+        ]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inFile = os.path.join(self.directory, "squares.shp")
+        schema = {"geometry": "Polygon", "properties": {"name": "str"}}
+        with fiona.open(self.inFile, "w", "ESRI Shapefile", schema) as output:
+            for index, square in enumerate(squares):
+                output.write(
+                    {"geometry": mapping(square), "properties": {"name": str(index)}}
+                )
+
+    def test_topology_counts(self):
+        process = SimplifyProcess()
+        process.process_file(
+            self.inFile, os.path.join(self.directory, "output.shp"), 100, True
+        )
+        report = process.metrics.report()
+
+        for phase in ("read", "junctions", "arcs", "elimination", "repair", "write"):
+            assert_true(phase in report["phases"])
+        counts = report["counts"]
+        assert_equal(counts["features_in"], 2)
+        assert_equal(counts["vertices_in"], 18)
+        assert_true(counts["junctions"] > 0)
+        assert_true(counts["vertices_out"] < counts["vertices_in"])
+        assert_true(counts["heap_operations"] > 0)
+        assert_equal(counts["repaired"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import shapely
+from geomsimplify import *
+from rankstore import RankStore
+from benchmark import write_input
+from testshapes import write_polygons
+from simplify_topology import SimplifyProcess
+from featureio import read_batches
+from nose.tools import *
+import unittest
+
+
+class test_RankStore(unittest.TestCase):
+    """
+    'RankStore' keeps the effective area of every vertex so that any threshold can be
+    extracted without running the elimination again. Extracting a threshold must give
+    the same shapes as the simplify_* methods.
+    """
+
+    def setUp(self):
+        self.g = GeomSimplify()
+        self.shapes = [
+            LineString([(-1000, 0), (0, 2), (0, 0), (1, 0), (2, 0), (2, 1), (1000, 0)]),
+            MultiLineString([[(0, 0), (0, 1), (4, 3)], [(0, 1), (1, 1), (2, 4)]]),
+            Polygon(
+                [(0, 0), (0, 20), (20, 20), (20, 0)],
+                [[(5, 5), (5, 6), (6, 6), (6, 5)]],
+            ),
+            MultiPolygon(
+                [
+                    Polygon([(0, 0), (1, 1), (1, 0)]),
+                    Polygon([(10, 0), (15, 4), (18, 2), (6, 2)]),
+                ]
+            ),
+        ]
+        self.store = RankStore()
+        for myShape in self.shapes:
+            self.store.append(self.g.rank_shape(myShape))
+        self.store.finish()
+
+    def test_rank_line_areas(self):
+        points, areas, isRing = self.g.rank_line(
+            LineString([(0, 0), (1, 2), (2, 0), (10, 0)])
+        )
+
+        assert_equal(areas, [float("inf"), 2.0, 2.0, float("inf")])
+        assert_false(isRing)
+
+    def test_extract_matches_simplify(self):
+        methods = [
+            self.g.simplify_line,
+            self.g.simplify_multiline,
+            self.g.simplify_polygon,
+            self.g.simplify_multipolygon,
+        ]
+        for threshold in (0, 0.7, 1.7, 11.5, 500):
+            result = self.store.extract(threshold)
+            for myShape, method, simpleShape in zip(self.shapes, methods, result):
+                expected = method(myShape, threshold)
+                if expected is None:
+                    assert_equal(simpleShape, None)
+                else:
+                    assert_equal(simpleShape.geom_type, expected.geom_type)
+                    assert simpleShape.equals_exact(expected, 0)
+
+    def test_polygon_removed_below_three_points(self):
+        result = self.store.extract(1000)
+
+        assert_equal(result[2], None)
+        assert_equal(result[3], None)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "ranks.npz")
+        self.store.source = "test"
+        self.store.save(path)
+        loaded = RankStore.load(path)
+
+        assert_equal(loaded.source, "test")
+        assert_equal(len(loaded), 4)
+        assert_equal(loaded.vertex_count(11.5), self.store.vertex_count(11.5))
+
+    def test_budget_threshold_ties(self):
+        areas = np.array([float("inf"), 5.0, 3.0, 3.0, 1.0, float("inf")])
+
+        assert_equal(RankStore.budget_threshold(areas, 3), 5.0)
+        # keeping 4 points would split the tie at 3.0, so only 3 are kept
+        assert_true(RankStore.budget_threshold(areas, 4) > 3.0)
+        assert_equal(RankStore.budget_threshold(areas, 5), 3.0)
+        assert_equal(RankStore.budget_threshold(areas, 6), 0.0)
+
+    def test_layer_budget(self):
+        for budget in (16, 20, 0.6):
+            threshold = self.store.threshold_for_budget(budget)
+            limit = budget if budget >= 1 else budget * len(self.store.areas)
+
+            assert_true(self.store.vertex_count(threshold) <= limit)
+
+        # end points and the last points of each ring are always kept
+        fixed = int(np.isinf(self.store.areas).sum())
+        threshold = self.store.threshold_for_budget(1)
+        assert_equal(self.store.vertex_count(threshold), fixed)
+
+    def test_budget_per_feature(self):
+        thresholds = self.store.threshold_for_budget(4, perFeature=True)
+        featureOfPoint = self.store.feature_of_point()
+        keep = self.store.areas >= self.store.vertex_thresholds(thresholds)
+
+        assert_equal(len(thresholds), 4)
+        assert_true((np.bincount(featureOfPoint[keep[self.store.points]]) <= 4).all())
+
+    def test_simplify_to_budget(self):
+        result = self.g.simplify_to_budget(self.shapes, 12)
+
+        assert_true(sum(len(shapely.get_coordinates(s)) for s in result if s) > 0)
+        assert_equal(len(result), 4)
+
+
+class test_RankedProcess(unittest.TestCase):
+    """
+    Every output of a run with several thresholds (or a rank file) must be the output
+    of a run with that threshold alone.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # A mosaic of 50 Voronoi cells with long shared borders
+        self.inFile, _ = write_input(self.directory, "voronoi", 50)
+
+    def read_shapes(self, path):
+        return [myShape for shapes, _ in read_batches(path, 100) for myShape in shapes]
+
+    def assert_same_shapes(self, shapes, expected):
+        assert_equal(len(shapes), len(expected))
+        for simpleShape, expectedShape in zip(shapes, expected):
+            if expectedShape is None:
+                assert_equal(simpleShape, None)
+            else:
+                assert simpleShape.equals_exact(expectedShape, 0)
+
+    def test_thresholds_match_single_runs(self):
+        thresholds = [300.0, 3000.0, 30000.0]
+        outFiles = [
+            os.path.join(self.directory, "ranked_%d.shp" % index)
+            for index in range(len(thresholds))
+        ]
+        SimplifyProcess().process_file(self.inFile, outFiles, thresholds, True)
+
+        for threshold, outFile in zip(thresholds, outFiles):
+            singleFile = os.path.join(self.directory, "single.shp")
+            SimplifyProcess().process_file(self.inFile, singleFile, threshold, True)
+            self.assert_same_shapes(
+                self.read_shapes(outFile), self.read_shapes(singleFile)
+            )
+
+    def test_rank_file_matches_single_run(self):
+        rankFile = os.path.join(self.directory, "ranks.npz")
+        outFile = os.path.join(self.directory, "ranked.shp")
+        singleFile = os.path.join(self.directory, "single.shp")
+        SimplifyProcess().process_file(
+            self.inFile, outFile, 3000, True, RankFile=rankFile
+        )
+        # The second run extracts from the saved ranks
+        SimplifyProcess().process_file(
+            self.inFile, outFile, 300, True, RankFile=rankFile
+        )
+        SimplifyProcess().process_file(self.inFile, singleFile, 300, True)
+
+        self.assert_same_shapes(self.read_shapes(outFile), self.read_shapes(singleFile))
+
+    def test_invalid_input_matches_single_runs(self):
+        # A bowtie no threshold simplifies is written as read, not repaired
+        bowtie = Polygon([(0, 0), (10, 10), (10, 0), (0, 10)])
+        square = Polygon([(20, 0), (20, 10), (30, 10), (30, 0)])
+        inFile = write_polygons(
+            os.path.join(self.directory, "bowtie.shp"), [bowtie, square]
+        )
+        thresholds = [1.0, 2.0]
+        outFiles = [
+            os.path.join(self.directory, "bowtie_%d.shp" % index)
+            for index in range(len(thresholds))
+        ]
+        singleFile = os.path.join(self.directory, "single.shp")
+
+        for Topology in (False, True):
+            SimplifyProcess().process_file(inFile, outFiles, thresholds, Topology)
+            for threshold, outFile in zip(thresholds, outFiles):
+                SimplifyProcess().process_file(inFile, singleFile, threshold, Topology)
+                shapes = self.read_shapes(outFile)
+                self.assert_same_shapes(shapes, self.read_shapes(singleFile))
+                assert_equal(shapes[0].geom_type, "Polygon")
+
+    def test_budget_keeps_borders(self):
+        outFile = os.path.join(self.directory, "budget.shp")
+        for budget in (0.4, 0.6):
+            SimplifyProcess().process_file(
+                self.inFile, outFile, None, True, VertexBudget=budget
+            )
+            shapes = np.array(self.read_shapes(outFile), dtype=object)
+
+            # Both sides of every border keep the same points: no gaps, no overlaps
+            union = shapely.union_all(shapes)
+            assert_equal(shapely.get_num_interior_rings(union), 0)
+            assert_almost_equal(shapely.area(shapes).sum(), union.area, 3)
+
+    def test_budget_per_feature_kept(self):
+        outFile = os.path.join(self.directory, "budget.shp")
+        # Points as stored: the closing point of each (single ring) cell is not counted
+        inShapes = np.array(self.read_shapes(self.inFile), dtype=object)
+        inCounts = shapely.get_num_coordinates(inShapes) - 1
+        for budget in (20, 0.5):
+            SimplifyProcess().process_file(
+                self.inFile,
+                outFile,
+                None,
+                True,
+                VertexBudget=budget,
+                BudgetPerFeature=True,
+            )
+            shapes = np.array(self.read_shapes(outFile), dtype=object)
+
+            # A border takes the larger threshold of its two cells
+            counts = shapely.get_num_coordinates(shapes) - 1
+            budgets = np.ceil(budget * inCounts) if budget < 1 else budget
+            assert_true(np.all(counts <= budgets))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from shapely.geometry import mapping
+from geomsimplify import *
+from shapestore import ShapeStore
+from simplify_topology import read_iso_thresholds
+from nose.tools import *
+import unittest
+
+
+class test_ShapeStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inFile = os.path.join(self.directory, "squares.shp")
+        schema = {"geometry": "Polygon", "properties": {"iso3": "str", "name": "str"}}
+        with fiona.open(self.inFile, "w", "ESRI Shapefile", schema) as output:
+            for index, iso3 in enumerate(["AAA", "BBB"]):
+                square = Polygon(
+                    [(index, 0), (index, 1), (index + 1, 1), (index + 1, 0)]
+                )
+                output.write(
+                    {
+                        "geometry": mapping(square),
+                        "properties": {"iso3": iso3, "name": "square" + str(index)},
+                    }
+                )
+
+    def test_read_fields(self):
+        store = ShapeStore.read(self.inFile, ["iso3"])
+
+        assert_equal(len(store), 2)
+        assert_equal(store.fields, {"iso3": ["AAA", "BBB"]})
+        assert_equal(store.shapes[1].bounds, (1.0, 0.0, 2.0, 1.0))
+
+    def test_records(self):
+        store = ShapeStore.read(self.inFile)
+        records = [dict(properties) for properties in store.records()]
+
+        assert_equal(records[1], {"iso3": "BBB", "name": "square1"})
+
+    def test_missing_field(self):
+        assert_raises(ValueError, ShapeStore.read, self.inFile, ["iso2"])
+
+    def test_read_iso_thresholds(self):
+        path = os.path.join(self.directory, "iso.csv")
+        with open(path, "w") as csvFile:
+            csvFile.write("AAA,0.5\r\nBBB,3\r\n")
+
+        assert_equal(read_iso_thresholds(path), {"AAA": 0.5, "BBB": 3.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -170,6 +170,219 @@ class test_GeomSimplify(unittest.TestCase):
 
         assert_equal(result, [(0.0, 0.0), (8.0, 2.0), (-4.0, 2.0), (0.0, 0.0)])
 
+    def test_simplify_batch_rings(self):
+        # same ring as test_simplify_ring_eliminate_one_pt, followed by a ring that
+        # goes down to 2 points (and would be deleted when rebuilt). The closing
+        # point of a ring is never part of the mask
+        g = GeomSimplify()
+        coords = np.array(
+            [(0, 0), (5, 4), (8, 2), (-4, 2), (0, 0), (0, 0), (1, 1), (1, 0), (0, 0)]
+        )
+        mask = g.simplify_batch(coords, [0, 5, 9], 11.5, closed=True)
+
+        assert_equal(
+            mask.tolist(), [True, False, True, True, False, False, True, True, False]
+        )
+
+    def test_simplify_geometries_matches_single_shapes(self):
+        g = GeomSimplify()
+        shapes = [
+            LineString([(-1000, 0), (0, 2), (0, 0), (1, 0), (2, 0), (2, 1), (1000, 0)]),
+            Polygon([(0, 0), (5, 4), (8, 2), (-4, 2)]),
+            Polygon([(0, 0), (1, 1), (1, 0)]),
+            MultiPolygon(
+                [
+                    Polygon([(0, 0), (1, 1), (1, 0)]),
+                    Polygon([(10, 0), (15, 4), (18, 2), (6, 2)]),
+                ]
+            ),
+        ]
+        result = g.simplify_geometries(shapes, 11.5)
+
+        assert_equal(
+            list(result[0].coords), list(g.simplify_line(shapes[0], 11.5).coords)
+        )
+        assert result[1].equals_exact(g.simplify_polygon(shapes[1], 11.5), 0)
+        assert_equal(result[2], None)
+        assert_equal(result[3].geom_type, "MultiPolygon")
+        assert result[3].equals_exact(g.simplify_multipolygon(shapes[3], 11.5), 0)
+
+    def test_simplify_geometries_empty(self):
+        g = GeomSimplify()
+
+        assert_equal(g.simplify_geometries([Polygon()], 1).tolist(), [None])
+        assert_equal(g.simplify_geometries([MultiPolygon()], 1).tolist(), [None])
+        assert_equal(g.simplify_geometries([MultiLineString()], 1).tolist(), [None])
+        result = g.simplify_geometries([LineString(), Polygon()], 1)
+        assert_true(result[0].is_empty)
+        assert_equal(result[1], None)
+
+    def test_simplify_ring_prevent_intersections(self):
+        # removing (-5.1, 5.2) with a threshold of 2 makes the ring cross itself
+        ring = LinearRing(
+            [
+                (-0.4, 3.1),
+                (-1.1, 1.5),
+                (-5.1, 5.2),
+                (-1.1, 0.3),
+                (-7.6, -0.2),
+                (-6.9, -3.7),
+                (-6.0, -5.7),
+                (-2.3, -6.4),
+            ]
+        )
+        result = GeomSimplify().simplify_ring(ring, 2)
+        assert_false(Polygon(result).is_valid)
+
+        result = GeomSimplify(preventIntersections=True).simplify_ring(ring, 2)
+        assert_true(Polygon(result).is_valid)
+
+    def test_prefilter_collinear(self):
+        g = GeomSimplify(prefilter=0)
+        coords = np.array(
+            [(0, 0), (1, 0), (2, 0), (2, 2), (0, 0), (1, 0), (2, 0), (2, 1), (2, 2)],
+            dtype=np.float64,
+        )
+        keep = g.prefilter_chains(coords, [0, 4, 9], closed=False)
+
+        # The end points of lines stay, even when collinear
+        assert_equal(
+            keep.tolist(), [True, False, True, True, True, False, True, False, True]
+        )
+
+    def test_prefilter_staircase(self):
+        # A diagonal staircase of 1 x 1 steps closed by two long edges
+        points = [(0, 0)]
+        for step in range(5):
+            points += [(step + 1, step), (step + 1, step + 1)]
+        points.append((0, 5))
+
+        assert_equal(len(GeomSimplify(prefilter=0).prefilter_points(points, True)), 12)
+        result = GeomSimplify(prefilter=1).prefilter_points(points, True)
+        assert_equal(result, [(0, 0), (5, 5), (0, 5)])
+        # A single pixel is left whole
+        square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        assert_equal(GeomSimplify(prefilter=1).prefilter_points(square, True), square)
+
+    def test_prefilter_batch_matches_rings(self):
+        g = GeomSimplify(prefilter=1)
+        rings = [
+            LinearRing(
+                [(0, 0), (4, 0), (4, 1), (5, 1), (5, 2), (6, 2), (6, 6), (0, 6)]
+            ),
+            LinearRing([(10, 0), (12, 0), (14, 0), (14, 3), (10, 3)]),
+        ]
+        coords, ringOfCoord = shapely.get_coordinates(rings, return_index=True)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(ringOfCoord))))
+        mask = g.simplify_batch(coords, offsets, 0.5, closed=True)
+
+        for index, ring in enumerate(rings):
+            ringSlice = slice(offsets[index], offsets[index + 1])
+            result = [tuple(point) for point in coords[ringSlice][mask[ringSlice]]]
+            assert_equal(result, list(g.simplify_ring(ring, 0.5).coords)[:-1])
+
+
+class test_EliminationEngine(unittest.TestCase):
+    """
+    'EliminationEngine' removes the vertex with the smallest triangle first and
+    only recomputes the two neighbours of a removed vertex.
+    """
+
+    def test_line_keeps_end_points(self):
+        engine = EliminationEngine()
+        chain = engine.add_line([(0, 0), (1, 1), (2, 0), (3, 1), (4, 0)], 100)
+        engine.eliminate()
+
+        assert_equal(engine.kept_indices(chain), [0, 4])
+
+    def test_ring_neighbours_are_updated(self):
+        # removing (1,0) makes the triangle at (2,0) grow from 0 to 1, so with a
+        # threshold of 0.9 the square corner at (2,0) must survive
+        engine = EliminationEngine()
+        chain = engine.add_ring([(0, 0), (1, 0), (2, 0), (2, 1), (0, 1)], 0.9)
+        engine.eliminate()
+
+        assert_equal(engine.kept_indices(chain), [0, 2, 3, 4])
+
+    def test_ring_minimum_points(self):
+        engine = EliminationEngine()
+        chain = engine.add_ring([(0, 0), (5, 4), (8, 2), (-4, 2)], 1000, 3)
+        engine.eliminate()
+
+        assert_equal(engine.chain_count(chain), 3)
+
+    def test_effective_areas_are_monotonic(self):
+        # (1,2) is removed first with area 2, after which (2,0) is collinear with
+        # its new neighbours, so its area of 0 is clamped to 2
+        engine = EliminationEngine()
+        chain = engine.add_line([(0, 0), (1, 2), (2, 0), (10, 0)])
+        engine.eliminate()
+
+        assert_equal(
+            engine.effective_areas(chain), [float("inf"), 2.0, 2.0, float("inf")]
+        )
+
+    def test_chains_keep_their_own_threshold(self):
+        engine = EliminationEngine()
+        first = engine.add_line([(0, 0), (1, 1), (2, 0)], 0.5)
+        second = engine.add_line([(0, 0), (1, 1), (2, 0)], 2)
+        engine.eliminate()
+
+        assert_equal(engine.kept_indices(first), [0, 1, 2])
+        assert_equal(engine.kept_indices(second), [0, 2])
+
+    def test_prevent_intersections_blocks_vertex(self):
+        # (5,1) of the second line lies inside the triangle of (5,5), removing (5,5)
+        # would make the first line cross the second one
+        engine = EliminationEngine(preventIntersections=True)
+        first = engine.add_line([(0, 0), (5, 5), (10, 0)], 100, group=0)
+        second = engine.add_line([(4, 1), (5, 1), (6, 1)], 0, group=0)
+        engine.eliminate()
+
+        assert_equal(engine.kept_indices(first), [0, 1, 2])
+        assert_equal(engine.kept_indices(second), [0, 1, 2])
+
+    def test_prevent_intersections_only_within_group(self):
+        engine = EliminationEngine(preventIntersections=True)
+        first = engine.add_line([(0, 0), (5, 5), (10, 0)], 100)
+        engine.add_line([(4, 1), (5, 1), (6, 1)], 0)
+        engine.eliminate()
+
+        assert_equal(engine.kept_indices(first), [0, 2])
+
+
+class test_ArcThreshold(unittest.TestCase):
+    def test_get_key_is_order_independent(self):
+        assert_equal(
+            ArcThreshold.get_key((1, -2), (-3, 4)),
+            ArcThreshold.get_key((-3, 4), (1, -2)),
+        )
+
+    def test_get_key_is_unique(self):
+        points = [(x, y) for x in range(-2, 3) for y in range(-2, 3)]
+        keys = set()
+        for start in points:
+            for end in points:
+                keys.add(ArcThreshold.get_key(start, end))
+
+        assert_equal(len(keys), len(points) * (len(points) + 1) // 2)
+
+    def test_split_key(self):
+        key = ArcThreshold.get_key((1, -2), (-(2**31), 2**31 - 1))
+
+        assert_true(0 <= key < 1 << 128)
+        assert_equal(ArcThreshold.split_key(key), ((1, -2), (-(2**31), 2**31 - 1)))
+
+    def test_get_key_range(self):
+        assert_raises(ValueError, ArcThreshold.get_key, (0, 0), (2**31, 0))
+
+    def test_arc_key_uses_quantitized_points(self):
+        g = GeomSimplify()
+
+        assert_equal(
+            g.arc_key((0.9, 2.1), (5.2, 3.8)), ArcThreshold.get_key((1, 2), (5, 4))
+        )
+
 
 ## TO DO tests for simplify_polygon and simplify_multipolygon ##
 
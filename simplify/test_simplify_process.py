@@ -0,0 +1,146 @@
+__author__ = "asimmons"
+
+from geomsimplify import *
+from simplify_topology import *
+from nose.tools import *
+import unittest
+
+
+class test_SimplifyPool(unittest.TestCase):
+    def setUp(self):
+        self.shapes = np.empty(25, dtype=object)
+        self.shapes[:] = [
+            LineString([(i, 0), (i + 0.5, 0.01), (i + 1, 0), (i + 1.5, 1), (i + 2, 0)])
+            for i in range(25)
+        ]
+        self.records = [{"id": i} for i in range(25)]
+        # Batches of 4 features, like read_batches
+        self.batches = [
+            (self.shapes[start : start + 4], self.records[start : start + 4])
+            for start in range(0, 25, 4)
+        ]
+
+    def test_pool_keeps_input_order(self):
+        results = list(simplify_in_pool(iter(self.batches), 0.1, 2))
+
+        assert_equal(
+            [properties["id"] for _, records in results for properties in records],
+            list(range(25)),
+        )
+
+    def test_pool_matches_single_process(self):
+        simplify = GeomSimplify()
+        results = list(simplify_in_pool(iter(self.batches), 0.1, 2))
+        simplifiedShapes = np.concatenate([shapes for shapes, _ in results])
+
+        for myShape, simpleShape in zip(self.shapes, simplifiedShapes):
+            expected = simplify_shape(simplify, myShape, 0.1)
+            assert_true(simpleShape.equals(expected))
+
+
+class test_SimplifyGeometries(unittest.TestCase):
+    def setUp(self):
+        # Two squares sharing a wavy border, and a square with no neighbor
+        border = [(10, 0), (12, 2), (8, 4), (12, 6), (8, 8), (10, 10)]
+        self.shapes = [
+            Polygon([(0, 0)] + border + [(0, 10)]),
+            Polygon([(20, 0), (20, 10)] + border[::-1]),
+            None,
+            Polygon([(40, 0), (42, 5), (40, 10), (30, 10), (30, 0)]),
+        ]
+
+    def test_topology_keeps_shared_border(self):
+        simplifiedShapes = SimplifyProcess().simplify_geometries(
+            self.shapes, 10, Topology=True
+        )
+
+        assert_equal(len(simplifiedShapes), 4)
+        assert_equal(simplifiedShapes[2], None)
+        # Both squares keep the same simplified border: no gap and no overlap
+        first, second = simplifiedShapes[0], simplifiedShapes[1]
+        assert_true(
+            shapely.get_num_coordinates(first)
+            < shapely.get_num_coordinates(self.shapes[0])
+        )
+        assert_almost_equal(first.intersection(second).area, 0)
+        assert_almost_equal(first.union(second).area, first.area + second.area)
+        assert_almost_equal(first.area + second.area, 200)
+
+    def test_per_feature_thresholds(self):
+        simplifiedShapes = SimplifyProcess().simplify_geometries(
+            self.shapes, [1, 1, 0, 100], Topology=True
+        )
+
+        # The shared border gets the threshold of both squares, the lone square its own
+        assert_true(simplifiedShapes[0].equals(self.shapes[0]))
+        assert_true(simplifiedShapes[1].equals(self.shapes[1]))
+        assert_equal(simplifiedShapes[3], None)
+
+    def test_series_keeps_index(self):
+        import pandas
+
+        series = pandas.Series(self.shapes, index=["a", "b", "c", "d"])
+        process = SimplifyProcess()
+        simplifiedShapes = process.simplify_geometries(series, 20)
+
+        assert_true(isinstance(simplifiedShapes, pandas.Series))
+        assert_equal(list(simplifiedShapes.index), ["a", "b", "c", "d"])
+        assert_equal(process.metrics.counts["features_in"], 3)
+        assert_true(
+            simplifiedShapes["d"].equals(
+                simplify_shape(GeomSimplify(), self.shapes[3], 20)
+            )
+        )
+
+    def test_prefilter(self):
+        # Two regions of a raster split by a staircase of 2 x 2 pixels
+        stairs = [(0, 0)]
+        for step in range(10):
+            stairs += [(2 * step + 2, 2 * step), (2 * step + 2, 2 * step + 2)]
+        shapes = [Polygon(stairs[1:-1] + [(20, 0)]), Polygon(stairs + [(0, 20)])]
+        process = SimplifyProcess()
+        # Each step is a triangle of 2, above the threshold
+        process.simplify_geometries(shapes, 1, Topology=True)
+        assert_equal(process.metrics.counts["vertices_out"], 44)
+        heapOperations = process.metrics.counts["heap_operations"]
+        simplifiedShapes = process.simplify_geometries(
+            shapes, 1, Topology=True, Prefilter=2
+        )
+
+        assert_true(process.metrics.counts["heap_operations"] < heapOperations / 2)
+        assert_true(process.metrics.counts["vertices_out"] < 20)
+        first, second = simplifiedShapes
+        assert_almost_equal(first.intersection(second).area, 0)
+        assert_almost_equal(first.area + second.area, 400)
+
+    def test_threshold_count_mismatch(self):
+        assert_raises(
+            ValueError, SimplifyProcess().simplify_geometries, self.shapes, [1, 2]
+        )
+
+
+class test_RepairGeometries(unittest.TestCase):
+    def setUp(self):
+        self.bowtie = Polygon([(0, 0), (0, 2), (2, 0), (2, 2)])
+        self.square = Polygon([(0, 0), (0, 2), (2, 2), (2, 0)])
+
+    def test_repairs_invalid(self):
+        shapes, repaired = repair_geometries([self.bowtie, self.square, None])
+
+        assert_equal(repaired, 1)
+        assert_true(shapes[0].is_valid)
+        assert_equal(shapes[0].geom_type, "MultiPolygon")
+        assert_almost_equal(shapes[0].area, 2.0)
+        assert_true(shapes[1] is self.square)
+        assert_equal(shapes[2], None)
+
+    def test_unchanged_not_checked(self):
+        shapes, repaired = repair_geometries([self.bowtie], [self.bowtie])
+
+        assert_equal(repaired, 0)
+        assert_true(shapes[0] is self.bowtie)
+
+    def test_collapsed_polygon_removed(self):
+        flat = Polygon([(0, 0), (1, 0), (2, 0), (1, 0)])
+
+        assert_equal(polygonal_parts(shapely.make_valid(flat), "Polygon"), None)
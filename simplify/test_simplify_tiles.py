@@ -0,0 +1,112 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import fiona
+from fiona.crs import CRS
+from shapely.geometry import mapping
+from geomsimplify import *
+from simplify_tiles import *
+from simplify_topology import SimplifyProcess
+from benchmark import write_input
+from featureio import read_batches
+from vectortile import *
+from nose.tools import *
+import unittest
+
+
+class test_VectorTile(unittest.TestCase):
+    def test_line_commands(self):
+        tile = VectorTile()
+        geomType, commands = tile.encode_geometry(
+            LineString([(2, 2), (2, 10), (10, 10)])
+        )
+
+        assert_equal(geomType, GEOM_LINESTRING)
+        # MoveTo(2, 2), LineTo(+0, +8), LineTo(+8, +0) - zigzag encoded
+        assert_equal(commands, [9, 4, 4, 18, 0, 16, 16, 0])
+
+    def test_polygon_winding(self):
+        tile = VectorTile()
+        # counter-clockwise with y pointing down, so it has to be reversed
+        polygon = Polygon(
+            [(0, 0), (0, 10), (10, 10), (10, 0)], [[(2, 2), (4, 2), (4, 4), (2, 4)]]
+        )
+        geomType, commands = tile.encode_geometry(polygon)
+
+        assert_equal(geomType, GEOM_POLYGON)
+        assert_equal(commands.count(command(CMD_CLOSE_PATH, 1)), 2)
+        assert_true(VectorTile.ring_area([[0, 0], [10, 0], [10, 10], [0, 10]]) > 0)
+        # reversed ring starts with MoveTo(10, 0), LineTo(+0, +10)...
+        assert_equal(commands[:6], [9, 20, 0, 26, 0, 20])
+
+    def test_collapsed_ring_dropped(self):
+        tile = VectorTile()
+        polygon = Polygon([(0, 0), (0.2, 0.1), (0.1, 0.3)])
+
+        assert_false(tile.add_layer("test", [polygon], [{}]))
+
+
+class test_TileProcess(unittest.TestCase):
+    def test_zoom_threshold(self):
+        assert_almost_equal(zoom_threshold(1) / zoom_threshold(2), 4.0)
+        assert_almost_equal(zoom_threshold(3, 2.0) / zoom_threshold(3), 2.0)
+
+    def test_process_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        inFile = os.path.join(directory, "squares.shp")
+        outFile = os.path.join(directory, "squares.mbtiles")
+        schema = {"geometry": "Polygon", "properties": {"name": "str"}}
+        with fiona.open(
+            inFile, "w", "ESRI Shapefile", schema, crs=CRS.from_epsg(3857)
+        ) as output:
+            for index in range(3):
+                square = Polygon(
+                    [
+                        (index * 1000.0, 0),
+                        (index * 1000.0, 1000.0),
+                        ((index + 1) * 1000.0, 1000.0),
+                        ((index + 1) * 1000.0, 0),
+                    ]
+                )
+                output.write(
+                    {"geometry": mapping(square), "properties": {"name": str(index)}}
+                )
+
+        TileProcess().process_file(inFile, outFile, 12, minZoom=10)
+
+        connection = sqlite3.connect(outFile)
+        zooms = connection.execute(
+            "SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level"
+        ).fetchall()
+        metadata = dict(connection.execute("SELECT * FROM metadata").fetchall())
+        connection.close()
+
+        assert_equal(zooms, [(10,), (11,), (12,)])
+        assert_equal(metadata["format"], "pbf")
+        assert_equal(metadata["name"], "squares")
+
+    def test_zoom_matches_single_run(self):
+        # Every zoom level is the output of simplify_topology.py with its threshold
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        inFile, _ = write_input(directory, "voronoi", 50)
+        outFile = os.path.join(directory, "single.shp")
+        rankStore = SimplifyProcess().build_rank_store(inFile, True)
+
+        for zoom in (12, 13):
+            threshold = zoom_threshold(zoom)
+            shapes, repaired = TileProcess().zoom_shapes(rankStore, threshold)
+            SimplifyProcess().process_file(inFile, outFile, threshold, True)
+            expected = [s for batch, _ in read_batches(outFile, 100) for s in batch]
+
+            assert_equal(len(shapes), len(expected))
+            for simpleShape, expectedShape in zip(shapes, expected):
+                assert simpleShape.equals_exact(expectedShape, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+__author__ = "asimmons"
+
+import os
+import shutil
+import tempfile
+import fiona
+from shapely.geometry import mapping
+from geomsimplify import *
+from simplify_topology import SimplifyProcess
+from tilegrid import TileGrid
+from nose.tools import *
+import unittest
+
+
+def wavy_border(x):
+    return [(x, 0), (x + 1, 2), (x - 1, 4), (x + 1, 6), (x - 1, 8), (x, 10)]
+
+
+class test_TileGrid(unittest.TestCase):
+    """
+    Tiled runs must give every tile the neighbors its junctions need, and cut shared
+    borders the same way in both tiles.
+    """
+
+    def setUp(self):
+        # A row of 6 squares with wavy shared borders
+        self.squares = [
+            Polygon(wavy_border(10 * i) + wavy_border(10 * (i + 1))[::-1])
+            for i in range(6)
+        ]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.inFile = self.write_squares("squares.shp", "ESRI Shapefile")
+
+    def write_squares(self, name, driver):
+        path = os.path.join(self.directory, name)
+        schema = {"geometry": "Polygon", "properties": {"name": "str"}}
+        with fiona.open(path, "w", driver, schema) as output:
+            for index, square in enumerate(self.squares):
+                output.write(
+                    {"geometry": mapping(square), "properties": {"name": str(index)}}
+                )
+        return path
+
+    def read_output(self, outFile):
+        with fiona.open(outFile, "r") as input:
+            return {
+                myGeom["properties"]["name"]: shape(myGeom["geometry"])
+                for myGeom in input
+            }
+
+    def test_tiles_by_center(self):
+        bounds = np.array(
+            [[0, 0, 10, 10], [10, 0, 20, 10], [25, 0, 35, 10]], dtype=float
+        )
+        tileGrid = TileGrid(bounds, 20)
+
+        assert_equal(len(tileGrid), 2)
+        assert_equal(list(tileGrid.tiles), [0, 0, 1])
+
+    def test_context_bands(self):
+        tileGrid = TileGrid(np.array([square.bounds for square in self.squares]), 10)
+        featureIds, ringIds, contextIds = tileGrid.context(2)
+
+        assert_equal(list(featureIds), [2])
+        assert_equal(list(ringIds), [1, 2, 3])
+        assert_equal(list(contextIds), [0, 1, 2, 3, 4])
+
+    def test_tiled_matches_whole_layer(self):
+        outFile = os.path.join(self.directory, "whole.shp")
+        tiledFile = os.path.join(self.directory, "tiled.shp")
+        SimplifyProcess().process_file(self.inFile, outFile, 10, True)
+        # Every tile holds two squares, so no ring needs pinned points
+        SimplifyProcess().process_file(self.inFile, tiledFile, 10, True, TileSize=20)
+
+        expected = self.read_output(outFile)
+        result = self.read_output(tiledFile)
+        assert_equal(sorted(result), sorted(expected))
+        for name, simpleShape in result.items():
+            assert simpleShape.equals_exact(expected[name], 0)
+
+    def test_geopackage_feature_ids(self):
+        # GeoPackage feature ids start at 1, not at the position of the feature
+        inFile = self.write_squares("squares.gpkg", "GPKG")
+        assert_equal(list(TileGrid.read(inFile, 20).fids), [1, 2, 3, 4, 5, 6])
+
+        outFile = os.path.join(self.directory, "whole.gpkg")
+        tiledFile = os.path.join(self.directory, "tiled.gpkg")
+        SimplifyProcess().process_file(inFile, outFile, 10, True)
+        SimplifyProcess().process_file(inFile, tiledFile, 10, True, TileSize=20)
+
+        expected = self.read_output(outFile)
+        result = self.read_output(tiledFile)
+        assert_equal(sorted(result), sorted(expected))
+        for name, simpleShape in result.items():
+            assert simpleShape.equals_exact(expected[name], 0)
+
+    def test_tile_borders_identical(self):
+        tiledFile = os.path.join(self.directory, "tiled.shp")
+        # One square per tile, the end squares have 2 junctions and get pinned points
+        SimplifyProcess().process_file(self.inFile, tiledFile, 10, True, TileSize=10)
+
+        result = self.read_output(tiledFile)
+        for index in range(5):
+            first = result[str(index)]
+            second = result[str(index + 1)]
+            border = first.exterior.intersection(second.exterior)
+            assert_true(border.length >= 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+__author__ = "asimmons"
+
+# Shapes shared by the tests that run process_file on a small mosaic
+
+import fiona
+from shapely.geometry import mapping, Polygon
+
+
+def wavy_edge(start, end):
+    # A zigzag from 'start' to 'end' (horizontal or vertical), the same for both
+    # polygons that share it
+    (x0, y0), (x1, y1) = start, end
+    points = [start]
+    for k in range(1, 5):
+        offset = (k * 7 + x0 + y0) % 3 - 1
+        if y0 == y1:
+            points.append((x0 + (x1 - x0) * k // 5, y0 + offset))
+        else:
+            points.append((x0 + offset, y0 + (y1 - y0) * k // 5))
+    return points + [end]
+
+
+def wavy_square(x, y, size=20):
+    # A square with wavy edges, its borders are identical to the ones of its neighbors
+    return Polygon(
+        wavy_edge((x, y), (x + size, y))
+        + wavy_edge((x + size, y), (x + size, y + size))[1:]
+        + wavy_edge((x, y + size), (x + size, y + size))[::-1][1:]
+        + wavy_edge((x, y), (x, y + size))[::-1][1:]
+    )
+
+
+def wavy_grid(columns=4, rows=4, size=20):
+    # A grid of wavy squares, row by row
+    return [
+        wavy_square(size * column, size * row, size)
+        for row in range(rows)
+        for column in range(columns)
+    ]
+
+
+def write_polygons(path, shapes, properties=None):
+    # Writes polygons to a shapefile, with an "id" field or the given properties
+    if properties is None:
+        properties = [{"id": index} for index in range(len(shapes))]
+    fields = {
+        name: "int" if isinstance(value, int) else "str"
+        for name, value in properties[0].items()
+    }
+    schema = {"geometry": "Polygon", "properties": fields}
+    with fiona.open(path, "w", "ESRI Shapefile", schema) as output:
+        for myShape, featureProperties in zip(shapes, properties):
+            output.write(
+                {"geometry": mapping(myShape), "properties": featureProperties}
+            )
+    return path
@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, MultiPolygon
+from featureio import read_fids
+from shapestore import batch_size
+
+
+class TileGrid(object):
+    """
+    TileGrid - splits a layer into square tiles that can be simplified one at a time.
+
+    Only the bounding box of every feature is kept in memory:
+        bounds = (N, 4) NumPy array of (minx, miny, maxx, maxy), one row per feature
+        tiles = the tile of every feature (the tile holding the center of its bounding box)
+        fids = the OGR feature id of every feature, to read it back (see read_fids)
+
+    Feature ids in the methods below are positions in the file (rows of bounds); fids
+    maps them to the ids featureio.read_by_id takes.
+
+    A tile is simplified with its own features plus two bands of neighbors (context()):
+        band 1 = features whose bounding box touches the extent of the tile's features, so
+            every feature sharing a point with the tile is there, and the junctions of the
+            tile's features are the same as in the whole layer
+        band 2 = the same around band 1, so the junctions of band 1 are exact too
+
+    Rings with only 1 or 2 junctions get artificial junctions (see
+    GeomSimplify.add_junctions_to_ring), which depend on the rings processed before them.
+    So that two tiles always cut a shared border the same way, the points such a ring
+    shares with a feature of another tile are pinned as junctions first (pinned_points()).
+    Then the artificial junctions of band 1 never land on a border of the tile.
+    """
+
+    def __init__(self, bounds, tileSize, fids=None):
+        self.bounds = bounds
+        self.tileSize = float(tileSize)
+        self.fids = np.arange(len(bounds), dtype=np.int64) if fids is None else fids
+
+        centers = np.column_stack(
+            ((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2)
+        )
+        cells = np.floor(centers / self.tileSize).astype(np.int64)
+        # One id per occupied tile, in row then column order
+        cellIds, self.tiles = np.unique(cells, axis=0, return_inverse=True)
+        self.tiles = self.tiles.reshape(-1)
+        self.tileCount = len(cellIds)
+
+    @staticmethod
+    def read(inFile, tileSize):
+        """
+        Reads the bounding box and the feature id of every feature of 'inFile'. The
+        geometries are parsed a batch at a time and not kept.
+        """
+        bounds = [np.zeros((0, 4), dtype=np.float64)]
+        fids = [np.zeros(0, dtype=np.int64)]
+        for batchFids, shapes in read_fids(inFile, batch_size):
+            bounds.append(shapely.bounds(shapes))
+            fids.append(batchFids)
+        return TileGrid(np.concatenate(bounds), tileSize, np.concatenate(fids))
+
+    def __len__(self):
+        return self.tileCount
+
+    def touching(self, featureIds):
+        """
+        Returns the ids of every feature whose bounding box touches the extent of the
+        features 'featureIds' (including those features).
+        """
+        extent = self.bounds[featureIds]
+        minx, miny = extent[:, 0].min(), extent[:, 1].min()
+        maxx, maxy = extent[:, 2].max(), extent[:, 3].max()
+        bounds = self.bounds
+        return np.flatnonzero(
+            (bounds[:, 0] <= maxx)
+            & (bounds[:, 2] >= minx)
+            & (bounds[:, 1] <= maxy)
+            & (bounds[:, 3] >= miny)
+        )
+
+    def context(self, tile):
+        """
+        Returns (featureIds, ringIds, contextIds) for 'tile': its own features, plus band
+        1, plus band 2. All three are sorted, and each holds the one before it.
+        """
+        featureIds = np.flatnonzero(self.tiles == tile)
+        ringIds = self.touching(featureIds)
+        contextIds = self.touching(ringIds)
+        return featureIds, ringIds, contextIds
+
+
+def pinned_points(simplify, shapes, shapeTiles, ringCount, dictJunctions):
+    """
+    Returns the points (keyed like GeomSimplify.quantitize) to pin as junctions in a tile.
+
+    shapes = the tile context (see TileGrid.context), the features of band 1 first
+    shapeTiles = the tile of every shape
+    ringCount = the number of shapes in band 1 (their rings get pinned)
+    dictJunctions = the junctions of 'shapes'
+
+    A point is pinned when it is on an exterior ring with 1 or 2 junctions (before any
+    artificial junctions are added) and is shared with a feature of another tile.
+    """
+    shapes = np.asarray(shapes, dtype=object)
+    shapeTiles = np.asarray(shapeTiles)
+    if len(shapes) == 0:
+        return []
+
+    # Points used by features of more than one tile
+    coords, shapeOfCoord = shapely.get_coordinates(shapes, return_index=True)
+    factor = np.asarray(simplify.quantitizationFactor, dtype=np.float64)
+    grid = np.rint(coords / factor).astype(np.int64)
+    rows = np.unique(np.column_stack((grid, shapeTiles[shapeOfCoord])), axis=0)
+    points, tileCounts = np.unique(rows[:, :2], axis=0, return_counts=True)
+    sharedPoints = {
+        (x * simplify.quantitizationFactor[0], y * simplify.quantitizationFactor[1])
+        for x, y in points[tileCounts > 1].tolist()
+    }
+    if not sharedPoints:
+        return []
+
+    pinned = []
+    for myShape in shapes[:ringCount]:
+        if isinstance(myShape, Polygon):
+            polygons = [myShape]
+        elif isinstance(myShape, MultiPolygon):
+            polygons = myShape.geoms
+        else:
+            continue
+        for polygon in polygons:
+            ringPoints = polygon.exterior.coords
+            junctionCount = simplify.count_junctions_in_points_list(
+                ringPoints, dictJunctions
+            )
+            if junctionCount > 0 and junctionCount < 3:
+                for point in ringPoints:
+                    quant_point = simplify.quantitize(point)
+                    if quant_point in sharedPoints and quant_point not in dictJunctions:
+                        pinned.append(quant_point)
+
+    return pinned
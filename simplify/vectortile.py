@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+__author__ = "asimmons"
+
+import struct
+import numpy as np
+import shapely
+
+# Mapbox Vector Tile geometry types
+# https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+
+# Geometry commands
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_64BIT = 1
+WIRE_LENGTH = 2
+
+
+def write_varint(buffer, value):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def write_key(buffer, field, wireType):
+    write_varint(buffer, (field << 3) | wireType)
+
+
+def write_bytes(buffer, field, data):
+    write_key(buffer, field, WIRE_LENGTH)
+    write_varint(buffer, len(data))
+    buffer.extend(data)
+
+
+def write_packed(buffer, field, values):
+    packed = bytearray()
+    for value in values:
+        write_varint(packed, value)
+    write_bytes(buffer, field, packed)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def command(commandId, count):
+    return (commandId & 0x7) | (count << 3)
+
+
+class VectorTile(object):
+    """
+    VectorTile - writes one tile in the Mapbox Vector Tile format (protobuf, version 2).
+
+    Only lines and polygons are supported, which is all the simplify tools produce.
+    Geometries must already be in tile coordinates (0 to extent, y pointing down); they
+    are rounded to the integer grid, and rings or lines that collapse are dropped.
+    """
+
+    def __init__(self, extent=4096):
+        self.extent = extent
+        self.layers = []
+
+    def add_layer(self, name, geometries, properties, ids=None):
+        """
+        Adds a layer with one feature per geometry (None and empty geometries are skipped).
+
+        'properties' is a list with a dictionary of attributes for every geometry, and 'ids'
+        optional feature ids.
+        """
+        keys = {}
+        values = {}
+        features = []
+
+        for index, geometry in enumerate(geometries):
+            if geometry is None or geometry.is_empty:
+                continue
+            geomType, commands = self.encode_geometry(geometry)
+            if not commands:
+                continue
+
+            tags = []
+            for key, value in properties[index].items():
+                encoded = self.encode_value(value)
+                if encoded is None:
+                    continue
+                tags.append(keys.setdefault(key, len(keys)))
+                tags.append(values.setdefault(encoded, len(values)))
+
+            feature = bytearray()
+            if ids is not None:
+                write_key(feature, 1, WIRE_VARINT)
+                write_varint(feature, int(ids[index]))
+            if tags:
+                write_packed(feature, 2, tags)
+            write_key(feature, 3, WIRE_VARINT)
+            write_varint(feature, geomType)
+            write_packed(feature, 4, commands)
+            features.append(feature)
+
+        if not features:
+            return False
+
+        layer = bytearray()
+        write_key(layer, 15, WIRE_VARINT)
+        write_varint(layer, 2)
+        write_bytes(layer, 1, name.encode("utf-8"))
+        for feature in features:
+            write_bytes(layer, 2, feature)
+        for key in keys:
+            write_bytes(layer, 3, key.encode("utf-8"))
+        for value in values:
+            write_bytes(layer, 4, value)
+        write_key(layer, 5, WIRE_VARINT)
+        write_varint(layer, self.extent)
+        self.layers.append(layer)
+        return True
+
+    def encode(self):
+        """
+        Returns the tile as bytes (not compressed).
+        """
+        tile = bytearray()
+        for layer in self.layers:
+            write_bytes(tile, 3, layer)
+        return bytes(tile)
+
+    @staticmethod
+    def encode_value(value):
+        """
+        Returns the protobuf Value message for an attribute, or None for null values.
+        """
+        encoded = bytearray()
+        if value is None:
+            return None
+        elif isinstance(value, bool):
+            write_key(encoded, 7, WIRE_VARINT)
+            write_varint(encoded, int(value))
+        elif isinstance(value, (int, np.integer)):
+            write_key(encoded, 6, WIRE_VARINT)
+            write_varint(encoded, zigzag(int(value)))
+        elif isinstance(value, (float, np.floating)):
+            write_key(encoded, 3, WIRE_64BIT)
+            encoded.extend(struct.pack("<d", float(value)))
+        else:
+            write_bytes(encoded, 1, str(value).encode("utf-8"))
+        return bytes(encoded)
+
+    def encode_geometry(self, geometry):
+        """
+        Returns (MVT geometry type, command integers) for a line or polygon geometry.
+        """
+        cursor = [0, 0]
+        commands = []
+        parts = shapely.get_parts(geometry)
+        if geometry.geom_type == "GeometryCollection":
+            # clipping can return mixed collections, keep the polygons if there are any
+            parts = shapely.get_parts(parts)
+        isPolygon = shapely.get_type_id(parts) == 3
+
+        if not isPolygon.any():
+            for part in parts:
+                points = self.grid_points(part.coords)
+                if len(points) >= 2:
+                    self.__append_path(commands, cursor, points, False)
+            return GEOM_LINESTRING, commands
+
+        for part in parts[isPolygon]:
+            exterior = self.grid_points(part.exterior.coords, True)
+            if len(exterior) < 3 or self.ring_area(exterior) == 0:
+                continue
+            # Exterior rings have a positive area in tile coordinates (clockwise with y
+            # pointing down), interior rings a negative one
+            if self.ring_area(exterior) < 0:
+                exterior = exterior[::-1]
+            self.__append_path(commands, cursor, exterior, True)
+
+            for interior in part.interiors:
+                points = self.grid_points(interior.coords, True)
+                if len(points) < 3 or self.ring_area(points) == 0:
+                    continue
+                if self.ring_area(points) > 0:
+                    points = points[::-1]
+                self.__append_path(commands, cursor, points, True)
+
+        return GEOM_POLYGON, commands
+
+    @staticmethod
+    def grid_points(coords, closed=False):
+        """
+        Rounds coordinates to the tile grid and drops repeated points (and, for rings,
+        the closing point).
+        """
+        points = np.rint(np.asarray(coords)[:, :2]).astype(np.int64)
+        if len(points) > 1:
+            repeated = np.all(points[1:] == points[:-1], axis=1)
+            points = points[np.concatenate(([True], ~repeated))]
+        if closed and len(points) > 1 and (points[0] == points[-1]).all():
+            points = points[:-1]
+        return points.tolist()
+
+    @staticmethod
+    def ring_area(points):
+        # Surveyor's formula (twice the signed area)
+        area = 0
+        for index in range(len(points)):
+            x1, y1 = points[index - 1]
+            x2, y2 = points[index]
+            area += x1 * y2 - x2 * y1
+        return area
+
+    @staticmethod
+    def __append_path(commands, cursor, points, closed):
+        x, y = points[0]
+        commands.append(command(CMD_MOVE_TO, 1))
+        commands.append(zigzag(x - cursor[0]))
+        commands.append(zigzag(y - cursor[1]))
+        cursor[0], cursor[1] = x, y
+
+        commands.append(command(CMD_LINE_TO, len(points) - 1))
+        for x, y in points[1:]:
+            commands.append(zigzag(x - cursor[0]))
+            commands.append(zigzag(y - cursor[1]))
+            cursor[0], cursor[1] = x, y
+
+        if closed:
+            commands.append(command(CMD_CLOSE_PATH, 1))